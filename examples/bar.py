@@ -35,15 +35,9 @@ s = tikz.get_header()
 s += tikz.get_begin_tikz(xdim=1.75, ydim=2.75, xunit='in', yunit='in')
 
 # Create the custom colors
-color_list = []
-colors = tikz.get_colors('default')
-for i in range(4):
-    # Set the color index
-    s += r'\definecolor{cust%d}{RGB}{%d,%d,%d}'%(i,
-        colors[i % len(colors)][0],
-        colors[i % len(colors)][1],
-        colors[i % len(colors)][2])
-    color_list.append('cust%d'%(i))
+registry = tikz.ColorRegistry(prefix='cust')
+color_list = registry.get_names(tikz.get_colors('default')[:4])
+s += registry.get_definitions()
 
 # 40 bars
 x_sep = 0.0
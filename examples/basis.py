@@ -20,6 +20,10 @@ for i in range(p+1):
 # of curves.
 colors = tikz.get_blue_red_colors(p+1)
 
+# The registry gives each color a name and defines it once in the document
+registry = tikz.ColorRegistry()
+color_names = registry.get_names(colors)
+
 # Create the header for the plot. Note that all the data is written to a string
 # that is then printed out to the file
 s = tikz.get_header()
@@ -28,6 +32,9 @@ s = tikz.get_header()
 # units used to specify the dimensions
 s += tikz.get_begin_tikz(xdim=2.75, ydim=2.25, xunit='in', yunit='in')
 
+# Define the colors used for the lines
+s += registry.get_definitions()
+
 # Specify any tick locations
 yticks = [-0.25, 0, 0.5, 1.0]
 
@@ -55,16 +62,11 @@ xlabel_offset = 0.15
 ylabel_offset = 0.08
 
 for icolor, N in enumerate(Nlist):
-    # Set the color index
-    s += r'\definecolor{customcolor}{RGB}{%d,%d,%d}'%(
-        colors[icolor % len(colors)][0],
-        colors[icolor % len(colors)][1],
-        colors[icolor % len(colors)][2])
-    
     # Plot the shape function values
     s += tikz.get_2d_plot(xi, N,
                           xscale=xscale, yscale=yscale,
-                          color='customcolor', line_dim='ultra thick',
+                          color=color_names[icolor % len(color_names)],
+                          line_dim='ultra thick',
                           xmin=xmin, xmax=xmax, ymin=ymin, ymax=ymax)
 
 # Plot the axes
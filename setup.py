@@ -1,4 +1,6 @@
 from setuptools import setup
 setup(name='tikzplots',
       version='0.1',
-      py_modules=['tikzplots'])
+      py_modules=['tikzplots', 'tikzbuild'],
+      install_requires=['numpy'],
+      extras_require={'split': ['pypdf']})
@@ -0,0 +1,52 @@
+import io
+
+import numpy as np
+import pytest
+
+import tikzplots as tp
+
+
+def test_nice_ticks():
+    assert tp.get_nice_ticks(0.0, 1.0) == [0.0, 0.2, 0.4, 0.6, 0.8, 1.0]
+    assert tp.get_log_ticks(0.5, 2000.0) == [1.0, 10.0, 100.0, 1000.0]
+    assert tp.get_log_ticks(-100.0, 10.0, 'symlog', 1.0) == \
+        [-100.0, -10.0, -1.0, 0.0, 1.0, 10.0]
+
+
+@pytest.mark.parametrize('vmin', [0.0, -1.0])
+def test_log_axes_nonpositive_limits(vmin):
+    fp = io.StringIO()
+    with pytest.raises(ValueError):
+        tp.get_log_ticks(vmin, 10.0)
+    with pytest.raises(ValueError):
+        tp.write_2d_axes(fp, 1.0, vmin, 0.0, 1.0, xlog=True)
+
+    # A lower limit at or below zero starts at the first positive tick
+    s = tp.get_2d_axes(vmin, 100.0, 0.0, 1.0, xlog=True,
+                       xticks=[vmin, 1.0, 10.0, 100.0])
+    assert s == tp.get_2d_axes(1.0, 100.0, 0.0, 1.0, xlog=True,
+                               xticks=[1.0, 10.0, 100.0])
+
+    # The automatic ticks are the decades up to the upper limit
+    s = tp.get_2d_axes(vmin, 500.0, 0.0, 1.0, xlog=True, xticks='auto',
+                       nticks=3)
+    assert s == tp.get_2d_axes(1.0, 500.0, 0.0, 1.0, xlog=True,
+                               xticks='auto')
+    with pytest.raises(ValueError):
+        tp.write_2d_axes(fp, vmin, vmin, 0.0, 1.0, xlog=True, xticks='auto')
+
+
+@pytest.mark.parametrize('vmin', [0.0, -1.0])
+def test_log_plot_nonpositive_limits(vmin):
+    x = np.array([0.0, 1.0, 10.0, 100.0])
+    y = np.array([1.0, 2.0, 3.0, 4.0])
+
+    # A lower limit at or below zero uses the smallest positive value
+    s = tp.get_2d_plot(x, y, xlog=True, xmin=vmin, ymin=0.0, ymax=5.0)
+    assert s == tp.get_2d_plot(x, y, xlog=True, xmin=1.0, ymin=0.0, ymax=5.0)
+    assert 'nan' not in s
+    s = tp.get_2d_scatter_plot(x, y, ylog=True, ymin=vmin, xmin=vmin)
+    assert 'nan' not in s
+
+    with pytest.raises(ValueError):
+        tp.get_2d_plot(x, y, xlog=True, xmax=vmin)
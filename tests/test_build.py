@@ -0,0 +1,110 @@
+import os
+import stat
+import sys
+
+import numpy as np
+import pytest
+
+import tikzbuild
+import tikzplots
+
+
+def get_fake_engine(tmp_path):
+    """Create an engine that copies the .tex file to the .pdf file and logs
+    the input path"""
+    engine = tmp_path / 'fakelatex'
+    engine.write_text('#!%s\n'
+                      'import os, shutil, sys\n'
+                      'name = sys.argv[-1][:-4]\n'
+                      'with open(name + ".log", "w") as fp:\n'
+                      '    fp.write(os.environ.get("TEXINPUTS", ""))\n'
+                      'shutil.copyfile(name + ".tex", name + ".pdf")\n'
+                      % sys.executable)
+    engine.chmod(engine.stat().st_mode | stat.S_IEXEC)
+    return str(engine)
+
+
+def test_duplicate_names(tmp_path):
+    docs = [('a', 'x'), ('b', 'y'), ('a', 'z')]
+    with pytest.raises(ValueError, match='a'):
+        tikzbuild.build_figures(docs, outdir=str(tmp_path),
+                                pdflatex=get_fake_engine(tmp_path))
+
+
+def test_input_path(tmp_path, monkeypatch):
+    monkeypatch.delenv('TEXINPUTS', raising=False)
+    outdir = tmp_path / 'out'
+    srcdir = tmp_path / 'src'
+    srcdir.mkdir()
+    results = tikzbuild.build_figures({'a': 'x'}, outdir=str(outdir),
+                                      pdflatex=get_fake_engine(tmp_path),
+                                      srcdir=str(srcdir))
+    assert results[0].success
+    with open(results[0].log) as fp:
+        paths = fp.read().split(os.pathsep)
+    assert paths[0] == str(srcdir)
+    assert paths[-1] == ''
+
+
+def test_cache_key_format(tmp_path):
+    cache = tikzbuild.FigureCache(str(tmp_path / 'cache'))
+    fmtdir = tmp_path / 'fmt'
+    fmtdir.mkdir()
+    fmtfile = fmtdir / (tikzplots.get_format_name('helvet') + '.fmt')
+    fmtfile.write_text('a')
+    doc = tikzplots.get_header(fmt=True) + '\\begin{document}\n'
+
+    key = cache.get_key(doc, 'pdflatex', str(fmtdir))
+    assert key == cache.get_key(doc, 'pdflatex', str(fmtdir))
+    fmtfile.write_text('ab')
+    assert key != cache.get_key(doc, 'pdflatex', str(fmtdir))
+
+
+def test_multi_figure_cache(tmp_path):
+    pytest.importorskip('pypdf')
+    engine = tmp_path / 'fakelatex'
+    engine.write_text('#!%s\n'
+                      'import sys, pypdf\n'
+                      'name = sys.argv[-1][:-4]\n'
+                      'doc = open(name + ".tex").read()\n'
+                      'writer = pypdf.PdfWriter()\n'
+                      'for i in range(doc.count("begin{tikzpicture}")):\n'
+                      '    writer.add_blank_page(72, 72)\n'
+                      'writer.write(name + ".pdf")\n' % sys.executable)
+    engine.chmod(engine.stat().st_mode | stat.S_IEXEC)
+
+    pictures = [('p%d'%(i), tikzplots.get_begin_tikz_picture() +
+                 '%% %d\n'%(i) + tikzplots.get_end_tikz_picture())
+                for i in range(3)]
+    cache = tikzbuild.FigureCache(str(tmp_path / 'cache'))
+    outdir = str(tmp_path / 'out')
+    results = tikzbuild.build_multi_figures(pictures, outdir=outdir,
+                                            pdflatex=str(engine),
+                                            cache=cache)
+    assert [r.cached for r in results] == [False]*3
+
+    pictures.append(('p3', pictures[0][1] + '% changed\n'))
+    results = tikzbuild.build_multi_figures(pictures, outdir=outdir,
+                                            pdflatex=str(engine),
+                                            cache=cache)
+    assert [r.name for r in results] == ['p0', 'p1', 'p2', 'p3']
+    assert [r.cached for r in results] == [True, True, True, False]
+    assert all(r.success for r in results)
+
+
+def test_image_cache(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    X, Y = np.meshgrid(np.linspace(0.0, 1.0, 5), np.linspace(0.0, 1.0, 5))
+    cache = tikzbuild.FigureCache(str(tmp_path / 'cache'))
+
+    cached = []
+    for F in (X + Y, X + Y, X - Y):
+        doc = (tikzplots.get_header() + '\\begin{document}\n' +
+               tikzplots.get_begin_tikz() +
+               tikzplots.get_2d_image_plot(X, Y, F, 'image.png', dpi=10) +
+               tikzplots.get_end_tikz() + '\\end{document}\n')
+        results = tikzbuild.build_figures({'a': doc}, outdir='out',
+                                          pdflatex=get_fake_engine(tmp_path),
+                                          cache=cache)
+        cached.append(results[0].cached)
+    assert cached == [False, True, False]
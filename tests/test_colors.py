@@ -0,0 +1,90 @@
+import numpy as np
+import pytest
+
+import tikzplots as tp
+
+
+def get_ref_blue_red_colors(n):
+    """The original implementation of get_blue_red_colors"""
+    red = tp.hex_to_rgb('c23616')
+    white = (255, 255, 255)
+    blue = tp.hex_to_rgb('192a56')
+
+    rgb = []
+    for i in range(n):
+        if i < n/2:
+            u = 0.75*i/(n-1)
+        else:
+            u = 0.25 + 0.75*i/(n - 1)
+
+        if u > 0.5:
+            w1 = 0.0
+            w2 = 2*(u - 0.5)
+            w3 = 1 - 2*(u - 0.5)
+        else:
+            w1 = 1 - 2*u
+            w2 = 0.0
+            w3 = 2*u
+        rgb.append((min(255, int(w1*blue[0] + w2*red[0] + w3*white[0])),
+                    min(255, int(w1*blue[1] + w2*red[1] + w3*white[1])),
+                    min(255, int(w1*blue[2] + w2*red[2] + w3*white[2]))))
+
+    return rgb
+
+
+def get_ref_colors(name):
+    """The original implementation of get_colors"""
+    if name == 'tableau20':
+        return tp.get_tableau20()
+    if name == 'blue-green':
+        hexa = ['48466d', '3d84a8', '46cdcf', 'abedd8']
+    elif name == 'orange-green':
+        hexa = ['ffba5a', 'c0ffb3', '52de97', '2c7873']
+    elif name == 'germany':
+        hexa = ['2d4059', 'ea5455', 'f07b3f', 'ffd460']
+    else:
+        hexa = ['00b894', '00cec9', '0984e3', '6c5ce7',
+                'b2bec3', 'fdcb6e', 'e17055', 'd63031',
+                'e84393', '2d3436']
+    return [tp.hex_to_rgb(h) for h in hexa]
+
+
+def test_blue_red_colors():
+    for n in range(2, 301):
+        assert tp.get_blue_red_colors(n) == get_ref_blue_red_colors(n)
+    assert len(tp.get_blue_red_colors(1)) == 1
+
+
+@pytest.mark.parametrize('name', ['tableau20', 'blue-green', 'orange-green',
+                                  'germany', 'default', 'unknown'])
+def test_colors(name):
+    assert tp.get_colors(name) == get_ref_colors(name)
+
+
+def test_colormap():
+    cmap = tp.Colormap(['000000', (100, 200, 250)], positions=[0.0, 0.5])
+    assert cmap(0.0).tolist() == [0, 0, 0]
+    assert cmap(0.25).tolist() == [50, 100, 125]
+    assert cmap([-1.0, 0.5, 2.0]).tolist() == [[0, 0, 0], [100, 200, 250],
+                                               [100, 200, 250]]
+    assert cmap(np.zeros((2, 3))).shape == (2, 3, 3)
+    assert cmap.sample(3) == [(0, 0, 0), (100, 200, 250), (100, 200, 250)]
+
+    cmap = tp.get_colormap('blue-red')
+    assert cmap.sample(3) == [tp.hex_to_rgb('192a56'), (255, 255, 255),
+                              tp.hex_to_rgb('c23616')]
+    cmap = tp.get_colormap('germany')
+    assert cmap.sample(4) == tp.get_colors('germany')
+
+
+def test_color_registry():
+    registry = tp.ColorRegistry(prefix='c')
+    assert registry.get_names([(1, 2, 3), (4, 5, 6)]) == ['c0', 'c1']
+    assert registry.get_name(np.array([1.0, 2.0, 3.0])) == 'c0'
+    assert registry.get_definitions() == (
+        '\\definecolor{c0}{RGB}{1,2,3}\n\\definecolor{c1}{RGB}{4,5,6}\n')
+
+    # Only the new colors are defined after the first definitions
+    assert registry.get_names([(4, 5, 6), (7, 8, 9)]) == ['c1', 'c2']
+    assert registry.get_definitions() == '\\definecolor{c2}{RGB}{7,8,9}\n'
+    assert registry.get_definitions() == ''
@@ -0,0 +1,214 @@
+import collections
+
+import numpy as np
+import pytest
+
+import tikzplots as tp
+
+
+def get_random_mesh(rng, n=12, nan_frac=0.0):
+    """Create a perturbed grid split into triangles along random diagonals"""
+    x, y = np.meshgrid(np.linspace(0.0, 1.0, n), np.linspace(0.0, 1.0, n))
+    h = 0.3/(n - 1)
+    x = x + h*rng.uniform(-1.0, 1.0, x.shape)
+    y = y + h*rng.uniform(-1.0, 1.0, y.shape)
+
+    tris = []
+    for j in range(n - 1):
+        for i in range(n - 1):
+            n0, n1 = j*n + i, j*n + i + 1
+            n2, n3 = (j + 1)*n + i + 1, (j + 1)*n + i
+            if rng.uniform() < 0.5:
+                tris.extend([[n0, n1, n2], [n0, n2, n3]])
+            else:
+                tris.extend([[n0, n1, n3], [n1, n2, n3]])
+
+    vals = rng.normal(size=n*n)
+    vals[rng.uniform(size=n*n) < nan_frac] = np.nan
+    return x, y, vals, np.array(tris)
+
+
+def get_segments(lines):
+    """Count the segments of a list of (X, Y) lines, independent of order"""
+    segs = collections.Counter()
+    for X, Y in lines:
+        for k in range(len(X) - 1):
+            p1 = (round(X[k], 9), round(Y[k], 9))
+            p2 = (round(X[k+1], 9), round(Y[k+1], 9))
+            segs[tuple(sorted((p1, p2)))] += 1
+    return segs
+
+
+def get_crossing(x, y, vals, n1, n2, lev):
+    if (vals[n1] < lev) == (vals[n2] < lev):
+        return None
+    u = (lev - vals[n1])/(vals[n2] - vals[n1])
+    return ((1.0 - u)*x[n1] + u*x[n2], (1.0 - u)*y[n1] + u*y[n2])
+
+
+def get_ref_tri_lines(x, y, vals, tris, lev):
+    """The contour segments found one triangle at a time"""
+    lines = []
+    for tri in tris:
+        if not np.all(np.isfinite(vals[tri])):
+            continue
+        pts = [get_crossing(x, y, vals, tri[k], tri[(k + 1) % 3], lev)
+               for k in range(3)]
+        pts = [p for p in pts if p is not None]
+        if len(pts) == 2:
+            lines.append(([pts[0][0], pts[1][0]], [pts[0][1], pts[1][1]]))
+    return lines
+
+
+def get_ref_grid_lines(X, Y, F, lev):
+    """The marching squares segments found one cell at a time"""
+    x, y, vals = X.ravel(), Y.ravel(), F.ravel()
+    ny, nx = F.shape
+    lines = []
+    for j in range(ny - 1):
+        for i in range(nx - 1):
+            n0, n1 = j*nx + i, j*nx + i + 1
+            n2, n3 = (j + 1)*nx + i + 1, (j + 1)*nx + i
+            if not np.all(np.isfinite(vals[[n0, n1, n2, n3]])):
+                continue
+            bottom = get_crossing(x, y, vals, n0, n1, lev)
+            top = get_crossing(x, y, vals, n3, n2, lev)
+            left = get_crossing(x, y, vals, n0, n3, lev)
+            right = get_crossing(x, y, vals, n1, n2, lev)
+            pts = [p for p in (bottom, top, left, right) if p is not None]
+            if len(pts) == 2:
+                pairs = [pts]
+            elif len(pts) == 4:
+                center = 0.25*np.sum(vals[[n0, n1, n2, n3]])
+                if (center >= lev) == (vals[n0] >= lev):
+                    pairs = [(bottom, right), (top, left)]
+                else:
+                    pairs = [(bottom, left), (top, right)]
+            else:
+                pairs = []
+            for p1, p2 in pairs:
+                lines.append(([p1[0], p2[0]], [p1[1], p2[1]]))
+    return lines
+
+
+@pytest.mark.parametrize('seed', range(5))
+@pytest.mark.parametrize('nan_frac', [0.0, 0.1])
+def test_tri_contour_segments(seed, nan_frac):
+    rng = np.random.default_rng(seed)
+    x, y, vals, tris = get_random_mesh(rng, nan_frac=nan_frac)
+    x, y = x.ravel(), y.ravel()
+    mesh = tp.TriMesh(x, y, tris)
+    levs = [-1.0, -0.2, 0.0, 0.5, 1.5]
+
+    level_lines = tp._get_2d_tri_contour_level_lines(
+        x, y, vals, mesh.tris, mesh.edges, mesh.tri_to_edges,
+        mesh.edge_to_tris, levs)
+    for lev, lines in zip(levs, level_lines):
+        ref = get_ref_tri_lines(x, y, vals, tris, lev)
+        assert get_segments(lines) == get_segments(ref)
+
+
+@pytest.mark.parametrize('seed', range(5))
+@pytest.mark.parametrize('nan_frac', [0.0, 0.1])
+def test_grid_contour_segments(seed, nan_frac):
+    rng = np.random.default_rng(seed)
+    X, Y, vals, tris = get_random_mesh(rng, nan_frac=nan_frac)
+    F = vals.reshape(X.shape)
+    levs = [0.3, -0.5, 0.0]
+
+    level_lines = tp._get_2d_grid_contour_level_lines(X, Y, F, levs)
+    for lev, lines in zip(levs, level_lines):
+        ref = get_ref_grid_lines(X, Y, F, lev)
+        assert get_segments(lines) == get_segments(ref)
+
+
+def test_contour_nan_node():
+    # A single NaN node used to pair the crossings of different triangles
+    n = 20
+    X, Y = np.meshgrid(np.linspace(0.0, 3.0, n), np.linspace(0.0, 3.0, n))
+    F = np.sin(3*X)*np.cos(2*Y) - 0.3
+    x, y = X.ravel(), Y.ravel()
+    quads = [[j*n + i, j*n + i + 1, (j + 1)*n + i + 1, (j + 1)*n + i]
+             for j in range(n - 1) for i in range(n - 1)]
+    mesh = tp.TriMesh.from_quads(x, y, quads)
+
+    for node in range(n*n):
+        vals = F.ravel().copy()
+        vals[node] = np.nan
+        lines = tp._get_2d_tri_contour_lines(
+            x, y, vals, mesh.tris, mesh.edges, mesh.tri_to_edges,
+            mesh.edge_to_tris, 0.0)
+        ref = get_ref_tri_lines(x, y, vals, mesh.tris, 0.0)
+        assert get_segments(lines) == get_segments(ref)
+
+        grid_lines = tp._get_2d_grid_contour_level_lines(
+            X, Y, vals.reshape(n, n), [0.0])[0]
+        for X1, Y1 in grid_lines:
+            assert np.all(np.isfinite(X1)) and np.all(np.isfinite(Y1))
+
+
+def test_contour_chains_are_connected():
+    rng = np.random.default_rng(10)
+    x, y, vals, tris = get_random_mesh(rng, n=30, nan_frac=0.05)
+    x, y = x.ravel(), y.ravel()
+    mesh = tp.TriMesh(x, y, tris)
+    lines = tp._get_2d_tri_contour_lines(
+        x, y, vals, mesh.tris, mesh.edges, mesh.tri_to_edges,
+        mesh.edge_to_tris, 0.1)
+
+    # Every segment of a chain lies within a single triangle, so it is
+    # shorter than the longest mesh edge
+    edges = mesh.edges
+    hmax = np.max(np.hypot(x[edges[:, 0]] - x[edges[:, 1]],
+                           y[edges[:, 0]] - y[edges[:, 1]]))
+    for X, Y in lines:
+        assert np.all(np.hypot(np.diff(X), np.diff(Y)) <= hmax)
+
+
+def get_even_odd_inside(px, py, polygons):
+    """Find the points inside the polygons with the even-odd rule"""
+    inside = np.zeros(len(px), dtype=bool)
+    for X, Y in polygons:
+        X, Y = np.asarray(X), np.asarray(Y)
+        x1, y1, x2, y2 = X[:-1], Y[:-1], X[1:], Y[1:]
+        crosses = (y1 > py[:, None]) != (y2 > py[:, None])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            xc = x1 + (py[:, None] - y1)*(x2 - x1)/(y2 - y1)
+        inside ^= (np.sum(crosses & (px[:, None] < xc), axis=1) % 2) == 1
+    return inside
+
+
+@pytest.mark.parametrize('seed', range(4))
+@pytest.mark.parametrize('nan_frac', [0.0, 0.15])
+def test_tri_contour_bands(seed, nan_frac):
+    rng = np.random.default_rng(seed)
+    n = 15
+    X, Y = np.meshgrid(np.linspace(0.0, 1.0, n), np.linspace(0.0, 1.0, n))
+    F = rng.normal(size=(n, n))
+    F[rng.uniform(size=(n, n)) < nan_frac] = np.nan
+    quads = [[j*n + i, j*n + i + 1, (j + 1)*n + i + 1, (j + 1)*n + i]
+             for j in range(n - 1) for i in range(n - 1)]
+    mesh = tp.TriMesh.from_quads(X.ravel(), Y.ravel(), quads)
+    levs = [-np.inf, -0.5, 0.0, 0.7, np.inf]
+    bands = tp._get_2d_tri_contour_bands(mesh.x, mesh.y, F.ravel(), mesh.tris,
+                                         mesh.edges, mesh.edge_to_tris, levs)
+
+    # Interpolate at random points on the triangles (0, 1, 2) and (0, 2, 3)
+    m = 2000
+    sx, sy = rng.uniform(0.0, 1.0, m), rng.uniform(0.0, 1.0, m)
+    i = np.minimum((sx*(n - 1)).astype(int), n - 2)
+    j = np.minimum((sy*(n - 1)).astype(int), n - 2)
+    u, w = sx*(n - 1) - i, sy*(n - 1) - j
+    f00, f10, f11, f01 = F[j, i], F[j, i + 1], F[j + 1, i + 1], F[j + 1, i]
+    lower = u >= w
+    v = np.where(lower, f00 + u*(f10 - f00) + w*(f11 - f10),
+                 f00 + w*(f01 - f00) + u*(f11 - f01))
+    finite = np.isfinite(f00) & np.isfinite(f11) & \
+        np.where(lower, np.isfinite(f10), np.isfinite(f01))
+
+    for k, polygons in enumerate(bands):
+        for X1, Y1 in polygons:
+            assert X1[0] == X1[-1] and Y1[0] == Y1[-1]
+        inside = get_even_odd_inside(sx, sy, polygons)
+        ref = finite & (v >= levs[k]) & (v < levs[k+1])
+        assert np.sum(inside != ref) == 0
@@ -0,0 +1,50 @@
+import warnings
+
+import numpy as np
+
+import tikzplots as tp
+
+
+def test_empty_axes_limits():
+    fig = tp.Figure()
+    ax = fig.add_axes(ymax=5.0)
+    log_ax = fig.add_axes(xlog=True)
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        assert ax.get_limits() == [0.0, 1.0, 0.0, 5.0]
+        assert log_ax.get_limits() == [1.0, 10.0, 0.0, 1.0]
+        fig.get_string()
+
+
+def test_figure_document():
+    fig = tp.Figure(xdim=2.0, ydim=3.0, xunit='in', yunit='in')
+    ax = fig.add_axes()
+    X, Y = np.meshgrid(np.linspace(-1.0, 1.0, 9), np.linspace(-1.0, 1.0, 7))
+    ax.contour(X, Y, X**2 + Y**2, [0.25, 0.5], lev_colors=['blue', 'red'])
+    ax.plot([0.0, 1.0], [0.0, 1.0], color=(10, 20, 30))
+    assert ax.get_limits() == [-1.0, 1.0, -1.0, 1.0]
+
+    s = fig.get_string()
+    begin = tp.get_header() + tp.get_begin_tikz(xdim=2.0, ydim=3.0,
+                                                 xunit='in', yunit='in')
+    assert s.startswith(begin)
+    assert s.endswith(tp.get_end_tikz())
+    assert s.count('\\draw[tps0]') > 0 and s.count('\\draw[tps1]') > 0
+    assert '\\definecolor{color0}{RGB}{10,20,30}' in s
+
+
+def test_symbol_styles():
+    fig = tp.Figure()
+    ax = fig.add_axes()
+    rng = np.random.default_rng(0)
+    ax.scatter(rng.uniform(size=50), rng.uniform(size=50), color='red',
+               fill_color=(0, 0, 255))
+    ax.scatter(rng.uniform(size=50), rng.uniform(size=50), mode='density')
+    ax.legend_entry(0.5, 0.5, 0.1, color='red', symbol='square',
+                    fill_color=(0, 0, 255))
+
+    s = fig.get_string()
+    assert s.count('tps0/.style={thin, color=red, fill=color0}') == 1
+    assert s.count('/.style=') == 2
+    assert s.count('\\draw[tps0]') > 10
+    assert 'fill=white' not in s
@@ -0,0 +1,168 @@
+import re
+import warnings
+import zlib
+
+import numpy as np
+import pytest
+
+import tikzplots as tp
+
+
+def read_png(filename):
+    """Read the RGBA pixels of a PNG file written by write_png"""
+    with open(filename, 'rb') as fp:
+        data = fp.read()
+    width = int.from_bytes(data[16:20], 'big')
+    height = int.from_bytes(data[20:24], 'big')
+    start = data.index(b'IDAT') + 4
+    length = int.from_bytes(data[start - 8:start - 4], 'big')
+    raw = np.frombuffer(zlib.decompress(data[start:start + length]),
+                        dtype=np.uint8)
+    return raw.reshape(height, 4*width + 1)[:, 1:].reshape(height, width, 4)
+
+
+def test_image_negative_scale(tmp_path):
+    X, Y = np.meshgrid(np.linspace(0.0, 2.0, 11), np.linspace(0.0, 1.0, 6))
+    F = X + 3*Y**2
+    files = {}
+    for xscale, yscale in [(1.0, 1.0), (-1.0, 1.0), (1.0, -1.0)]:
+        filename = str(tmp_path / ('image%g%g.png'%(xscale, yscale)))
+        s = tp.get_2d_image_plot(X, Y, F, filename, xscale=xscale,
+                                 yscale=yscale, xbase=1.0, dpi=20)
+        files[xscale, yscale] = read_png(filename)
+        assert 'width=-' not in s and 'height=-' not in s
+
+    image = files[1.0, 1.0]
+    assert np.array_equal(files[-1.0, 1.0], image[:, ::-1])
+    assert np.array_equal(files[1.0, -1.0], image[::-1])
+
+    s = tp.get_2d_image_plot(X, Y, F, str(tmp_path / 'a.png'), xscale=-1.0,
+                             xbase=1.0)
+    assert s.splitlines()[1].startswith('\\node[anchor=south west, '
+                                        'inner sep=0] at (-1.000000, 0.000000)')
+
+    with pytest.raises(ValueError):
+        tp.get_2d_image_plot(X, Y, F, str(tmp_path / 'b.png'), xscale=0.0)
+
+
+@pytest.mark.parametrize('header', [None, True, False])
+def test_csv_header(tmp_path, header):
+    filename = tmp_path / 'data.csv'
+    rows = np.arange(12, dtype=float).reshape(6, 2)
+    with open(filename, 'w') as fp:
+        if header is not False:
+            fp.write('x, y\n')
+        for row in rows:
+            fp.write('%g, %g\n'%tuple(row))
+
+    blocks = list(tp.iter_csv_blocks(str(filename), block_size=4,
+                                     header=header))
+    assert [len(b) for b in blocks] == [4, 2]
+    assert np.array_equal(np.concatenate(blocks), rows)
+    if header is not False:
+        data = np.concatenate(list(tp.iter_csv_blocks(
+            str(filename), columns=['y'], block_size=4, header=header)))
+        assert np.array_equal(data[:, 0], rows[:, 1])
+    else:
+        with pytest.raises(ValueError):
+            list(tp.iter_csv_blocks(str(filename), columns=['y']))
+
+
+def test_blocks_with_nan_block():
+    x = np.linspace(0.0, 1.0, 100)
+    y = np.sin(5*x)
+    y[20:40] = np.nan
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        s = tp.get_2d_plot(x, y, block_size=10)
+    assert s == tp.get_2d_plot(x, y)
+
+
+def get_stream_blocks(x, y, block_size):
+    for start in range(0, len(x), block_size):
+        yield x[start:start + block_size], y[start:start + block_size]
+
+
+@pytest.mark.parametrize('block_size', [1, 2, 7, 50, 1000])
+@pytest.mark.parametrize('precision', [None, 3])
+def test_stream_matches_plot(block_size, precision):
+    rng = np.random.default_rng(block_size)
+    x = np.cumsum(rng.uniform(0.0, 0.1, 300))
+    y = np.sin(x) + 0.3*rng.normal(size=300)
+    y[[50, 51, 120]] = np.nan
+    limits = dict(xmin=1.0, xmax=12.0, ymin=-1.0, ymax=1.0)
+
+    s = tp.get_2d_plot(x, y, precision=precision, **limits)
+    assert s == tp.get_2d_plot_stream(get_stream_blocks(x, y, block_size),
+                                      precision=precision, **limits)
+    assert s == tp.get_2d_plot(x, y, precision=precision,
+                               block_size=block_size, **limits)
+
+
+def test_stream_symbols():
+    # The symbols are the same, but the lines are split at the blocks
+    x = np.linspace(0.0, 1.0, 100)
+    y = x**2
+    s = tp.get_2d_plot(x, y, symbol='circle')
+    t = tp.get_2d_plot_stream(get_stream_blocks(x, y, 50), symbol='circle')
+    assert s.count('circle') == t.count('circle') == 100
+
+
+def get_bar_rectangles(s):
+    """Parse the colors and corners of the bars in a bar chart"""
+    bars = re.findall(r'color=(\w+), fill=\w+, fill opacity=0.3\] '
+                      r'\(([-.\d]+), ([-.\d]+)\) rectangle '
+                      r'\(([-.\d]+), ([-.\d]+)\);', s)
+    return [(c, tuple(float(v) for v in r)) for c, *r in bars]
+
+
+def test_bar_chart_1d():
+    s = tp.get_bar_chart([1.0, 2.0, 3.0])
+    assert s == tp.get_bar_chart(np.array([1.0, 2.0, 3.0]))
+    assert s == tp.get_bar_chart([[1.0], [2.0], [3.0]])
+    rects = get_bar_rectangles(s)
+    assert [r[1][3] for r in rects] == [1.0, 2.0, 3.0]
+    assert [np.floor(r[1][0]) for r in rects] == [1.0, 2.0, 3.0]
+
+    with pytest.raises(ValueError):
+        tp.get_bar_chart(np.ones((2, 2, 2)))
+
+
+def test_bar_chart_base():
+    # Without ymin the bars start at zero and negative bars go down
+    rects = get_bar_rectangles(tp.get_bar_chart([[2.0, -1.0]]))
+    assert [r[1][1] for r in rects] == [0.0, 0.0]
+    assert [r[1][3] for r in rects] == [2.0, -1.0]
+
+    # With ymin the bars start there and are clamped to it
+    rects = get_bar_rectangles(tp.get_bar_chart([[2.0, -1.0]], ymin=0.5))
+    assert len(rects) == 1
+    assert rects[0][1][1] == 0.5 and rects[0][1][3] == 2.0
+
+
+def test_bar_chart_missing():
+    colors = ['red', 'green', 'blue']
+    ragged = tp.get_bar_chart([[1.0, 2.0, 3.0], [4.0], [5.0, 6.0]],
+                              color_list=colors)
+    rects = get_bar_rectangles(ragged)
+    assert [c for c, r in rects] == ['red', 'green', 'blue', 'red', 'red',
+                                     'green']
+    # Each group fills the same width with its own number of bars
+    assert rects[3][1][2] - rects[3][1][0] > rects[0][1][2] - rects[0][1][0]
+
+    data = np.ma.masked_array([[1.0, 2.0], [3.0, np.nan]],
+                              mask=[[False, True], [False, False]])
+    rects = get_bar_rectangles(tp.get_bar_chart(data, color_list=colors))
+    assert [(c, r[3]) for c, r in rects] == [('red', 1.0), ('red', 3.0)]
+
+
+def test_bar_chart_stacked():
+    colors = ['red', 'green', 'blue']
+    s = tp.get_bar_chart([[1.0, 2.0, 3.0], [4.0, np.nan, 1.0]],
+                         color_list=colors, stacked=True)
+    rects = get_bar_rectangles(s)
+    assert [(c, r[1], r[3]) for c, r in rects] == [
+        ('red', 0.0, 1.0), ('green', 1.0, 3.0), ('blue', 3.0, 6.0),
+        ('red', 0.0, 4.0), ('blue', 4.0, 5.0)]
+    # The bars of a group are on top of each other
+    assert len(set((r[0], r[2]) for c, r in rects[:3])) == 1
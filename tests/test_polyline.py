@@ -0,0 +1,168 @@
+import re
+
+import numpy as np
+import pytest
+
+import tikzplots as tp
+
+
+def get_ref_intersections(x1, x2, y1, y2, xmin, xmax, ymin, ymax):
+    """Clip a single segment to the box, as in the original implementation"""
+    if not np.all(np.isfinite([x1, x2, y1, y2])):
+        return None
+
+    umin, umax = 0.0, 1.0
+    for d, v1, vmin, vmax in ((x2 - x1, x1, xmin, xmax),
+                              (y2 - y1, y1, ymin, ymax)):
+        if d > 0.0:
+            umin = max(umin, (vmin - v1)/d)
+            umax = min(umax, (vmax - v1)/d)
+        elif d < 0.0:
+            umin = max(umin, (vmax - v1)/d)
+            umax = min(umax, (vmin - v1)/d)
+        elif v1 < vmin or v1 > vmax:
+            return None
+
+    if umin > umax:
+        return None
+    return umin, umax
+
+
+def check_intersections(x, y, box):
+    umin, umax, visible = tp._get_polyline_intersections(x, y, *box)
+    for i in range(len(x) - 1):
+        ref = get_ref_intersections(x[i], x[i+1], y[i], y[i+1], *box)
+        assert visible[i] == (ref is not None)
+        if ref is not None:
+            assert umin[i] == ref[0] and umax[i] == ref[1]
+
+
+@pytest.mark.parametrize('box', [(0.0, 1.0, 0.0, 1.0),
+                                 (-np.inf, np.inf, -np.inf, np.inf),
+                                 (0.0, np.inf, -np.inf, 1.0),
+                                 (0.5, 0.5, 0.0, 1.0)])
+def test_clip_edge_cases(box):
+    # Segments inside, outside, along the sides, through the corners, with
+    # zero length and with non-finite end points
+    pts = [(0.5, 0.5), (0.7, 0.2), (2.0, 2.0), (3.0, 2.0), (0.0, 0.0),
+           (0.0, 1.0), (1.0, 1.0), (1.0, 1.0), (-1.0, 0.0), (0.0, -1.0),
+           (1.0, 2.0), (2.0, 1.0), (0.5, -1.0), (0.5, 2.0), (-1.0, 0.5),
+           (2.0, 0.5), (np.nan, 0.5), (0.5, 0.5), (np.inf, 0.5), (0.3, 0.3),
+           (1.0, 0.0), (1.0, 1.0), (1.0 + 1e-12, 0.5), (0.5, 0.5)]
+    x = np.array([p[0] for p in pts])
+    y = np.array([p[1] for p in pts])
+    check_intersections(x, y, box)
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_clip_random(seed):
+    rng = np.random.default_rng(seed)
+    x = rng.uniform(-1.0, 2.0, 500)
+    y = rng.uniform(-1.0, 2.0, 500)
+    x[rng.uniform(size=500) < 0.2] = 0.0
+    y[rng.uniform(size=500) < 0.2] = 1.0
+    check_intersections(x, y, (0.0, 1.0, 0.0, 1.0))
+
+
+def test_clipped_plot_inside_box():
+    rng = np.random.default_rng(0)
+    x = np.cumsum(rng.normal(size=200))
+    y = np.cumsum(rng.normal(size=200))
+    s = tp.get_2d_plot(x, y, xmin=-2.0, xmax=3.0, ymin=-1.0, ymax=4.0,
+                       precision=6)
+    pts = np.array(re.findall(r'\(([-.\de]+), ?([-.\de]+)\)', s),
+                   dtype=float)
+    assert len(pts) > 0
+    assert np.all(pts[:, 0] >= -2.0 - 1e-6) and np.all(pts[:, 0] <= 3.0 + 1e-6)
+    assert np.all(pts[:, 1] >= -1.0 - 1e-6) and np.all(pts[:, 1] <= 4.0 + 1e-6)
+
+    assert tp.get_2d_plot(x, y, xmin=100.0, xmax=101.0, ymin=0.0,
+                          ymax=1.0) == ''
+
+
+def get_ref_simplify(px, py, tolerance, start, end, keep, depth=0):
+    """
+    The recursive Douglas-Peucker algorithm, which splits in the middle
+    half of the interval after 2*log2(n) levels and keeps all the points
+    after 4*log2(n) levels
+    """
+    max_depth = 4*int(np.ceil(np.log2(len(px))))
+    keep[start] = keep[end] = True
+    if end - start < 2:
+        return
+    if depth == max_depth:
+        keep[start:end] = True
+        return
+    lo, hi = start + 0.25*(end - start), end - 0.25*(end - start)
+    dx, dy = px[end] - px[start], py[end] - py[start]
+    length2 = dx**2 + dy**2
+    dmax, imax = -1.0, start
+    dmid, imid = -1.0, start
+    for i in range(start + 1, end):
+        rx, ry = px[i] - px[start], py[i] - py[start]
+        t = 0.0
+        if length2 > 0.0:
+            t = min(max((rx*dx + ry*dy)/length2, 0.0), 1.0)
+        d = np.hypot(rx - t*dx, ry - t*dy)
+        if d > dmax:
+            dmax, imax = d, i
+        if lo <= i <= hi and d > dmid:
+            dmid, imid = d, i
+    if 2*depth >= max_depth and dmid > tolerance:
+        imax = imid
+    if dmax > tolerance:
+        get_ref_simplify(px, py, tolerance, start, imax, keep, depth + 1)
+        get_ref_simplify(px, py, tolerance, imax, end, keep, depth + 1)
+
+
+def get_simplify_error(px, py, keep):
+    """The largest distance from a point to the simplified line"""
+    kept = np.nonzero(keep)[0]
+    seg = np.searchsorted(kept, np.arange(len(px)), side='right') - 1
+    seg = np.minimum(seg, len(kept) - 2)
+    a, b = kept[seg], kept[seg + 1]
+    dx, dy = px[b] - px[a], py[b] - py[a]
+    rx, ry = px - px[a], py - py[a]
+    length2 = dx**2 + dy**2
+    t = np.clip((rx*dx + ry*dy)/np.where(length2 > 0.0, length2, 1.0),
+                0.0, 1.0)
+    return np.max(np.hypot(rx - t*dx, ry - t*dy))
+
+
+@pytest.mark.parametrize('seed', range(5))
+@pytest.mark.parametrize('tolerance', [0.0, 0.1, 1.0])
+def test_simplify_polyline(seed, tolerance):
+    rng = np.random.default_rng(seed)
+    n = 300
+    px = np.cumsum(rng.normal(size=n))
+    py = np.cumsum(rng.normal(size=n))
+    if seed % 2 == 1:
+        px, py = np.round(px), np.round(py)
+
+    keep = np.zeros(n, dtype=bool)
+    get_ref_simplify(px, py, tolerance, 0, n - 1, keep)
+    assert np.array_equal(tp._simplify_polyline(px, py, tolerance), keep)
+
+
+def get_deep_lines(n):
+    """Lines that make the recursive algorithm split off one point at a time"""
+    i = np.arange(n)
+    x = i/n
+    return [(x, (i % 7)/7.0),
+            (x, np.sin(0.99*np.pi*i)),
+            (x, (-1.0)**i*((n - i)/n)**3)]
+
+
+@pytest.mark.parametrize('line', range(3))
+def test_simplify_deep_polyline(line):
+    px, py = get_deep_lines(2000)[line]
+    keep = np.zeros(len(px), dtype=bool)
+    get_ref_simplify(px, py, 1e-3, 0, len(px) - 1, keep)
+    assert np.array_equal(tp._simplify_polyline(px, py, 1e-3), keep)
+
+
+def test_simplify_long_polyline():
+    # The number of passes is bounded, so long lines stay fast
+    for px, py in get_deep_lines(100000):
+        keep = tp._simplify_polyline(px, py, 1e-3)
+        assert get_simplify_error(px, py, keep) <= 1e-3
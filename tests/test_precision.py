@@ -0,0 +1,72 @@
+import re
+
+import numpy as np
+import pytest
+
+import tikzplots as tp
+
+
+@pytest.fixture
+def reset_precision():
+    yield
+    tp.set_precision(None)
+
+
+def get_path_points(s):
+    """Parse the points of a path, adding up the ++ offsets"""
+    points = []
+    for rel, x, y in re.findall(r'(\+\+)?\(([-.\de]+), ?([-.\de]+)\)', s):
+        p = np.array([float(x), float(y)])
+        if rel:
+            p += points[-1]
+        points.append(p)
+    return np.array(points)
+
+
+def test_shorten_numbers():
+    s = '(1.500000, -0.000000) -- (2.000, 10.0) -- (-0.50, 100) -- (-0, 0.)'
+    assert tp._shorten_numbers(s) == ('(1.5, 0) -- (2, 10) -- (-0.5, 100) '
+                                      '-- (0, 0)')
+    assert tp._shorten_numbers('{-0.0/20.050}') == '{0/20.05}'
+
+
+def test_precision():
+    x = [0.0, 1.5, 2.25]
+    y = [0.0, -0.0001, 1.0]
+    assert tp.get_2d_plot(x, y) == (
+        '\\draw[thick, color=black] (0.000000, 0.000000) -- '
+        '(1.500000, -0.000100) -- (2.250000, 1.000000) ;\n')
+    assert tp.get_2d_plot(x, y, precision=2) == (
+        '\\draw[thick, color=black] (0,0)--(1.5,0)--(2.25,1);\n')
+
+
+def test_set_precision(reset_precision):
+    x = [0.0, 1.5, 2.25]
+    y = [0.0, -0.0001, 1.0]
+    tp.set_precision(2)
+    assert tp.get_2d_plot(x, y) == tp.get_2d_plot(x, y, precision=2)
+    assert tp._format_number(-0.001) == '0'
+    assert tp.get_2d_plot(x, y, precision=4).count('-0.0001') == 1
+    tp.set_precision(None)
+    assert tp._format_number(-0.001) == '-0.001000'
+
+
+@pytest.mark.parametrize('precision', [None, 1, 3])
+def test_relative_positions(precision):
+    rng = np.random.default_rng(0)
+    x = np.cumsum(rng.uniform(0.0, 0.1, 2000))
+    y = np.cumsum(rng.normal(size=2000))/3.0
+    digits = 6 if precision is None else precision
+
+    s = tp.get_2d_plot(x, y, precision=precision, relative=True)
+    assert s.count('++') == len(x) - 1
+    points = get_path_points(s)
+
+    # The offsets add up to the rounded positions without accumulating
+    # the rounding errors
+    assert np.allclose(points[:, 0], np.round(x, digits), rtol=0.0,
+                       atol=1e-9)
+    assert np.allclose(points[:, 1], np.round(y, digits), rtol=0.0,
+                       atol=1e-9)
+    absolute = get_path_points(tp.get_2d_plot(x, y, precision=precision))
+    assert np.allclose(points, absolute, rtol=0.0, atol=1e-9)
@@ -0,0 +1,73 @@
+import re
+
+import numpy as np
+import pytest
+
+import tikzplots as tp
+
+
+def get_points(s):
+    return np.array(re.findall(r'\(([-.\d]+), ?([-.\d]+)\)', s), dtype=float)
+
+
+def get_first_in_cells(px, py, x0, y0, cell_size):
+    """Find the first point in each cell with a dictionary"""
+    cells = {}
+    for i, (x, y) in enumerate(zip(px, py)):
+        key = (int(np.floor((x - x0)/cell_size)),
+               int(np.floor((y - y0)/cell_size)))
+        if key not in cells:
+            cells[key] = [i, 0]
+        cells[key][1] += 1
+    return cells
+
+
+def test_scatter_cull():
+    rng = np.random.default_rng(0)
+    x = rng.normal(size=5000)
+    y = rng.normal(size=5000)
+    s = tp.get_2d_scatter_plot(x, y, xmin=-1.0, xmax=2.0, ymin=-2.0,
+                               ymax=1.0, symbol_size=0.2)
+
+    inside = (x >= -1.0) & (x <= 2.0) & (y >= -2.0) & (y <= 1.0)
+    px, py = x[inside], y[inside]
+    cells = get_first_in_cells(px, py, -1.0, -2.0, 0.2)
+    first = [i for i, count in cells.values()]
+
+    # One symbol in each cell, at the first point in the cell
+    assert s.count('circle') == len(cells)
+    centers = get_points(s)
+    assert np.allclose(centers[:, 0], px[first], atol=1e-6)
+    assert np.allclose(centers[:, 1], py[first], atol=1e-6)
+
+
+def test_scatter_density():
+    rng = np.random.default_rng(0)
+    x = rng.normal(size=5000)
+    y = rng.normal(size=5000)
+    levels = 4
+    s = tp.get_2d_scatter_plot(x, y, xmin=-1.0, xmax=2.0, ymin=-2.0,
+                               ymax=1.0, cell_size=0.5, mode='density',
+                               levels=levels)
+
+    inside = (x >= -1.0) & (x <= 2.0) & (y >= -2.0) & (y <= 1.0)
+    cells = get_first_in_cells(x[inside], y[inside], -1.0, -2.0, 0.5)
+    count_max = max(count for i, count in cells.values())
+    expected = {}
+    for (ix, iy), (i, count) in cells.items():
+        opacity = np.ceil(levels*count/count_max)/levels
+        expected[(-1.0 + 0.5*ix, -2.0 + 0.5*iy)] = opacity
+
+    # Each cell is filled once, with all the cells at a level in one path
+    found = {}
+    fills = re.findall(r'\\fill\[color=black, fill opacity=([.\d]+)\] (.*);',
+                       s)
+    assert len(fills) == len(set(expected.values()))
+    for opacity, path in fills:
+        corners = get_points(path).reshape(-1, 2, 2)
+        assert np.allclose(corners[:, 1] - corners[:, 0], 0.5)
+        for corner in corners[:, 0].tolist():
+            key = tuple(np.round(corner, 6).tolist())
+            assert key not in found
+            found[key] = float(opacity)
+    assert found == pytest.approx(expected)
@@ -0,0 +1,73 @@
+import re
+
+import numpy as np
+import pytest
+
+import tikzplots as tp
+
+symbols = ['circle', 'square', 'triangle', 'delta', 'diamond']
+
+
+def get_ref_symbols(px, py, symbol, symbol_size=0.15, symbol_dim='thin',
+                    color='black', fill_color='white'):
+    """Draw the symbols one at a time, as in the original implementation"""
+    s = ''
+    h = 0.5*symbol_size
+    head = r'\draw[%s, color=%s, fill=%s] '%(symbol_dim, color, fill_color)
+    for x, y in zip(px, py):
+        if symbol == 'circle':
+            s += head + '(%f, %f) circle (%g);'%(x, y, h)
+        elif symbol == 'square':
+            s += head + '(%f, %f) rectangle (%f, %f);'%(
+                x - h, y - h, x + h, y + h)
+        elif symbol == 'triangle':
+            s += head + '(%f,%f) -- (%f,%f) -- (%f,%f) -- cycle;\n'%(
+                x - 0.45*symbol_size, y - h, x + 0.45*symbol_size, y - h,
+                x, y + h)
+        elif symbol == 'delta':
+            s += head + '(%f,%f) -- (%f,%f) -- (%f,%f) -- cycle;\n'%(
+                x - 0.45*symbol_size, y + h, x + 0.45*symbol_size, y + h,
+                x, y - h)
+        elif symbol == 'diamond':
+            s += head + ('(%f,%f) -- (%f,%f) -- (%f,%f) -- (%f,%f) '
+                         '-- cycle;\n')%(x - h, y, x, y - h, x + h, y, x, y + h)
+    return s
+
+
+def get_points(s):
+    return np.array(re.findall(r'\(([-.\d]+), ?([-.\d]+)\)', s), dtype=float)
+
+
+@pytest.mark.parametrize('symbol', symbols)
+def test_symbols_draw(symbol):
+    rng = np.random.default_rng(0)
+    px = rng.uniform(-5.0, 5.0, 100)
+    py = rng.uniform(-5.0, 5.0, 100)
+    s = tp._get_string(tp._write_symbols, px, py, symbol)
+    assert s == get_ref_symbols(px, py, symbol)
+
+
+@pytest.mark.parametrize('symbol', symbols)
+def test_symbols_foreach(symbol):
+    rng = np.random.default_rng(1)
+    px = rng.uniform(-5.0, 5.0, 100)
+    py = rng.uniform(-5.0, 5.0, 100)
+    s = tp._get_string(tp._write_symbols, px, py, symbol, color='red',
+                       symbol_mode='foreach')
+    m = re.match(r'\\foreach \\px/\\py in \{(.*)\}\{\\draw\[(.*), '
+                 r'shift=\{\(\\px,\\py\)\}\] (.*);\}\n$', s)
+    assert m is not None
+    points, style, shape = m.groups()
+    assert style == 'thin, color=red, fill=white'
+    points = np.array([p.split('/') for p in points.split(',')], dtype=float)
+    assert np.allclose(points, np.column_stack((px, py)), atol=1e-6)
+
+    # The shape about the origin shifted to each point gives the same
+    # symbols as the draw mode
+    draw = tp._get_string(tp._write_symbols, px, py, symbol)
+    offsets = get_points(shape)
+    if symbol == 'circle':
+        assert shape.endswith('circle (0.075)')
+    expected = get_points(draw).reshape(len(px), len(offsets), 2)
+    shifted = points[:, np.newaxis, :] + offsets[np.newaxis, :, :]
+    assert np.allclose(shifted, expected, atol=2e-6)
@@ -0,0 +1,523 @@
+"""
+Compile the documents created with tikzplots into PDF figures.
+
+The documents are the complete strings from get_header, get_begin_tikz,
+the plotting functions and get_end_tikz. Each one is written to its own
+temporary directory and compiled with pdflatex. The files included with
+relative paths, such as the PNG images of write_2d_image_plot, are found
+in the current directory through TEXINPUTS. Several documents are
+compiled at the same time, and the PDF and log files are copied to the
+output directory.
+
+The package imports of the header can be precompiled once into a format
+file with build_format. Documents created with get_header(fmt=True) and
+compiled with build_figures(fmtdir=...) then load the format instead of
+the packages.
+
+Many small figures can also be placed in a single document with
+build_multi_figures. The preview package crops each tikzpicture to its
+own page, so the document is compiled once and the pages are split into
+one PDF per figure. This requires the pypdf package.
+
+A FigureCache can be passed to build_figures or build_multi_figures so
+that only the documents that have changed since they were last compiled
+are passed to pdflatex.
+
+The module can also be run from the command line to compile a set of
+.tex files:
+
+python -m tikzbuild -j 8 -o figures --cache .tikzcache *.tex
+"""
+
+import os
+import re
+import sys
+import time
+import hashlib
+import shutil
+import argparse
+import tempfile
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+import tikzplots
+
+class BuildResult(object):
+    """The outcome of compiling a single figure"""
+    def __init__(self, name, pdf=None, log=None, elapsed=0.0,
+                 returncode=None, cached=False):
+        self.name = name
+        self.pdf = pdf
+        self.log = log
+        self.elapsed = elapsed
+        self.returncode = returncode
+        self.cached = cached
+
+    @property
+    def success(self):
+        return self.pdf is not None
+
+    def __repr__(self):
+        return ('BuildResult(%r, pdf=%r, elapsed=%.3f, returncode=%r, '
+                'cached=%r)'%(self.name, self.pdf, self.elapsed,
+                              self.returncode, self.cached))
+
+class FigureCache(object):
+    """
+    An on-disk store of compiled figures keyed by the document contents
+
+    The key is the SHA-256 hash of the complete document string, which
+    includes the preamble and font package from get_header, together with
+    the name of the LaTeX engine. For a document that loads a format file
+    from the format directory, the modification time and size of the
+    format are included as well, so rebuilding the format invalidates the
+    figures compiled with it. When the total size of the stored PDF
+    files exceeds max_size bytes, the least recently used files are
+    removed. A hit updates the modification time of the file, which is
+    used to order the files.
+    """
+    def __init__(self, cachedir, max_size=500*1024**2):
+        self.cachedir = cachedir
+        self.max_size = max_size
+        if not os.path.isdir(cachedir):
+            os.makedirs(cachedir)
+
+    def get_key(self, doc, engine='pdflatex', fmtdir=None):
+        """Get the key for a document compiled with the engine"""
+        h = hashlib.sha256()
+        h.update(os.path.basename(engine).encode('utf-8'))
+        h.update(b'\0')
+        if fmtdir is not None and doc.startswith('%&'):
+            name = doc[2:].split('\n', 1)[0].strip()
+            try:
+                st = os.stat(os.path.join(fmtdir, name + '.fmt'))
+                h.update(('%d %d'%(st.st_mtime_ns, st.st_size)).encode('utf-8'))
+            except OSError:
+                pass
+            h.update(b'\0')
+        h.update(doc.encode('utf-8'))
+        return h.hexdigest()
+
+    def _get_path(self, key):
+        return os.path.join(self.cachedir, key + '.pdf')
+
+    def get(self, key, dest):
+        """Copy the stored PDF to dest, returning False if there is none"""
+        path = self._get_path(key)
+        try:
+            shutil.copyfile(path, dest)
+            os.utime(path, None)
+        except (IOError, OSError):
+            return False
+        return True
+
+    def put(self, key, pdf):
+        """Add a compiled PDF to the cache and evict the oldest files"""
+        path = self._get_path(key)
+        fd, tmp = tempfile.mkstemp(dir=self.cachedir, suffix='.tmp')
+        os.close(fd)
+        shutil.copyfile(pdf, tmp)
+        os.replace(tmp, path)
+        self.evict()
+
+    def evict(self):
+        """Remove the least recently used files until the cache fits"""
+        entries = []
+        total = 0
+        for fname in os.listdir(self.cachedir):
+            if not fname.endswith('.pdf'):
+                continue
+            try:
+                st = os.stat(os.path.join(self.cachedir, fname))
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, fname))
+            total += st.st_size
+
+        entries.sort()
+        for mtime, size, fname in entries:
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(os.path.join(self.cachedir, fname))
+            except OSError:
+                pass
+            total -= size
+
+def _get_documents(docs):
+    """
+    Get the list of (name, document) pairs
+
+    The names are used for the output files, so they must be unique.
+    """
+    if isinstance(docs, dict):
+        return list(docs.items())
+
+    docs = list(docs)
+    names = set()
+    duplicates = []
+    for name, doc in docs:
+        if name in names and name not in duplicates:
+            duplicates.append(name)
+        names.add(name)
+    if len(duplicates) > 0:
+        raise ValueError('The figure names must be unique, but these names '
+                         'are repeated: %s'%(', '.join(duplicates)))
+    return docs
+
+def _get_input_env(srcdir=None, env=None):
+    """
+    Get the environment that adds the source directory to the input path
+
+    The documents are compiled in a temporary directory, so the relative
+    paths of \\input and \\includegraphics are found through TEXINPUTS
+    instead. The source directory is the current directory by default.
+    """
+    if srcdir is None:
+        srcdir = os.getcwd()
+    if env is None:
+        env = os.environ
+    env = dict(env)
+    # The trailing separator keeps the default search path
+    env['TEXINPUTS'] = (os.path.abspath(srcdir) + os.pathsep +
+                        env.get('TEXINPUTS', ''))
+    return env
+
+def compile_figure(name, doc, outdir='.', pdflatex='pdflatex',
+                   timeout=None, env=None, srcdir=None):
+    """
+    Compile a single document in a temporary directory
+
+    The document is written to name.tex and compiled with pdflatex. The
+    files that the document includes with relative paths are found in
+    srcdir, which is the current directory by default. The name.pdf and
+    name.log files are copied to the output directory. Returns a
+    BuildResult with the paths of the copied files, or with pdf=None if
+    the compilation failed.
+    """
+
+    env = _get_input_env(srcdir, env)
+    result = BuildResult(name)
+    t0 = time.time()
+    with tempfile.TemporaryDirectory(prefix='tikzbuild-') as tmpdir:
+        texfile = os.path.join(tmpdir, name + '.tex')
+        with open(texfile, 'w') as fp:
+            fp.write(doc)
+
+        cmd = [pdflatex, '-interaction=nonstopmode', '-halt-on-error',
+               name + '.tex']
+        try:
+            proc = subprocess.run(cmd, cwd=tmpdir, env=env,
+                                  stdout=subprocess.DEVNULL,
+                                  stderr=subprocess.DEVNULL,
+                                  timeout=timeout)
+            result.returncode = proc.returncode
+        except subprocess.TimeoutExpired:
+            result.returncode = None
+
+        log = os.path.join(tmpdir, name + '.log')
+        if os.path.isfile(log):
+            result.log = os.path.join(outdir, name + '.log')
+            shutil.copyfile(log, result.log)
+
+        pdf = os.path.join(tmpdir, name + '.pdf')
+        if result.returncode == 0 and os.path.isfile(pdf):
+            result.pdf = os.path.join(outdir, name + '.pdf')
+            shutil.copyfile(pdf, result.pdf)
+
+    result.elapsed = time.time() - t0
+    return result
+
+def build_format(font_package='helvet', fmtdir='.', pdflatex='pdflatex',
+                 force=False):
+    """
+    Dump the package imports of the header into a format file
+
+    The format is built with the mylatexformat package and is named by
+    get_format_name(font_package). An existing format is only rebuilt
+    when force is True. Returns the path to the .fmt file.
+    """
+
+    name = tikzplots.get_format_name(font_package)
+    fmtfile = os.path.join(fmtdir, name + '.fmt')
+    if os.path.isfile(fmtfile) and not force:
+        return fmtfile
+
+    if not os.path.isdir(fmtdir):
+        os.makedirs(fmtdir)
+
+    with tempfile.TemporaryDirectory(prefix='tikzbuild-') as tmpdir:
+        with open(os.path.join(tmpdir, name + '.tex'), 'w') as fp:
+            tikzplots.write_preamble(fp, font_package=font_package)
+            fp.write('\\endofdump\n')
+
+        cmd = [pdflatex, '-ini', '-interaction=nonstopmode',
+               '-jobname=' + name, '&' + os.path.basename(pdflatex),
+               'mylatexformat.ltx', name + '.tex']
+        proc = subprocess.run(cmd, cwd=tmpdir, stdout=subprocess.PIPE,
+                              stderr=subprocess.STDOUT)
+        fmt = os.path.join(tmpdir, name + '.fmt')
+        if proc.returncode != 0 or not os.path.isfile(fmt):
+            raise RuntimeError('Failed to build the format %s:\n%s'%(
+                name, proc.stdout.decode('utf-8', 'replace')))
+        shutil.copyfile(fmt, fmtfile)
+
+    return fmtfile
+
+def _get_format_env(fmtdir):
+    """Get the environment that adds the directory to the format path"""
+    env = dict(os.environ)
+    # The trailing separator keeps the default search path
+    env['TEXFORMATS'] = os.path.abspath(fmtdir) + os.pathsep
+    return env
+
+def build_figures(docs, outdir='.', nprocs=None, pdflatex='pdflatex',
+                  timeout=None, cache=None, fmtdir=None, srcdir=None):
+    """
+    Compile a set of documents with a pool of pdflatex processes
+
+    The documents are given as a dictionary or a list of (name, document)
+    pairs, where the unique name is used for the output files. Relative
+    paths in the documents are found in srcdir, which is the current
+    directory by default. Up to nprocs
+    documents are compiled at the same time, using the number of CPUs by
+    default. If a FigureCache is given, the documents found in the cache
+    are copied from it instead of being compiled. The fmtdir is the
+    directory of the format files from build_format for the documents
+    that use them. Returns the list of
+    BuildResult objects in the same order as the documents.
+    """
+
+    docs = _get_documents(docs)
+    if not os.path.isdir(outdir):
+        os.makedirs(outdir)
+    if nprocs is None:
+        nprocs = os.cpu_count() or 1
+    env = None
+    if fmtdir is not None:
+        env = _get_format_env(fmtdir)
+
+    # Copy the figures that are already in the cache
+    results = [None]*len(docs)
+    keys = [None]*len(docs)
+    if cache is not None:
+        for i, (name, doc) in enumerate(docs):
+            t0 = time.time()
+            keys[i] = cache.get_key(doc, pdflatex, fmtdir)
+            pdf = os.path.join(outdir, name + '.pdf')
+            if cache.get(keys[i], pdf):
+                results[i] = BuildResult(name, pdf=pdf, returncode=0,
+                                         elapsed=time.time() - t0,
+                                         cached=True)
+
+    # Each worker thread waits on its own pdflatex process
+    with ThreadPoolExecutor(max_workers=max(1, nprocs)) as pool:
+        futures = [(i, pool.submit(compile_figure, name, doc, outdir=outdir,
+                                   pdflatex=pdflatex, timeout=timeout,
+                                   env=env, srcdir=srcdir))
+                   for i, (name, doc) in enumerate(docs)
+                   if results[i] is None]
+        for i, f in futures:
+            results[i] = f.result()
+            if cache is not None and results[i].success:
+                cache.put(keys[i], results[i].pdf)
+
+    return results
+
+def get_multi_figure_document(pictures, font_package='helvet', fmt=False):
+    """
+    Get a document that contains each of the pictures on its own page
+
+    The pictures are the strings from get_begin_tikz_picture, the plotting
+    functions and get_end_tikz_picture.
+    """
+    doc = [tikzplots.get_header(font_package=font_package, fmt=fmt),
+           '\\begin{document}\n']
+    for picture in pictures:
+        doc.append(picture)
+        doc.append('\n')
+    doc.append('\\end{document}\n')
+    return ''.join(doc)
+
+def split_pages(pdf, outfiles):
+    """Write each page of the PDF file to the corresponding output file"""
+    try:
+        import pypdf
+    except ImportError:
+        raise ImportError('Splitting a multi-figure document into separate '
+                          'PDF files requires the pypdf package')
+
+    reader = pypdf.PdfReader(pdf)
+    if len(reader.pages) != len(outfiles):
+        raise RuntimeError('Expected %d pages in %s but found %d'%(
+            len(outfiles), pdf, len(reader.pages)))
+
+    for page, outfile in zip(reader.pages, outfiles):
+        writer = pypdf.PdfWriter()
+        writer.add_page(page)
+        with open(outfile, 'wb') as fp:
+            writer.write(fp)
+
+def build_multi_figures(pictures, outdir='.', nprocs=None,
+                        pdflatex='pdflatex', timeout=None, fmtdir=None,
+                        font_package='helvet', group_size=None, srcdir=None,
+                        cache=None):
+    """
+    Compile many pictures in shared documents and split the pages
+
+    The pictures are given as a dictionary or a list of (name, picture)
+    pairs with unique names. They are placed in documents of up to
+    group_size pictures (all of them by default) that are compiled in
+    parallel with build_figures. Each page is then written to name.pdf in
+    the output directory. If a FigureCache is given, each picture is
+    stored under the key of a document that contains only that picture,
+    and only the pictures missing from the cache are compiled. Returns a
+    BuildResult for each picture, where the elapsed time is the compile
+    time of its document divided by the number of pictures in it.
+    """
+
+    pictures = _get_documents(pictures)
+    if not os.path.isdir(outdir):
+        os.makedirs(outdir)
+
+    # Copy the pictures that are already in the cache
+    cached = {}
+    keys = {}
+    if cache is not None:
+        for name, picture in pictures:
+            t0 = time.time()
+            doc = get_multi_figure_document([picture],
+                                            font_package=font_package,
+                                            fmt=fmtdir is not None)
+            keys[name] = cache.get_key(doc, pdflatex, fmtdir)
+            pdf = os.path.join(outdir, name + '.pdf')
+            if cache.get(keys[name], pdf):
+                cached[name] = BuildResult(name, pdf=pdf, returncode=0,
+                                           elapsed=time.time() - t0,
+                                           cached=True)
+
+    all_pictures = pictures
+    pictures = [(name, picture) for name, picture in pictures
+                if name not in cached]
+    if group_size is None:
+        group_size = max(1, len(pictures))
+
+    groups = [pictures[i:i + group_size]
+              for i in range(0, len(pictures), group_size)]
+    docs = [('figures%d'%(k), get_multi_figure_document(
+        [picture for name, picture in group], font_package=font_package,
+        fmt=fmtdir is not None)) for k, group in enumerate(groups)]
+
+    with tempfile.TemporaryDirectory(prefix='tikzbuild-') as tmpdir:
+        doc_results = build_figures(docs, outdir=tmpdir, nprocs=nprocs,
+                                    pdflatex=pdflatex, timeout=timeout,
+                                    fmtdir=fmtdir, srcdir=srcdir)
+
+        results = cached
+        for group, r in zip(groups, doc_results):
+            log = None
+            if r.log is not None:
+                log = os.path.join(outdir, os.path.basename(r.log))
+                shutil.copyfile(r.log, log)
+
+            outfiles = None
+            if r.success:
+                outfiles = [os.path.join(outdir, name + '.pdf')
+                            for name, picture in group]
+                split_pages(r.pdf, outfiles)
+                if cache is not None:
+                    for (name, picture), pdf in zip(group, outfiles):
+                        cache.put(keys[name], pdf)
+
+            for i, (name, picture) in enumerate(group):
+                results[name] = BuildResult(
+                    name, pdf=outfiles[i] if outfiles else None, log=log,
+                    elapsed=r.elapsed/len(group), returncode=r.returncode)
+
+    return [results[name] for name, picture in all_pictures]
+
+def print_timings(results, fp=sys.stdout):
+    """Print the compile time and status of each figure"""
+    total = 0.0
+    for r in results:
+        total += r.elapsed
+        if r.cached:
+            status = 'cached'
+        elif r.success:
+            status = 'ok'
+        else:
+            status = 'FAILED (see %s)'%(r.log)
+        fp.write('%-30s %8.3fs  %s\n'%(r.name, r.elapsed, status))
+    fp.write('%-30s %8.3fs\n'%('total', total))
+
+_tikzpicture = re.compile(r'\\begin\{tikzpicture\}.*?\\end\{tikzpicture\}',
+                          re.DOTALL)
+
+def main(argv=None):
+    """Compile the .tex files given on the command line"""
+    p = argparse.ArgumentParser(prog='tikzbuild',
+                                description='Compile tikzplots figures')
+    p.add_argument('files', nargs='+', help='the .tex files to compile')
+    p.add_argument('-o', '--outdir', default='.',
+                   help='the directory for the PDF and log files')
+    p.add_argument('-j', '--nprocs', type=int, default=None,
+                   help='the number of pdflatex processes')
+    p.add_argument('--pdflatex', default='pdflatex',
+                   help='the pdflatex executable')
+    p.add_argument('--timeout', type=float, default=None,
+                   help='the time limit for each figure in seconds')
+    p.add_argument('--fmtdir', default=None,
+                   help='the directory of the precompiled header formats')
+    p.add_argument('--build-format', default=None, metavar='FONT_PACKAGE',
+                   help='build the header format for the font package first')
+    p.add_argument('--multi', action='store_true',
+                   help='compile the tikzpictures of the files in one '
+                   'document with the default header and split the pages '
+                   '(requires pypdf)')
+    p.add_argument('--cache', default=None,
+                   help='the directory used to cache the compiled figures')
+    p.add_argument('--cache-size', type=float, default=500.0,
+                   help='the maximum size of the cache in MB')
+    args = p.parse_args(argv)
+
+    docs = []
+    for fname in args.files:
+        name = os.path.splitext(os.path.basename(fname))[0]
+        with open(fname, 'r') as fp:
+            docs.append((name, fp.read()))
+
+    fmtdir = args.fmtdir
+    if args.build_format is not None:
+        if fmtdir is None:
+            fmtdir = args.outdir
+        build_format(args.build_format, fmtdir=fmtdir,
+                     pdflatex=args.pdflatex)
+
+    cache = None
+    if args.cache is not None:
+        cache = FigureCache(args.cache, max_size=int(args.cache_size*1024**2))
+
+    if args.multi:
+        # Extract the pictures from each of the documents
+        pictures = []
+        for name, doc in docs:
+            found = _tikzpicture.findall(doc)
+            if len(found) == 1:
+                pictures.append((name, found[0]))
+            else:
+                pictures.extend([('%s-%d'%(name, i), picture)
+                                 for i, picture in enumerate(found)])
+        results = build_multi_figures(pictures, outdir=args.outdir,
+                                      nprocs=args.nprocs,
+                                      pdflatex=args.pdflatex,
+                                      timeout=args.timeout, fmtdir=fmtdir,
+                                      cache=cache)
+    else:
+        results = build_figures(docs, outdir=args.outdir,
+                                nprocs=args.nprocs, pdflatex=args.pdflatex,
+                                timeout=args.timeout, cache=cache,
+                                fmtdir=fmtdir)
+    print_timings(results)
+    return 0 if all(r.success for r in results) else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
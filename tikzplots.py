@@ -5,49 +5,207 @@ These allow you to generate a string that contains the tikz/LaTeX
 commands that will create 2D line plots over a given domain. These can
 be customized by adding commands to the string that will generate the
 axes, title, labels etc. that may be required.
+
+Each get_* function has a write_* counterpart that takes a file-like
+object as its first argument and writes the commands to it directly.
+This avoids building large strings in memory for big figures, and the
+get_* functions are thin wrappers that return the output as a string.
 """
 
-def get_header(font_package='helvet'):
-    """Return the header file"""
-    s = '\\documentclass{article}\n'
-    s += '\\usepackage[usenames,dvipsnames]{xcolor}\n'
-    s += '\\usepackage{tikz}\n'
-    s += '\\usepackage[active,tightpage]{preview}\n'
-    s += '\\usepackage{amsmath}\n'
+import io
+import re
+import inspect
+import zlib
+import hashlib
+import functools
+import itertools
+import struct
+import numpy as np
+
+def _get_string(write_func, *args, **kwargs):
+    """Call the write function and return its output as a string"""
+    fp = io.StringIO()
+    write_func(fp, *args, **kwargs)
+    return fp.getvalue()
+
+def _get_string_signature(write_func):
+    """
+    Give a get_* wrapper the signature of its write function without the fp
+    argument, so that help() and inspect.signature show the arguments
+    """
+    sig = inspect.signature(write_func)
+    params = list(sig.parameters.values())[1:]
+
+    def decorator(get_func):
+        get_func.__signature__ = sig.replace(parameters=params)
+        return get_func
+    return decorator
+
+# The default number of decimal places for the coordinates. None uses the
+# full '%f' format.
+_precision = None
+
+# Patterns to shorten the formatted numbers in a coordinate string
+_trailing_zeros = re.compile(r'(\.\d*?)0+(?=[,)/}\s]|$)')
+_trailing_point = re.compile(r'\.(?=[,)/}\s]|$)')
+_negative_zero = re.compile(r'(?<![\d.])-0(?=[,)/}\s]|$)')
+
+def set_precision(precision=None):
+    """
+    Set the default number of decimal places used for the coordinates
+
+    With a precision, coordinates are written in their shortest form
+    (trailing zeros are removed) and the paths are written without the
+    optional spaces. Use None to restore the full '%f' output.
+    """
+    global _precision
+    _precision = precision
+
+def _shorten_numbers(s):
+    """Remove the trailing zeros from the numbers in a coordinate string"""
+    s = _trailing_zeros.sub(r'\1', s)
+    s = _trailing_point.sub('', s)
+    return _negative_zero.sub('0', s)
+
+def _get_coord_strings(vals, precision=None):
+    """
+    Format an array of numbers as a list of coordinate strings
+    """
+    vals = np.asarray(vals, dtype=float).ravel().tolist()
+    if precision is None:
+        precision = _precision
+    if precision is None:
+        return (('%f\n'*len(vals))%tuple(vals)).split('\n')[:-1]
+
+    s = (('%%.%df\n'%(precision))*len(vals))%tuple(vals)
+    return _shorten_numbers(s).split('\n')[:-1]
+
+def _format_number(val, precision=None):
+    """Format a single coordinate value"""
+    return _get_coord_strings([val], precision)[0]
+
+_format_spec = re.compile(r'%[%sdfg]')
+
+def _format_coords(fmt, args, precision=None):
+    """
+    Apply the % format to the arguments, writing the %f fields with the
+    coordinate precision
+    """
+    if precision is None:
+        precision = _precision
+    if precision is None:
+        return fmt%args
+
+    args = list(args)
+    specs = [m for m in _format_spec.findall(fmt) if m != '%%']
+    for i, spec in enumerate(specs):
+        if spec == '%f':
+            args[i] = _format_number(args[i], precision)
+    return fmt.replace('%f', '%s')%tuple(args)
+
+def _get_path_format(precision=None):
+    """
+    Get the format for a point and the separator between points in a path
+    """
+    if precision is None:
+        precision = _precision
+    if precision is None:
+        return '(%f, %f)', ' -- '
+    return '(%%.%df,%%.%df)'%(precision, precision), '--'
+
+def get_format_name(font_package='helvet'):
+    """Get the name of the precompiled format for the header"""
+    return 'tikzplots-%s'%(font_package)
+
+def write_preamble(fp, font_package='helvet'):
+    """Write the package imports of the header that can be precompiled"""
+    fp.write('\\documentclass{article}\n')
+    fp.write('\\usepackage[usenames,dvipsnames]{xcolor}\n')
+    fp.write('\\usepackage{tikz}\n')
+    fp.write('\\usepackage[active,tightpage]{preview}\n')
+    fp.write('\\usepackage{amsmath}\n')
     if font_package is not None:
-        s += '\\usepackage{%s}\n'%(font_package)
-    s += '\\usepackage{sfmath}\n'
-    s += '\\PreviewEnvironment{tikzpicture}\n'
-    s += '\\setlength\PreviewBorder{5pt}\n'
-    return s
-
-def get_begin_tikz(xdim=1.0, ydim=1.0, xunit='cm', yunit='cm',
-                   use_sf=True):
-    """Get the portion of the string that starts the figure"""
-    s = '\\begin{document}\n'
-    s += '\\begin{figure}[h]\n'
-    s += get_begin_tikz_picture(xdim=xdim, ydim=ydim, xunit=xunit, yunit=yunit,
-                                use_sf=use_sf)
-    return s
-
-def get_begin_tikz_picture(xdim=1.0, ydim=1.0, xunit='cm', yunit='cm',
-                           use_sf=True):
-    s = '\\begin{tikzpicture}[x=%f%s, y=%f%s]\n'%(
-        xdim, xunit, ydim, yunit)
-    if use_sf:
-        s += '\\sffamily\n'
-    return s
+        fp.write('\\usepackage{%s}\n'%(font_package))
+    fp.write('\\usepackage{sfmath}\n')
 
-def get_end_tikz_picture():
-    s = '\\end{tikzpicture}'
-    return s
+@_get_string_signature(write_preamble)
+def get_preamble(*args, **kwargs):
+    """Return the package imports of the header"""
+    return _get_string(write_preamble, *args, **kwargs)
+
+def write_header(fp, font_package='helvet', fmt=False):
+    """
+    Write the header file
+
+    If fmt is True (or the name of a format), the document loads the
+    preamble from a format file built with tikzbuild.build_format. The
+    first line selects the format and the package imports up to
+    \\endofdump are skipped when the format is used. Otherwise the
+    packages are loaded as usual and \\endofdump is defined to do
+    nothing, so the document also compiles without the format.
+    """
+    if fmt:
+        if fmt is True:
+            fmt = get_format_name(font_package)
+        fp.write('%%&%s\n'%(fmt))
+        # Define \endofdump without using the token, which the format skips to
+        fp.write('\\expandafter\\providecommand\\csname endofdump\\endcsname{}\n')
+    write_preamble(fp, font_package=font_package)
+    if fmt:
+        fp.write('\\endofdump\n')
+    fp.write('\\PreviewEnvironment{tikzpicture}\n')
+    fp.write('\\setlength\\PreviewBorder{5pt}\n')
+
+@_get_string_signature(write_header)
+def get_header(*args, **kwargs):
+    """Return the header file"""
+    return _get_string(write_header, *args, **kwargs)
+
+def write_begin_tikz(fp, xdim=1.0, ydim=1.0, xunit='cm', yunit='cm',
+                     use_sf=True):
+    """Write the portion of the document that starts the figure"""
+    fp.write('\\begin{document}\n')
+    fp.write('\\begin{figure}[h]\n')
+    write_begin_tikz_picture(fp, xdim=xdim, ydim=ydim, xunit=xunit, yunit=yunit,
+                             use_sf=use_sf)
+
+@_get_string_signature(write_begin_tikz)
+def get_begin_tikz(*args, **kwargs):
+    """Get the portion of the string that starts the figure"""
+    return _get_string(write_begin_tikz, *args, **kwargs)
 
-def get_end_tikz():
+def write_begin_tikz_picture(fp, xdim=1.0, ydim=1.0, xunit='cm', yunit='cm',
+                             use_sf=True):
+    """Write the start of the tikzpicture environment"""
+    fp.write('\\begin{tikzpicture}[x=%f%s, y=%f%s]\n'%(
+        xdim, xunit, ydim, yunit))
+    if use_sf:
+        fp.write('\\sffamily\n')
+
+@_get_string_signature(write_begin_tikz_picture)
+def get_begin_tikz_picture(*args, **kwargs):
+    """Get the string that starts the tikzpicture environment"""
+    return _get_string(write_begin_tikz_picture, *args, **kwargs)
+
+def write_end_tikz_picture(fp):
+    """Write the end of the tikzpicture environment"""
+    fp.write('\\end{tikzpicture}')
+
+@_get_string_signature(write_end_tikz_picture)
+def get_end_tikz_picture(*args, **kwargs):
+    """Get the string that ends the tikzpicture environment"""
+    return _get_string(write_end_tikz_picture, *args, **kwargs)
+
+def write_end_tikz(fp):
+    """Write the end of the figure and the document"""
+    write_end_tikz_picture(fp)
+    fp.write('\\end{figure}')
+    fp.write('\\end{document}')
+
+@_get_string_signature(write_end_tikz)
+def get_end_tikz(*args, **kwargs):
     """Get the final string at the end of the document"""
-    s = get_end_tikz_picture()
-    s += '\\end{figure}'
-    s += '\\end{document}'
-    return s
+    return _get_string(write_end_tikz, *args, **kwargs)
 
 def hex_to_rgb(h):
     return tuple(int(h[i:i+2], 16) for i in (0, 2, 4))
@@ -66,629 +224,2508 @@ def get_tableau20():
                  (23, 190, 207), (158, 218, 229)]
     return tableau20
 
-def get_blue_red_colors(n):
-    red = hex_to_rgb('c23616')
-    white = (255, 255, 255)
-    blue = hex_to_rgb('192a56')
-
-    rgb = []
-    for i in range(n):
-        if i < n/2:
-            u = 0.75*i/(n-1)
-        else:
-            u = 0.25 + 0.75*i/(n - 1)
+# The discrete color palettes by name
+_palettes = {
+    'blue-green': ['48466d', '3d84a8', '46cdcf', 'abedd8'],
+    'orange-green': ['ffba5a', 'c0ffb3', '52de97', '2c7873'],
+    'germany': ['2d4059', 'ea5455', 'f07b3f', 'ffd460'],
+    'default': ['00b894', '00cec9', '0984e3', '6c5ce7',
+                'b2bec3', 'fdcb6e', 'e17055', 'd63031',
+                'e84393', '2d3436']}
 
-        if u > 0.5:
-            w1 = 0.0
-            w2 = 2*(u - 0.5)
-            w3 = 1 - 2*(u - 0.5)
-        else:
-            w1 = 1 - 2*u
-            w2 = 0.0
-            w3 = 2*u
-        rgb.append((min(255, int(w1*blue[0] + w2*red[0] + w3*white[0])), 
-                    min(255, int(w1*blue[1] + w2*red[1] + w3*white[1])),
-                    min(255, int(w1*blue[2] + w2*red[2] + w3*white[2]))))
+class Colormap(object):
+    """
+    A piecewise linear map from [0, 1] to RGB colors
 
-    return rgb
+    The colors are RGB tuples with values from 0 to 255 or hex strings,
+    placed at the given positions, which are equally spaced by default.
+    """
+    def __init__(self, colors, positions=None):
+        colors = [hex_to_rgb(c) if isinstance(c, str) else c for c in colors]
+        self.colors = np.array(colors, dtype=float)
+        if positions is None:
+            positions = np.linspace(0.0, 1.0, len(self.colors))
+        self.positions = np.array(positions, dtype=float)
+
+    def __call__(self, u):
+        """Get the RGB colors at the values of u as an integer array"""
+        u = np.clip(np.asarray(u, dtype=float), self.positions[0],
+                    self.positions[-1])
+
+        # Interpolate between the colors at the ends of each interval
+        index = np.searchsorted(self.positions, u, side='right') - 1
+        index = np.clip(index, 0, len(self.positions) - 2)
+        p1 = self.positions[index]
+        p2 = self.positions[index + 1]
+        t = ((u - p1)/(p2 - p1))[..., np.newaxis]
+        rgb = (1.0 - t)*self.colors[index] + t*self.colors[index + 1]
+        return np.minimum(255, rgb.astype(int))
+
+    def sample(self, n):
+        """Get a list of n equally spaced colors"""
+        return [tuple(c) for c in self(np.linspace(0.0, 1.0, n)).tolist()]
+
+def get_colormap(name):
+    """
+    Get a colormap by name
+
+    The name can be 'blue-red' or any of the palettes from get_colors.
+    """
+    if name == 'blue-red':
+        return Colormap(['192a56', (255, 255, 255), 'c23616'])
+    return Colormap(get_colors(name))
+
+def get_blue_red_colors(n):
+    """Return n colors from blue through white to red"""
+    # Skip over the lightest colors in the middle of the map
+    i = np.arange(n)
+    m = max(n - 1, 1)
+    u = np.where(i < n/2, 0.75*i/m, 0.25 + 0.75*i/m)
+    return [tuple(c) for c in get_colormap('blue-red')(u).tolist()]
 
 def get_colors(name):
+    """Return the colors of a palette"""
     if name == 'tableau20':
         return get_tableau20()
-    if name == 'blue-green':
-        hexa = ['48466d', '3d84a8', '46cdcf', 'abedd8']
-    elif name == 'orange-green':
-        hexa = ['ffba5a', 'c0ffb3', '52de97', '2c7873']
-    elif name == 'germany':
-        hexa = ['2d4059', 'ea5455', 'f07b3f', 'ffd460']
+    return [hex_to_rgb(h) for h in _palettes.get(name, _palettes['default'])]
+
+class ColorRegistry(object):
+    """
+    The colors defined in a document
+
+    Each distinct color is given a name the first time it is used, and
+    its \\definecolor command is written once by write_definitions.
+    """
+    def __init__(self, prefix='color'):
+        self.prefix = prefix
+        self.names = {}
+        self.pending = []
+
+    def get_name(self, rgb):
+        """Get the name of an RGB color, defining it if required"""
+        rgb = tuple(int(c) for c in rgb)
+        if rgb not in self.names:
+            name = '%s%d'%(self.prefix, len(self.names))
+            self.names[rgb] = name
+            self.pending.append((name, rgb))
+        return self.names[rgb]
+
+    def get_names(self, colors):
+        """Get the names of a list of RGB colors"""
+        return [self.get_name(rgb) for rgb in colors]
+
+    def write_definitions(self, fp):
+        """Write the colors that have not been defined yet"""
+        for name, rgb in self.pending:
+            fp.write('\\definecolor{%s}{RGB}{%d,%d,%d}\n'%(
+                name, rgb[0], rgb[1], rgb[2]))
+        self.pending = []
+
+    def get_definitions(self):
+        """Get the colors that have not been defined yet"""
+        return _get_string(self.write_definitions)
+
+def _get_axis_transform(log=False, linthresh=1.0):
+    """
+    Get the function that maps the data to an axis with a log scale
+
+    With log=True the values are mapped to log10(v), and non-positive
+    values are mapped to NaN. With log='symlog' the values are mapped
+    linearly to [-1, 1] within the linear threshold and logarithmically
+    outside of it. Returns None for a linear axis.
+    """
+    if not log:
+        return None
+
+    if log == 'symlog':
+        def transform(v):
+            v = np.asarray(v, dtype=float)
+            a = np.abs(v)/linthresh
+            with np.errstate(divide='ignore', invalid='ignore'):
+                return np.where(a <= 1.0, v/linthresh,
+                                np.sign(v)*(1.0 + np.log10(a)))
     else:
-        hexa = ['00b894', '00cec9', '0984e3', '6c5ce7', 
-                'b2bec3', 'fdcb6e', 'e17055', 'd63031',
-                'e84393', '2d3436']
+        def transform(v):
+            v = np.asarray(v, dtype=float)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                return np.where(v > 0.0, np.log10(v), np.nan)
+    return transform
 
-    rgb = []
-    for h in hexa:
-        rgb.append(hex_to_rgb(h))
-    return rgb
+def _transform_limits(transform, vmin, vmax):
+    """
+    Apply the axis transformation to the limits that are specified
 
-def _get_intersections(x1, x2, y1, y2,
-                       xmin, xmax, ymin, ymax):
+    A lower limit at or below zero on a log axis is returned as None, so
+    that it is found from the smallest positive value of the data. An
+    upper limit at or below zero raises a ValueError.
+    """
+    if transform is None:
+        return vmin, vmax
+    if vmin is not None:
+        vmin = float(transform(vmin))
+        if np.isnan(vmin):
+            vmin = None
+    if vmax is not None:
+        vmax = float(transform(vmax))
+        if np.isnan(vmax):
+            raise ValueError('The upper limit of a log axis must be positive')
+    return vmin, vmax
+
+def _get_polyline_intersections(x, y, xmin, xmax, ymin, ymax):
     """
-    Get the intersection points along the line segment:
+    Get the intersection parameters for all the line segments of a polyline:
 
-    (x1, y1) + u*(x2 - x1, y2 - y1) = (xmin/xmax, ymin/ymax)
+    (x[i], y[i]) + u*(x[i+1] - x[i], y[i+1] - y[i]) = (xmin/xmax, ymin/ymax)
 
-    and sort them for convenience.
+    Returns the arrays umin/umax that bound the visible portion of each
+    segment and a mask of the segments that are visible at all. Segments
+    with non-finite end points are never visible.
     """
 
-    # Keep track of the original points
-    dx = x2 - x1
-    dy = y2 - y1
+    x1 = x[:-1]
+    y1 = y[:-1]
+    dx = x[1:] - x1
+    dy = y[1:] - y1
 
-    umin = 0.0
-    umax = 1.0
-    if dx > 0.0:
-        umin = max(umin, (xmin - x1)/dx)
-        umax = min(umax, (xmax - x1)/dx)
-    elif dx < 0.0:
-        umin = max(umin, (xmax - x1)/dx)
-        umax = min(umax, (xmin - x1)/dx)
-    else:
-        # dx = 0, be careful here..
-        if x1 < xmin or x1 > xmax:
-            return None
-
-    if dy > 0.0:
-        umin = max(umin, (ymin - y1)/dy)
-        umax = min(umax, (ymax - y1)/dy)
-    elif dy < 0.0:
-        umin = max(umin, (ymax - y1)/dy)
-        umax = min(umax, (ymin - y1)/dy)
-    else:
-        if y1 < ymin or y1 > ymax:
-            return None
+    umin = np.zeros(len(dx))
+    umax = np.ones(len(dx))
+    visible = (np.isfinite(x1) & np.isfinite(x[1:]) &
+               np.isfinite(y1) & np.isfinite(y[1:]))
 
-    if umin > umax:
-        return None
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for d, v1, vmin, vmax in ((dx, x1, xmin, xmax), (dy, y1, ymin, ymax)):
+            umin1 = (vmin - v1)/d
+            umax1 = (vmax - v1)/d
 
-    return umin, umax
+            pos = d > 0.0
+            umin[pos] = np.maximum(umin[pos], umin1[pos])
+            umax[pos] = np.minimum(umax[pos], umax1[pos])
 
-def _get_tri_edges(tri):
-    """
-    Get the edges for the triangular mesh
-    """
-    return [[tri[1], tri[2]], [tri[2], tri[0]], [tri[0], tri[1]]]
+            neg = d < 0.0
+            umin[neg] = np.maximum(umin[neg], umax1[neg])
+            umax[neg] = np.minimum(umax[neg], umin1[neg])
+
+            # d = 0, the segment is parallel to this side of the box
+            zero = d == 0.0
+            visible[zero] &= (v1[zero] >= vmin) & (v1[zero] <= vmax)
+
+    visible &= umin <= umax
+
+    return umin, umax, visible
 
 def _get_planar_tri_edges(npts, tris):
     """
     Uniquely order and create the connectivity for a planar triangular mesh
+
+    Edges are identified by sorting the (min, max) node pairs of every
+    triangle edge so that shared edges are found in O(n log n) time. The
+    edges are numbered in the order they are first encountered and are
+    oriented as they appear in the first triangle that references them.
     """
 
-    # Find the nodes associated with the triangle
-    node_to_tris = []
-    for i in range(npts):
-        node_to_tris.append([])
-
-    for index, tri in enumerate(tris):
-        node_to_tris[tri[0]].append(index)
-        node_to_tris[tri[1]].append(index)
-        node_to_tris[tri[2]].append(index)
-
-    # Assign edge numbers for each edge
-    edges = []
-    edge_to_tris = []
-    num_edges = 0
-
-    tri_to_edges = []
-    for i in range(len(tris)):
-        tri_to_edges.append([-1, -1, -1])
-
-    for tri_index, tri in enumerate(tris):
-        for e1_index, e1 in enumerate(_get_tri_edges(tri)):
-            if tri_to_edges[tri_index][e1_index] < 0:
-                match = False
-                for adj_index in node_to_tris[e1[0]]:
-                    if adj_index != tri_index:
-                        for e2_index, e2 in enumerate(_get_tri_edges(tris[adj_index])):
-                            if ((e1[0] == e2[0] and e1[1] == e2[1]) or
-                                (e1[1] == e2[0] and e1[0] == e2[1])):
-                                match = True
-                                tri_to_edges[tri_index][e1_index] = num_edges
-                                tri_to_edges[adj_index][e2_index] = num_edges
-                                edges.append((e1[0], e1[1]))
-                                edge_to_tris.append((tri_index, adj_index))
-                                num_edges += 1
-                                break
-                    if match:
-                        break
-
-                if not match:
-                    edges.append((e1[0], e1[1]))
-                    edge_to_tris.append((tri_index, -1))
-                    tri_to_edges[tri_index][e1_index] = num_edges
-                    num_edges += 1
+    tris = np.asarray(tris, dtype=int).reshape(-1, 3)
+    ntris = tris.shape[0]
+
+    # Create all the triangle edges in the order (tri, local edge)
+    e1 = tris[:, [1, 2, 0]].ravel()
+    e2 = tris[:, [2, 0, 1]].ravel()
+
+    # Find the unique edges based on the sorted node pairs
+    keys = np.minimum(e1, e2)*npts + np.maximum(e1, e2)
+    keys, first, inverse = np.unique(keys, return_index=True,
+                                     return_inverse=True)
+
+    # Renumber the edges in the order they are first encountered
+    order = np.argsort(first, kind='stable')
+    first = first[order]
+    renum = np.empty(len(order), dtype=int)
+    renum[order] = np.arange(len(order))
+    tri_to_edges = renum[inverse.ravel()].reshape(ntris, 3)
+
+    edges = np.column_stack((e1[first], e2[first]))
+
+    # Find the triangles on either side of each edge. The second triangle
+    # is the last one to reference the edge or -1 on the boundary.
+    last = np.empty(len(first), dtype=int)
+    last[tri_to_edges.ravel()] = np.arange(3*ntris)
+    edge_to_tris = np.column_stack((first//3, last//3))
+    edge_to_tris[first == last, 1] = -1
 
     return edges, tri_to_edges, edge_to_tris
 
+class TriMesh(object):
+    """
+    A planar triangular mesh that caches its edge connectivity
+
+    The mesh can be passed in place of the tris/quads argument of the
+    contour plotting functions so that plotting several fields on the same
+    mesh only computes the connectivity once.
+    """
+
+    def __init__(self, x, y, tris):
+        self.x = np.asarray(x, dtype=float)
+        self.y = np.asarray(y, dtype=float)
+        self.tris = np.asarray(tris, dtype=int).reshape(-1, 3)
+        self._edges = None
+        self._tri_to_edges = None
+        self._edge_to_tris = None
+
+    @classmethod
+    def from_quads(cls, x, y, quads):
+        """Create the mesh by splitting each quad into two triangles"""
+        quads = np.asarray(quads, dtype=int).reshape(-1, 4)
+        tris = np.empty((2*quads.shape[0], 3), dtype=int)
+        tris[::2] = quads[:, [0, 1, 2]]
+        tris[1::2] = quads[:, [0, 2, 3]]
+        return cls(x, y, tris)
+
+    def _init_edges(self):
+        if self._edges is None:
+            self._edges, self._tri_to_edges, self._edge_to_tris = \
+                _get_planar_tri_edges(len(self.x), self.tris)
+
+    @property
+    def edges(self):
+        self._init_edges()
+        return self._edges
+
+    @property
+    def tri_to_edges(self):
+        self._init_edges()
+        return self._tri_to_edges
+
+    @property
+    def edge_to_tris(self):
+        self._init_edges()
+        return self._edge_to_tris
+
+def _chain_segments(seg1, seg2, nnodes):
+    """
+    Join line segments that share end nodes into chains of nodes
+
+    A node shared by more than two segments is split into copies that each
+    join a pair of its segments. Open chains are returned first, followed
+    by closed chains that repeat their first node at the end.
+    """
+
+    seg1 = np.asarray(seg1, dtype=int)
+    seg2 = np.asarray(seg2, dtype=int)
+    nseg = len(seg1)
+
+    # Find the segments attached to each node
+    ends = np.concatenate((seg1, seg2))
+    segs = np.tile(np.arange(nseg), 2)
+    order = np.argsort(ends, kind='stable')
+    ends = ends[order]
+    segs = segs[order]
+    first = np.ones(len(ends), dtype=bool)
+    first[1:] = ends[1:] != ends[:-1]
+
+    # Give each additional pair of segments at a node its own copy of the
+    # node, numbered after the original nodes
+    index = np.arange(len(ends))
+    occurrence = index - np.maximum.accumulate(np.where(first, index, 0))
+    node_map = None
+    if np.any(occurrence >= 2):
+        copies = (occurrence >= 2) & (occurrence % 2 == 0)
+        copy_index = nnodes + np.cumsum(copies) - 1
+        node_map = np.concatenate((np.arange(nnodes), ends[copies]))
+        ends = np.where(occurrence >= 2, copy_index, ends)
+        nnodes = len(node_map)
+
+        seg_ends = np.empty(len(ends), dtype=int)
+        seg_ends[order] = ends
+        seg1 = seg_ends[:nseg]
+        seg2 = seg_ends[nseg:]
+
+        order = np.argsort(ends, kind='stable')
+        ends = ends[order]
+        segs = segs[order]
+        first = np.ones(len(ends), dtype=bool)
+        first[1:] = ends[1:] != ends[:-1]
+
+    node_to_segs = np.full((nnodes, 2), -1, dtype=int)
+    node_to_segs[ends[first], 0] = segs[first]
+    node_to_segs[ends[~first], 1] = segs[~first]
+
+    # Start from the nodes at the ends of the open chains
+    count = np.bincount(ends, minlength=nnodes)
+    start_nodes = np.nonzero(count == 1)[0].tolist()
+
+    seg1 = seg1.tolist()
+    seg2 = seg2.tolist()
+    node_to_segs = node_to_segs.tolist()
+    used = [False]*nseg
+
+    chains = []
+    for node, s in ([(n, node_to_segs[n][0]) for n in start_nodes] +
+                    [(seg1[s], s) for s in range(nseg)]):
+        if used[s]:
+            continue
+
+        chain = [node]
+        while s >= 0 and not used[s]:
+            used[s] = True
+            if seg1[s] == node:
+                node = seg2[s]
+            else:
+                node = seg1[s]
+            chain.append(node)
+
+            if node_to_segs[node][0] == s:
+                s = node_to_segs[node][1]
+            else:
+                s = node_to_segs[node][0]
+        chains.append(chain)
+
+    if node_map is not None:
+        node_map = node_map.tolist()
+        chains = [[node_map[n] for n in chain] for chain in chains]
+
+    return chains
+
+def _get_edge_level_intersections(x, y, vals, edges, levs):
+    """
+    Find the intersections of the edges with all the contour levels
+
+    The levels are sorted and each edge is binned by the range of levels
+    that it crosses. A node that lies exactly on a level is counted as above
+    it. Returns the intersected edges and the intersection points grouped by
+    level so that the entries for sorted level k are in the slice
+    bounds[k]:bounds[k+1], along with the sort order of the levels. Edges
+    with a non-finite node value do not intersect any level.
+    """
+
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    vals = np.asarray(vals, dtype=float)
+    edges = np.asarray(edges)
+
+    # NaN values are binned past the last level, so they never intersect
+    vals = np.where(np.isfinite(vals), vals, np.nan)
+
+    levs = np.asarray(levs, dtype=float)
+    lev_order = np.argsort(levs, kind='stable')
+    sorted_levs = levs[lev_order]
+
+    v1 = vals[edges[:, 0]]
+    v2 = vals[edges[:, 1]]
+    lo = np.searchsorted(sorted_levs, np.minimum(v1, v2), side='right')
+    hi = np.searchsorted(sorted_levs, np.maximum(v1, v2), side='right')
+    count = hi - lo
+
+    # Create an (edge, level) pair for every intersection, grouped by level
+    pair_edges = np.repeat(np.arange(len(edges)), count)
+    offset = np.arange(len(pair_edges)) - np.repeat(np.cumsum(count) - count, count)
+    pair_levs = np.repeat(lo, count) + offset
+
+    order = np.argsort(pair_levs, kind='stable')
+    pair_edges = pair_edges[order]
+    pair_levs = pair_levs[order]
+
+    # Compute the intersection points for all the pairs at once
+    n1 = edges[pair_edges, 0]
+    n2 = edges[pair_edges, 1]
+    u = (sorted_levs[pair_levs] - vals[n1])/(vals[n2] - vals[n1])
+    xi = (1.0 - u)*x[n1] + u*x[n2]
+    yi = (1.0 - u)*y[n1] + u*y[n2]
+
+    bounds = np.searchsorted(pair_levs, np.arange(len(levs) + 1))
+
+    return pair_edges, xi, yi, bounds, lev_order
+
+def _get_tri_level_segments(edge_to_tris, lev_edges):
+    """
+    Get the contour segments in the triangles for the intersected edges
+
+    Each intersected triangle contains a segment between the intersections
+    on two of its edges. Triangles with any other number of intersections
+    are skipped. Returns the indices into lev_edges of the two ends of each
+    segment.
+    """
+    tri_index = edge_to_tris[lev_edges].T.ravel()
+    local = np.tile(np.arange(len(lev_edges)), 2)
+    local = local[tri_index >= 0]
+    tri_index = tri_index[tri_index >= 0]
+    tri_order = np.argsort(tri_index, kind='stable')
+    local = local[tri_order]
+    tri_index = tri_index[tri_order]
+
+    _, start, count = np.unique(tri_index, return_index=True,
+                                return_counts=True)
+    start = start[count == 2]
+    return local[start], local[start + 1]
+
+def _get_finite_edge_to_tris(vals, tris, edge_to_tris):
+    """
+    Remove the triangles with a non-finite node value from edge_to_tris
+
+    The references to these triangles are replaced with -1, so that their
+    edges are treated like edges on the boundary of the mesh.
+    """
+    vals = np.asarray(vals, dtype=float)
+    edge_to_tris = np.asarray(edge_to_tris)
+    skip = ~np.all(np.isfinite(vals[np.asarray(tris)]), axis=1)
+    if not skip.any():
+        return edge_to_tris
+
+    edge_to_tris = edge_to_tris.copy()
+    edge_to_tris[(edge_to_tris >= 0) & skip[edge_to_tris]] = -1
+    return edge_to_tris
+
+def _get_2d_tri_contour_level_lines(x, y, vals, tris, edges, tri_to_edges,
+                                    edge_to_tris, levs):
+    """
+    Get the contour lines for all the levels with a single pass over the
+    mesh edges
+
+    Returns a list with one list of (X, Y) lines for each entry in levs.
+    Triangles with a non-finite node value are left out.
+    """
+
+    edge_to_tris = _get_finite_edge_to_tris(vals, tris, edge_to_tris)
+    pair_edges, xi, yi, bounds, lev_order = \
+        _get_edge_level_intersections(x, y, vals, edges, levs)
+
+    level_lines = [None]*len(levs)
+    for k in range(len(levs)):
+        # Get the intersected edges for this level in increasing order
+        lev_edges = pair_edges[bounds[k]:bounds[k+1]]
+        X = xi[bounds[k]:bounds[k+1]].tolist()
+        Y = yi[bounds[k]:bounds[k+1]].tolist()
+
+        seg1, seg2 = _get_tri_level_segments(edge_to_tris, lev_edges)
+        chains = _chain_segments(seg1, seg2, len(lev_edges))
+
+        lines = []
+        for chain in chains:
+            lines.append(([X[i] for i in chain], [Y[i] for i in chain]))
+        level_lines[lev_order[k]] = lines
+
+    return level_lines
+
+def _get_2d_grid_contour_level_lines(X, Y, F, levs):
+    """
+    Get the contour lines for all the levels on a structured grid using
+    marching squares
+
+    The grid topology is implicit: the horizontal edges are numbered first,
+    followed by the vertical edges, and the cells adjacent to each edge are
+    computed from its index. Saddle cells are resolved using the average of
+    the four corner values. Cells with a non-finite corner value are left
+    out.
+    """
+
+    F = np.asarray(F, dtype=float)
+    ny, nx = F.shape
+    x = np.asarray(X, dtype=float).ravel()
+    y = np.asarray(Y, dtype=float).ravel()
+    vals = F.ravel()
+
+    # Create the horizontal and vertical edges of the grid
+    nodes = np.arange(nx*ny).reshape(ny, nx)
+    hedges = nodes[:, :-1].ravel()
+    vedges = nodes[:-1, :].ravel()
+    nh = len(hedges)
+    edges = np.column_stack((np.concatenate((hedges, vedges)),
+                             np.concatenate((hedges + 1, vedges + nx))))
+
+    pair_edges, xi, yi, bounds, lev_order = \
+        _get_edge_level_intersections(x, y, vals, edges, levs)
+
+    # Compute the cell center values for the saddle points
+    center = 0.25*(F[:-1, :-1] + F[:-1, 1:] + F[1:, :-1] + F[1:, 1:]).ravel()
+    corner = F[:-1, :-1].ravel()
+    finite = np.isfinite(F)
+    skip = ~(finite[:-1, :-1] & finite[:-1, 1:] &
+             finite[1:, :-1] & finite[1:, 1:]).ravel()
+
+    levs = np.asarray(levs, dtype=float)
+    level_lines = [None]*len(levs)
+    for k in range(len(levs)):
+        lev = levs[lev_order[k]]
+        lev_edges = pair_edges[bounds[k]:bounds[k+1]]
+        Xk = xi[bounds[k]:bounds[k+1]].tolist()
+        Yk = yi[bounds[k]:bounds[k+1]].tolist()
+
+        # Find the cells on either side of each intersected edge. Cells are
+        # numbered j*(nx - 1) + i, edges outside the grid are set to -1.
+        horiz = lev_edges < nh
+        j = np.where(horiz, lev_edges//(nx - 1), (lev_edges - nh)//nx)
+        i = np.where(horiz, lev_edges % (nx - 1), (lev_edges - nh) % nx)
+        cell1 = np.where(horiz, (j - 1)*(nx - 1) + i, j*(nx - 1) + i - 1)
+        cell1[(horiz & (j == 0)) | (~horiz & (i == 0))] = -1
+        cell2 = j*(nx - 1) + i
+        cell2[(horiz & (j == ny - 1)) | (~horiz & (i == nx - 1))] = -1
+
+        # Order the intersections in each cell as bottom, top, left, right
+        cells = np.concatenate((cell1, cell2))
+        cells[(cells >= 0) & skip[cells]] = -1
+        local = np.tile(np.arange(len(lev_edges)), 2)
+        local = local[cells >= 0]
+        cells = cells[cells >= 0]
+        cell_order = np.lexsort((lev_edges[local], cells))
+        local = local[cell_order]
+        cells = cells[cell_order]
+
+        ucells, start, count = np.unique(cells, return_index=True,
+                                         return_counts=True)
+
+        # Cells with two intersections contain a single segment
+        start2 = start[count == 2]
+        seg1 = [local[start2]]
+        seg2 = [local[start2 + 1]]
+
+        # Saddle cells contain two segments that cut off the corners that
+        # are not connected through the cell center
+        start4 = start[count == 4]
+        cells4 = ucells[count == 4]
+        diag = (center[cells4] >= lev) == (corner[cells4] >= lev)
+        bottom = local[start4]
+        top = local[start4 + 1]
+        left = local[start4 + 2]
+        right = local[start4 + 3]
+        seg1.extend([bottom, top])
+        seg2.extend([np.where(diag, right, left), np.where(diag, left, right)])
+
+        chains = _chain_segments(np.concatenate(seg1), np.concatenate(seg2),
+                                 len(lev_edges))
+
+        lines = []
+        for chain in chains:
+            lines.append(([Xk[i] for i in chain], [Yk[i] for i in chain]))
+        level_lines[lev_order[k]] = lines
+
+    return level_lines
+
 def _get_2d_tri_contour_lines(x, y, vals, tris, edges, tri_to_edges, edge_to_tris, lev):
     """
     Get a list of the (x,y) coordinates of lines that make up a contour level
     on a contour plot
     """
+    return _get_2d_tri_contour_level_lines(x, y, vals, tris, edges, tri_to_edges,
+                                           edge_to_tris, [lev])[0]
+
+def write_2d_quad_contour_plot(fp, x, y, vals, quads, levs, lev_colors=None, line_dim='thick',
+                              xscale=1.0, xbase=0.0, yscale=1.0, ybase=0.0,
+                              xmin=None, xmax=None, ymin=None, ymax=None,
+                              tolerance=None, precision=None,
+                              xlog=False, ylog=False, linthresh=1.0):
+    """
+    Write a 2d contour plot for a set of quads
 
-    # Find all the edge intersections
-    has_intersect = []
-    intersect = []
-    for tri in tris:
-        inter = []
-        count = 0
-        for e_index, e in enumerate(_get_tri_edges(tri)):
-            if ((vals[e[1]] < lev and vals[e[0]] > lev) or
-                (vals[e[0]] < lev and vals[e[1]] > lev)):
-                u = (lev - vals[e[0]])/(vals[e[1]] - vals[e[0]])
-                xi = (1.0 - u)*x[e[0]] + u*x[e[1]]
-                yi = (1.0 - u)*y[e[0]] + u*y[e[1]]
-                inter.append((xi, yi))
-                count += 1
-            else:
-                inter.append(None)
-        intersect.append(inter)
-        if count == 2:
-            has_intersect.append(True)
-        else:
-            has_intersect.append(False)
-
-    # Now, try and find all of the lines
-    lines = []
-    for tri_index, tri in enumerate(tris):
-        if has_intersect[tri_index]:
-            # Find the intersections
-            X, Y = [], []
-
-            # Find the intersecting edges
-            tri_edges = []
-            for i, e_index in enumerate(tri_to_edges[tri_index]):
-                if intersect[tri_index][i] is not None:
-                    X.append(intersect[tri_index][i][0])
-                    Y.append(intersect[tri_index][i][1])
-                    tri_edges.append(e_index)
-
-            # We've finished plotting this triangle, move on to the next
-            has_intersect[tri_index] = False
-
-            prev_edge = tri_edges[1]
-            next_tri_index = edge_to_tris[prev_edge][0]
-            if next_tri_index == tri_index:
-                next_tri_index = edge_to_tris[prev_edge][1]
-
-            # Find the triangles associated with the intersection3
-            while next_tri_index >= 0:
-                for i, e_index in enumerate(tri_to_edges[next_tri_index]):
-                    if (e_index != prev_edge and intersect[next_tri_index][i] is not None):
-                        X.append(intersect[next_tri_index][i][0])
-                        Y.append(intersect[next_tri_index][i][1])
-                        prev_edge = e_index
-                        has_intersect[next_tri_index] = False
-
-                        next_tri_index = -1
-                        if has_intersect[edge_to_tris[prev_edge][0]]:
-                            next_tri_index = edge_to_tris[prev_edge][0]
-                        elif has_intersect[edge_to_tris[prev_edge][1]]:
-                            next_tri_index = edge_to_tris[prev_edge][1]
-                        break
-
-            prev_edge = tri_edges[0]
-            next_tri_index = edge_to_tris[prev_edge][0]
-            if next_tri_index == tri_index:
-                next_tri_index = edge_to_tris[prev_edge][1]
-
-            while next_tri_index >= 0:
-                for i, e_index in enumerate(tri_to_edges[next_tri_index]):
-                    if (e_index != prev_edge and intersect[next_tri_index][i] is not None):
-                        X.insert(0, intersect[next_tri_index][i][0])
-                        Y.insert(0, intersect[next_tri_index][i][1])
-                        prev_edge = e_index
-                        has_intersect[next_tri_index] = False
-
-                        next_tri_index = -1
-                        if has_intersect[edge_to_tris[prev_edge][0]]:
-                            next_tri_index = edge_to_tris[prev_edge][0]
-                        elif has_intersect[edge_to_tris[prev_edge][1]]:
-                            next_tri_index = edge_to_tris[prev_edge][1]
-                        break
-
-            lines.append((X, Y))
-
-    return lines
-
-def get_2d_quad_contour_plot(x, y, vals, quads, levs, lev_colors=None, line_dim='thick',
-                            xscale=1.0, xbase=0.0, yscale=1.0, ybase=0.0,
-                            xmin=None, xmax=None, ymin=None, ymax=None):
-    """
-    Create a 2d contour plot for a set of quads
-    """
-    s = ''
+    See write_2d_tri_contour_plot. The quads argument may also be a
+    TriMesh, in which case x and y are taken from the mesh and may be None.
+    """
+
+    if isinstance(quads, TriMesh):
+        mesh = quads
+    else:
+        mesh = TriMesh.from_quads(x, y, quads)
+
+    write_2d_tri_contour_plot(fp, None, None, vals, mesh, levs,
+                              lev_colors=lev_colors, line_dim=line_dim,
+                              xscale=xscale, xbase=xbase,
+                              yscale=yscale, ybase=ybase,
+                              xmin=xmin, xmax=xmax, ymin=ymin, ymax=ymax,
+                              tolerance=tolerance, precision=precision,
+                              xlog=xlog, ylog=ylog, linthresh=linthresh)
+
+@_get_string_signature(write_2d_quad_contour_plot)
+def get_2d_quad_contour_plot(*args, **kwargs):
+    """Create a 2d contour plot for a set of quads"""
+    return _get_string(write_2d_quad_contour_plot, *args, **kwargs)
+
+def write_2d_tri_contour_plot(fp, x, y, vals, tris, levs, lev_colors=None, line_dim='thick',
+                              xscale=1.0, xbase=0.0, yscale=1.0, ybase=0.0,
+                              xmin=None, xmax=None, ymin=None, ymax=None,
+                              tolerance=None, precision=None,
+                              xlog=False, ylog=False, linthresh=1.0):
+    """
+    Write a 2d contour plot for a set of triangles
+
+    The tris argument may also be a TriMesh, in which case x and y are
+    taken from the mesh and may be None.
+    """
 
     # Make sure that the levels and colors match
     if (lev_colors is None or
         (isinstance(lev_colors, list) and len(lev_colors) != len(levs))):
         lev_colors = ['black']*len(levs)
 
-    tris = []
-    for quad in quads:
-        tris.append([quad[0], quad[1], quad[2]])
-        tris.append([quad[0], quad[2], quad[3]])
+    # Build the mesh unless a TriMesh with cached connectivity is given
+    if isinstance(tris, TriMesh):
+        mesh = tris
+    else:
+        mesh = TriMesh(x, y, tris)
 
     # Get the edges and tri_to_edges/edge_to_tris data structures
-    npts = len(x)
-    edges, tri_to_edges, edge_to_tris = _get_planar_tri_edges(npts, tris)
+    x, y, tris = mesh.x, mesh.y, mesh.tris
+    edges = mesh.edges
+    tri_to_edges = mesh.tri_to_edges
+    edge_to_tris = mesh.edge_to_tris
 
-    for index, lev in enumerate(levs):
-        line_list = _get_2d_tri_contour_lines(x, y, vals, tris, edges, tri_to_edges, edge_to_tris, lev)
+    # Find the lines for all the levels in a single pass
+    level_lines = _get_2d_tri_contour_level_lines(x, y, vals, tris, edges,
+                                                  tri_to_edges, edge_to_tris, levs)
 
+    for index, line_list in enumerate(level_lines):
         for line in line_list:
-            s += get_2d_plot(line[0], line[1], xscale=xscale, xbase=xbase,
-                             yscale=yscale, ybase=ybase, line_dim=line_dim,
-                             color=lev_colors[index],
-                             xmin=xmin, xmax=xmax, ymin=ymin, ymax=ymax)
-
-    return s
-
-def get_2d_tri_contour_plot(x, y, vals, tris, levs, lev_colors=None, line_dim='thick',
-                            xscale=1.0, xbase=0.0, yscale=1.0, ybase=0.0,
-                            xmin=None, xmax=None, ymin=None, ymax=None):
+            write_2d_plot(fp, line[0], line[1], xscale=xscale, xbase=xbase,
+                          yscale=yscale, ybase=ybase, line_dim=line_dim,
+                          color=lev_colors[index],
+                          xmin=xmin, xmax=xmax, ymin=ymin, ymax=ymax,
+                          tolerance=tolerance, precision=precision,
+                          xlog=xlog, ylog=ylog, linthresh=linthresh)
+
+@_get_string_signature(write_2d_tri_contour_plot)
+def get_2d_tri_contour_plot(*args, **kwargs):
+    """Create a 2d contour plot for a set of triangles"""
+    return _get_string(write_2d_tri_contour_plot, *args, **kwargs)
+
+def write_2d_grid_contour_plot(fp, X, Y, F, levs, lev_colors=None, line_dim='thick',
+                               xscale=1.0, xbase=0.0, yscale=1.0, ybase=0.0,
+                               xmin=None, xmax=None, ymin=None, ymax=None,
+                               tolerance=None, precision=None,
+                               xlog=False, ylog=False, linthresh=1.0):
     """
-    Create a 2d contour plot for a set of triangles
+    Write a 2d contour plot for data on a structured grid
+
+    X, Y and F are 2D arrays with the same shape, for instance created with
+    np.meshgrid, and the contours are found directly from the grid cells
+    without creating a triangulation.
     """
-    s = ''
 
     # Make sure that the levels and colors match
     if (lev_colors is None or
         (isinstance(lev_colors, list) and len(lev_colors) != len(levs))):
         lev_colors = ['black']*len(levs)
 
-    # Get the edges and tri_to_edges/edge_to_tris data structures
+    # Find the lines for all the levels in a single pass
+    level_lines = _get_2d_grid_contour_level_lines(X, Y, F, levs)
+
+    for index, line_list in enumerate(level_lines):
+        for line in line_list:
+            write_2d_plot(fp, line[0], line[1], xscale=xscale, xbase=xbase,
+                          yscale=yscale, ybase=ybase, line_dim=line_dim,
+                          color=lev_colors[index],
+                          xmin=xmin, xmax=xmax, ymin=ymin, ymax=ymax,
+                          tolerance=tolerance, precision=precision,
+                          xlog=xlog, ylog=ylog, linthresh=linthresh)
+
+@_get_string_signature(write_2d_grid_contour_plot)
+def get_2d_grid_contour_plot(*args, **kwargs):
+    """Create a 2d contour plot for data on a structured grid"""
+    return _get_string(write_2d_grid_contour_plot, *args, **kwargs)
+
+def _get_2d_tri_contour_bands(x, y, vals, tris, edges, edge_to_tris, levs):
+    """
+    Get the boundaries of the filled regions between consecutive levels
+
+    The boundary of the band between the sorted levels a and b is made of
+    the contour segments at both levels and the parts of the mesh boundary
+    edges where a <= v < b. These are joined into closed polygons, so that
+    the band can be filled using the even-odd rule, with the holes left
+    unfilled. Triangles with a non-finite node value are left out, and
+    their edges become part of the boundary. Returns a list with one list
+    of (X, Y) polygons for each band.
+    """
+
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    vals = np.asarray(vals, dtype=float)
+    edges = np.asarray(edges)
+    edge_to_tris = _get_finite_edge_to_tris(vals, tris, edge_to_tris)
     npts = len(x)
-    edges, tri_to_edges, edge_to_tris = _get_planar_tri_edges(npts, tris)
 
-    for index, lev in enumerate(levs):
-        line_list = _get_2d_tri_contour_lines(x, y, vals, tris, edges, tri_to_edges, edge_to_tris, lev)
+    levs = np.sort(np.asarray(levs, dtype=float))
+    pair_edges, xi, yi, bounds, _ = \
+        _get_edge_level_intersections(x, y, vals, edges, levs)
+
+    # Get the values at the ends of the edges with a triangle on one side
+    bedges = np.nonzero(np.sum(edge_to_tris >= 0, axis=1) == 1)[0]
+    n1 = edges[bedges, 0]
+    n2 = edges[bedges, 1]
+    v1 = vals[n1]
+    v2 = vals[n2]
+
+    bands = []
+    for k in range(len(levs) - 1):
+        a, b = levs[k], levs[k+1]
+        edges_a = pair_edges[bounds[k]:bounds[k+1]]
+        edges_b = pair_edges[bounds[k+1]:bounds[k+2]]
+
+        # Number the mesh nodes first, then the intersections with each level
+        offset_a = npts
+        offset_b = npts + len(edges_a)
+        px = np.concatenate((x, xi[bounds[k]:bounds[k+2]]))
+        py = np.concatenate((y, yi[bounds[k]:bounds[k+2]]))
+
+        # Add the contour segments at both levels
+        sa1, sa2 = _get_tri_level_segments(edge_to_tris, edges_a)
+        sb1, sb2 = _get_tri_level_segments(edge_to_tris, edges_b)
+        seg1 = [sa1 + offset_a, sb1 + offset_b]
+        seg2 = [sa2 + offset_a, sb2 + offset_b]
+
+        # Each boundary edge contributes the part of the edge inside the
+        # band, which ends at a node inside the band or at an intersection
+        in1 = (v1 >= a) & (v1 < b)
+        in2 = (v2 >= a) & (v2 < b)
+        cross_a = (v1 < a) != (v2 < a)
+        cross_b = (v1 < b) != (v2 < b)
+        ia = offset_a + np.searchsorted(edges_a, bedges)
+        ib = offset_b + np.searchsorted(edges_b, bedges)
+
+        start = np.where(in1, n1, np.where(v1 < a, ia, ib))
+        end = np.where(in2, n2, np.where(v2 < a, ia, ib))
+        piece = (in1 | in2 | (cross_a & cross_b))
+        seg1.append(start[piece])
+        seg2.append(end[piece])
+
+        seg1 = np.concatenate(seg1)
+        seg2 = np.concatenate(seg2)
+        chains = _chain_segments(seg1, seg2, len(px))
+
+        polygons = []
+        for chain in chains:
+            if chain[0] != chain[-1]:
+                raise ValueError('The boundary of the band between the '
+                                 'levels %g and %g is not closed, the mesh '
+                                 'must be a planar triangulation'%(a, b))
+            polygons.append((px[chain].tolist(), py[chain].tolist()))
+        bands.append(polygons)
+
+    return bands
+
+def _write_filled_contour_bands(fp, bands, band_colors=None,
+                                xscale=1.0, xbase=0.0, yscale=1.0, ybase=0.0,
+                                xmin=None, xmax=None, ymin=None, ymax=None,
+                                fill_opacity=None, precision=None):
+    """
+    Write each band as a single path filled with the even-odd rule
 
-        for line in line_list:
-            s += get_2d_plot(line[0], line[1], xscale=xscale, xbase=xbase,
-                             yscale=yscale, ybase=ybase, line_dim=line_dim,
-                             color=lev_colors[index],
-                             xmin=xmin, xmax=xmax, ymin=ymin, ymax=ymax)
+    If any of the box limits are given, the bands are drawn in a scope
+    that clips them to the box.
+    """
+
+    if band_colors is None or len(band_colors) != len(bands):
+        band_colors = ['black!%d'%(100*(k + 1)//(len(bands) + 1))
+                       for k in range(len(bands))]
+
+    clip = not (xmin is None and xmax is None and
+                ymin is None and ymax is None)
+    if clip:
+        points = [p for band in bands for p in band]
+        xs = np.concatenate([p[0] for p in points] + [[0.0]])
+        ys = np.concatenate([p[1] for p in points] + [[0.0]])
+        if xmin is None:
+            xmin = np.min(xs)
+        if xmax is None:
+            xmax = np.max(xs)
+        if ymin is None:
+            ymin = np.min(ys)
+        if ymax is None:
+            ymax = np.max(ys)
+
+        fp.write('\\begin{scope}\n')
+        fp.write(_format_coords('\\clip (%f, %f) rectangle (%f, %f);\n', (
+            xscale*(xmin - xbase), yscale*(ymin - ybase),
+            xscale*(xmax - xbase), yscale*(ymax - ybase)), precision))
+
+    options = ''
+    if fill_opacity is not None:
+        options = ', fill opacity=%g'%(fill_opacity)
+
+    _, sep = _get_path_format(precision)
+    for polygons, color in zip(bands, band_colors):
+        if len(polygons) == 0:
+            continue
+
+        # The polygons are closed, so drop the repeated first point of each
+        # one and close it with a cycle instead
+        px = np.concatenate([p[0][:-1] for p in polygons])
+        py = np.concatenate([p[1][:-1] for p in polygons])
+        run_len = np.array([len(p[0]) - 2 for p in polygons])
+        paths = _get_polyline_strings(xscale*(px - xbase), yscale*(py - ybase),
+                                      run_len, precision=precision)
+        fp.write('\\fill[color=%s, even odd rule%s] '%(color, options))
+        fp.write(' '.join([path + sep + 'cycle' for path in paths]))
+        fp.write(';\n')
+
+    if clip:
+        fp.write('\\end{scope}\n')
+
+def write_2d_tri_filled_contour_plot(fp, x, y, vals, tris, levs,
+                                     band_colors=None,
+                                     xscale=1.0, xbase=0.0, yscale=1.0,
+                                     ybase=0.0, xmin=None, xmax=None,
+                                     ymin=None, ymax=None, fill_opacity=None,
+                                     precision=None):
+    """
+    Write a filled contour plot for a set of triangles
 
-    return s
+    The region between each pair of consecutive sorted levels is filled
+    with the corresponding entry of band_colors, so there is one color
+    fewer than the number of levels. Use -np.inf or np.inf as the first
+    or last level to fill the regions below or above the other levels.
+    The tris argument may also be a TriMesh.
+    """
+
+    if isinstance(tris, TriMesh):
+        mesh = tris
+    else:
+        mesh = TriMesh(x, y, tris)
+
+    bands = _get_2d_tri_contour_bands(mesh.x, mesh.y, vals, mesh.tris,
+                                      mesh.edges, mesh.edge_to_tris, levs)
+    _write_filled_contour_bands(fp, bands, band_colors=band_colors,
+                                xscale=xscale, xbase=xbase,
+                                yscale=yscale, ybase=ybase,
+                                xmin=xmin, xmax=xmax, ymin=ymin, ymax=ymax,
+                                fill_opacity=fill_opacity, precision=precision)
+
+@_get_string_signature(write_2d_tri_filled_contour_plot)
+def get_2d_tri_filled_contour_plot(*args, **kwargs):
+    """Create a filled contour plot for a set of triangles"""
+    return _get_string(write_2d_tri_filled_contour_plot, *args, **kwargs)
+
+def write_2d_quad_filled_contour_plot(fp, x, y, vals, quads, levs,
+                                      band_colors=None,
+                                      xscale=1.0, xbase=0.0, yscale=1.0,
+                                      ybase=0.0, xmin=None, xmax=None,
+                                      ymin=None, ymax=None, fill_opacity=None,
+                                      precision=None):
+    """
+    Write a filled contour plot for a set of quads
 
-def get_2d_plot(xvals, yvals, xscale=1.0, xbase=0.0, yscale=1.0, ybase=0.0,
-                line_dim='thick', color='black', fill_color='white',
-                xmin=None, xmax=None, ymin=None, ymax=None,
-                symbol=None, symbol_dim='thin', symbol_size=0.15):
+    See write_2d_tri_filled_contour_plot. The quads argument may also be
+    a TriMesh.
+    """
+
+    if isinstance(quads, TriMesh):
+        mesh = quads
+    else:
+        mesh = TriMesh.from_quads(x, y, quads)
+
+    write_2d_tri_filled_contour_plot(fp, None, None, vals, mesh, levs,
+                                     band_colors=band_colors,
+                                     xscale=xscale, xbase=xbase,
+                                     yscale=yscale, ybase=ybase,
+                                     xmin=xmin, xmax=xmax,
+                                     ymin=ymin, ymax=ymax,
+                                     fill_opacity=fill_opacity,
+                                     precision=precision)
+
+@_get_string_signature(write_2d_quad_filled_contour_plot)
+def get_2d_quad_filled_contour_plot(*args, **kwargs):
+    """Create a filled contour plot for a set of quads"""
+    return _get_string(write_2d_quad_filled_contour_plot, *args, **kwargs)
+
+def _simplify_polyline(px, py, tolerance):
+    """
+    Simplify a polyline using the Douglas-Peucker algorithm
+
+    The live intervals between the points that are currently kept are
+    stored as (start, end) pairs and refined at the same time, so each
+    pass visits at most n points. After 2*log2(n) passes, an interval that
+    is out of tolerance is split at the farthest point in the middle half
+    of its index range if that point is also out of tolerance, and at the
+    farthest point otherwise. Such splits shrink the intervals quickly, so
+    deep recursions such as a sawtooth finish in a few more passes. The
+    number of passes is limited to 4*log2(n), and the intervals that are
+    still live after the last pass keep all of their points. This bounds
+    the work by O(n log n) in every case. The result is the same as the
+    recursive algorithm for the lines that finish in 2*log2(n) passes, and
+    every dropped point is always within the tolerance of the new line.
+    Returns a mask of the points to keep. Non-finite points and their
+    neighbors are always kept so that gaps in the line are preserved.
+    """
+
+    n = len(px)
+    keep = np.zeros(n, dtype=bool)
+    if n <= 2:
+        keep[:] = True
+        return keep
+
+    keep[0] = True
+    keep[-1] = True
+    bad = ~(np.isfinite(px) & np.isfinite(py))
+    keep[bad] = True
+    keep[:-1][bad[1:]] = True
+    keep[1:][bad[:-1]] = True
+
+    # Only the intervals that contain points are live
+    kept = np.nonzero(keep)[0]
+    live = np.diff(kept) > 1
+    a = kept[:-1][live]
+    b = kept[1:][live]
+    max_passes = 4*int(np.ceil(np.log2(n)))
+    for npass in range(max_passes + 1):
+        if len(a) == 0:
+            break
+
+        # Number the points inside each live interval consecutively
+        count = b - a - 1
+        starts = np.cumsum(count) - count
+        index = np.arange(np.sum(count)) - np.repeat(starts - a - 1, count)
+        if npass == max_passes:
+            # Keep all the points of the intervals that are left
+            keep[index] = True
+            break
+
+        # Compute the distance from each point to its interval's chord
+        dx = px[b] - px[a]
+        dy = py[b] - py[a]
+        length2 = np.repeat(dx**2 + dy**2, count)
+        dx = np.repeat(dx, count)
+        dy = np.repeat(dy, count)
+        rx = px[index] - np.repeat(px[a], count)
+        ry = py[index] - np.repeat(py[a], count)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t = np.where(length2 > 0.0, (rx*dx + ry*dy)/length2, 0.0)
+        t = np.clip(t, 0.0, 1.0)
+        dist = np.hypot(rx - t*dx, ry - t*dy)
+
+        # Find the first point with the maximum distance in each interval,
+        # or in the middle half of each interval on the later passes
+        dmax = np.maximum.reduceat(dist, starts)
+        dfind = dist
+        target = dmax
+        if 2*npass >= max_passes:
+            lo = np.repeat(a + 0.25*(b - a), count)
+            hi = np.repeat(b - 0.25*(b - a), count)
+            dmid = np.where((index >= lo) & (index <= hi), dist, -1.0)
+            dmid_max = np.maximum.reduceat(dmid, starts)
+            mid = dmid_max > tolerance
+            dfind = np.where(np.repeat(mid, count), dmid, dist)
+            target = np.where(mid, dmid_max, dmax)
+        pos = np.where(dfind == np.repeat(target, count),
+                       np.arange(len(dist)), len(dist))
+        imax = index[np.minimum.reduceat(pos, starts)]
+
+        # Keep the farthest point when the interval is out of tolerance and
+        # split the interval there, otherwise drop all of its points
+        split = dmax > tolerance
+        a, m, b = a[split], imax[split], b[split]
+        keep[m] = True
+        a = np.concatenate((a, m))
+        b = np.concatenate((m, b))
+        live = b - a > 1
+        a = a[live]
+        b = b[live]
+
+    return keep
+
+def _get_polyline_strings(px, py, run_len, precision=None, relative=False):
+    """
+    Format the points of a series of polylines in the drawing coordinates
+
+    The points of all the polylines are stored consecutively, and each
+    polyline with m segments has m+1 points. Returns one path string per
+    polyline. With relative coordinates, each point after the first is
+    written as an offset ++(dx, dy) from the previous one. The offsets are
+    computed from the rounded positions so that no error accumulates.
+    """
+
+    if len(run_len) == 0:
+        return []
+
+    if precision is None:
+        precision = _precision
+
+    point, sep = _get_path_format(precision)
+    if relative:
+        digits = 6 if precision is None else precision
+        px = np.round(px, digits)
+        py = np.round(py, digits)
+
+        # Replace every point except the first in each polyline by its offset
+        first = np.zeros(len(px), dtype=bool)
+        first[np.cumsum(run_len + 1) - run_len - 1] = True
+        dx = np.zeros(len(px))
+        dy = np.zeros(len(py))
+        dx[1:] = px[1:] - px[:-1]
+        dy[1:] = py[1:] - py[:-1]
+        px = np.where(first, px, dx)
+        py = np.where(first, py, dy)
+        sep = sep + '++'
+
+    coords = np.column_stack((px, py)).ravel().tolist()
+    fmt = '\n'.join([point + (sep + point)*m for m in run_len.tolist()])
+    s = fmt%tuple(coords)
+    if precision is not None:
+        s = _shorten_numbers(s)
+    return s.split('\n')
+
+# The path for each symbol with the point offsets in units of half the
+# symbol size and the string that ends each symbol
+_symbol_paths = {
+    'circle': ('(%f, %f) circle (%g)', [(0.0, 0.0)], ';'),
+    'square': ('(%f, %f) rectangle (%f, %f)', [(-1.0, -1.0), (1.0, 1.0)], ';'),
+    'triangle': ('(%f,%f) -- (%f,%f) -- (%f,%f) -- cycle',
+                 [(-0.9, -1.0), (0.9, -1.0), (0.0, 1.0)], ';\n'),
+    'delta': ('(%f,%f) -- (%f,%f) -- (%f,%f) -- cycle',
+              [(-0.9, 1.0), (0.9, 1.0), (0.0, -1.0)], ';\n'),
+    'diamond': ('(%f,%f) -- (%f,%f) -- (%f,%f) -- (%f,%f) -- cycle',
+                [(-1.0, 0.0), (0.0, -1.0), (1.0, 0.0), (0.0, 1.0)], ';\n')}
+
+def _write_symbols(fp, px, py, symbol, symbol_dim='thin', color='black',
+                   fill_color='white', symbol_size=0.15, symbol_mode='draw',
+                   style=None, precision=None):
+    """
+    Write the symbols at the points given in the drawing coordinates
+    """
+
+    if symbol not in _symbol_paths or len(px) == 0:
+        return
+
+    if precision is None:
+        precision = _precision
+    if precision is None:
+        nf = '%f'
+    else:
+        nf = '%%.%df'%(precision)
+
+    h = 0.5*symbol_size
+    path, offsets, end = _symbol_paths[symbol]
+    path = path.replace('%g', '%g'%(h)).replace('%f', nf)
+    if style is None:
+        style = '%s, color=%s, fill=%s'%(symbol_dim, color, fill_color)
+
+    if symbol_mode == 'foreach':
+        # Define the symbol once about the origin and shift it to each point
+        coords = np.column_stack((px, py)).ravel().tolist()
+        points = ','.join([nf + '/' + nf]*len(px))%tuple(coords)
+        shape = path%tuple(h*np.array(offsets).ravel())
+        s = '\\foreach \\px/\\py in {%s}{\\draw[%s, shift={(\\px,\\py)}] %s;}\n'%(
+            points, style, shape)
+    else:
+        # Write a separate command for each symbol
+        offsets = h*np.array(offsets)
+        coords = np.empty((len(px), len(offsets), 2))
+        coords[:, :, 0] = px[:, np.newaxis] + offsets[:, 0]
+        coords[:, :, 1] = py[:, np.newaxis] + offsets[:, 1]
+        fmt = ('\\draw[' + style.replace('%', '%%') + '] ' + path + end)*len(px)
+        s = fmt%tuple(coords.ravel().tolist())
+
+    if precision is not None:
+        s = _shorten_numbers(s)
+    fp.write(s)
+
+def write_2d_plot(fp, xvals, yvals, xscale=1.0, xbase=0.0, yscale=1.0, ybase=0.0,
+                  line_dim='thick', color='black', fill_color='white',
+                  xmin=None, xmax=None, ymin=None, ymax=None,
+                  symbol=None, symbol_dim='thin', symbol_size=0.15,
+                  symbol_mode='draw', tolerance=None, precision=None,
+                  relative=False, style=None, symbol_style=None,
+                  xlog=False, ylog=False, linthresh=1.0, block_size=None):
+    """
+    Write the 2D plot of a series of linesegments. If ymin/ymax,
+    xmin/xmax are specified, clip the plot to the box
+
+    The symbol can be 'circle', 'square', 'triangle', 'delta' or
+    'diamond'. With symbol_mode='draw' each symbol is a separate \\draw
+    command, while symbol_mode='foreach' defines the symbol once and places
+    it at a compact list of points with \\foreach.
+
+    If a tolerance is specified, the line is simplified so that it deviates
+    from the original points by at most the tolerance, measured in the
+    scaled drawing units. Symbols are still drawn at every point.
+
+    The precision sets the number of decimal places of the coordinates
+    (see set_precision) and relative=True writes the points of each line
+    as offsets from the previous point.
+
+    The style and symbol_style replace the options of the line and the
+    symbols, for instance with the name of a style set with \\tikzset.
+
+    With xlog or ylog set to True or 'symlog' (with the linear threshold
+    linthresh), the data and the limits are mapped to a log scale before
+    the scale and base are applied, so the base is given in decades.
+    Points that cannot be mapped, such as non-positive values on a log
+    axis, leave a gap in the line.
+
+    With a block_size, the points are read and written in blocks of that
+    size, so a np.memmap (see load_npy) or a column of a structured
+    array is plotted without loading it into memory at once. The blocks
+    are written with write_2d_plot_stream, so the output only matches
+    the output without a block_size when there are no symbols and no
+    tolerance.
+    """
+
+    if block_size is not None and min(len(xvals), len(yvals)) > block_size:
+        _write_2d_plot_blocks(fp, xvals, yvals, block_size, xscale=xscale,
+                              xbase=xbase, yscale=yscale, ybase=ybase,
+                              line_dim=line_dim, color=color,
+                              fill_color=fill_color,
+                              xmin=xmin, xmax=xmax, ymin=ymin, ymax=ymax,
+                              symbol=symbol, symbol_dim=symbol_dim,
+                              symbol_size=symbol_size,
+                              symbol_mode=symbol_mode, tolerance=tolerance,
+                              precision=precision, relative=relative,
+                              style=style, symbol_style=symbol_style,
+                              xlog=xlog, ylog=ylog, linthresh=linthresh)
+        return
+
+    xvals = np.asarray(xvals, dtype=float)
+    yvals = np.asarray(yvals, dtype=float)
+    if precision is None:
+        precision = _precision
+
+    # Apply the log transformations to the data and the limits
+    fx = _get_axis_transform(xlog, linthresh)
+    fy = _get_axis_transform(ylog, linthresh)
+    if fx is not None:
+        xvals = fx(xvals)
+    if fy is not None:
+        yvals = fy(yvals)
+    xmin, xmax = _transform_limits(fx, xmin, xmax)
+    ymin, ymax = _transform_limits(fy, ymin, ymax)
+
+    # Map the points to the drawing
+    if ymin is None:
+        ymin = np.nanmin(yvals)
+    if xmin is None:
+        xmin = np.nanmin(xvals)
+
+    if ymax is None:
+        ymax = np.nanmax(yvals)
+    if xmax is None:
+        xmax = np.nanmax(xvals)
+
+    n = min(len(yvals), len(xvals))
+    xvals = xvals[:n]
+    yvals = yvals[:n]
+
+    # Thin out the line before it is clipped and formatted
+    lx, ly = xvals, yvals
+    if line_dim is not None and tolerance is not None:
+        keep = _simplify_polyline(xscale*(xvals - xbase),
+                                  yscale*(yvals - ybase), tolerance)
+        lx, ly = xvals[keep], yvals[keep]
+
+    if line_dim is not None and len(lx) >= 2:
+        if style is None:
+            style = '%s, color=%s'%(line_dim, color)
+        head = r'\draw[%s] '%(style)
+        if symbol is None and np.all((lx >= xmin) & (lx <= xmax) &
+                                     (ly >= ymin) & (ly <= ymax)):
+            # When all the points lie within the box no clipping is
+            # required, so transform and format the whole line at once
+            px = xscale*(lx - xbase)
+            py = yscale*(ly - ybase)
+            run_len = np.array([len(lx) - 1])
+        else:
+            # Clip all the segments against the box at once
+            umin, umax, visible = _get_polyline_intersections(
+                lx, ly, xmin, xmax, ymin, ymax)
+
+            index = np.nonzero(visible)[0]
+            u = umin[index]
+            x1 = xscale*((1.0 - u)*lx[index] + u*lx[index+1] - xbase)
+            y1 = yscale*((1.0 - u)*ly[index] + u*ly[index+1] - ybase)
+            u = umax[index]
+            x2 = xscale*((1.0 - u)*lx[index] + u*lx[index+1] - xbase)
+            y2 = yscale*((1.0 - u)*ly[index] + u*ly[index+1] - ybase)
+
+            if symbol is None:
+                # A run of visible segments continues as long as each
+                # segment ends inside the box and is followed by the next
+                start = np.ones(len(index), dtype=bool)
+                start[1:] = ((index[1:] != index[:-1] + 1) |
+                             (umax[index[:-1]] < 1.0))
+                run_start = np.nonzero(start)[0]
+                run_len = np.diff(np.append(run_start, len(index)))
+
+                # Insert the first point of each run before its end points
+                first = np.zeros(len(index) + len(run_start), dtype=bool)
+                first[run_start + np.arange(len(run_start))] = True
+                px = np.empty(len(first))
+                py = np.empty(len(first))
+                px[first] = x1[start]
+                py[first] = y1[start]
+                px[~first] = x2
+                py[~first] = y2
+            else:
+                # Draw each of the segments separately
+                px = np.column_stack((x1, x2)).ravel()
+                py = np.column_stack((y1, y2)).ravel()
+                run_len = np.ones(len(index), dtype=int)
+
+        paths = _get_polyline_strings(px, py, run_len, precision=precision,
+                                      relative=relative)
+        if symbol is None and precision is None:
+            end = ' ;\n'
+        else:
+            end = ';\n'
+        for path in paths:
+            fp.write(head + path + end)
+
+    if symbol is not None:
+        # Draw the symbols at the points inside the box
+        inside = ((xvals >= xmin) & (xvals <= xmax) &
+                  (yvals >= ymin) & (yvals <= ymax))
+        _write_symbols(fp, xscale*(xvals[inside] - xbase),
+                       yscale*(yvals[inside] - ybase), symbol,
+                       symbol_dim=symbol_dim, color=color,
+                       fill_color=fill_color, symbol_size=symbol_size,
+                       symbol_mode=symbol_mode, style=symbol_style,
+                       precision=precision)
+
+def write_2d_plot_stream(fp, blocks, xscale=1.0, xbase=0.0, yscale=1.0,
+                         ybase=0.0, line_dim='thick', color='black',
+                         fill_color='white',
+                         xmin=None, xmax=None, ymin=None, ymax=None,
+                         symbol=None, symbol_dim='thin', symbol_size=0.15,
+                         symbol_mode='draw', tolerance=None, precision=None,
+                         style=None, symbol_style=None,
+                         xlog=False, ylog=False, linthresh=1.0):
+    """
+    Write the 2D plot of a line given as an iterable of (x, y) blocks
+
+    The blocks may come from a generator, for instance one that reads a
+    log file while it is written. Only the clipping state and the last
+    point of the previous block are kept, and the line is written as it
+    arrives, so a path that crosses a block boundary is continued in the
+    next block. The limits that are not specified do not clip the line.
+    The other options are the same as for write_2d_plot.
+
+    Without symbols or a tolerance, the output is the same as the output
+    of write_2d_plot for the whole line with the same limits. With
+    symbols, the paths are ended at each block and the symbols of the
+    block are written after them, so the same line and symbols are drawn
+    with different commands. The tolerance is applied to each block, so
+    the simplified line may keep different points.
+    """
+
+    if precision is None:
+        precision = _precision
+
+    fx = _get_axis_transform(xlog, linthresh)
+    fy = _get_axis_transform(ylog, linthresh)
+    xmin, xmax = _transform_limits(fx, xmin, xmax)
+    ymin, ymax = _transform_limits(fy, ymin, ymax)
+    xmin = -np.inf if xmin is None else xmin
+    xmax = np.inf if xmax is None else xmax
+    ymin = -np.inf if ymin is None else ymin
+    ymax = np.inf if ymax is None else ymax
+
+    if style is None:
+        style = '%s, color=%s'%(line_dim, color)
+    head = r'\draw[%s] '%(style)
+    point, sep = _get_path_format(precision)
+    if symbol is None and precision is None:
+        end = ' ;\n'
+    else:
+        end = ';\n'
+
+    # The last point of the previous block and whether the path is open
+    prev = None
+    path_open = False
+
+    for bx, by in blocks:
+        bx = np.asarray(bx, dtype=float).ravel()
+        by = np.asarray(by, dtype=float).ravel()
+        n = min(len(bx), len(by))
+        bx, by = bx[:n], by[:n]
+        if fx is not None:
+            bx = fx(bx)
+        if fy is not None:
+            by = fy(by)
+        if n == 0:
+            continue
+
+        if line_dim is not None:
+            # Join the block to the last point of the previous block
+            lx, ly = bx, by
+            if prev is not None:
+                lx = np.concatenate(([prev[0]], bx))
+                ly = np.concatenate(([prev[1]], by))
+            if tolerance is not None:
+                keep = _simplify_polyline(xscale*(lx - xbase),
+                                          yscale*(ly - ybase), tolerance)
+                lx, ly = lx[keep], ly[keep]
+
+            index = np.zeros(0, dtype=int)
+            if len(lx) >= 2:
+                umin, umax, visible = _get_polyline_intersections(
+                    lx, ly, xmin, xmax, ymin, ymax)
+                index = np.nonzero(visible)[0]
+
+            if len(index) == 0:
+                if path_open:
+                    fp.write(end)
+                path_open = False
+            else:
+                u = umin[index]
+                x1 = xscale*((1.0 - u)*lx[index] + u*lx[index+1] - xbase)
+                y1 = yscale*((1.0 - u)*ly[index] + u*ly[index+1] - ybase)
+                u = umax[index]
+                x2 = xscale*((1.0 - u)*lx[index] + u*lx[index+1] - xbase)
+                y2 = yscale*((1.0 - u)*ly[index] + u*ly[index+1] - ybase)
+
+                # Find the runs of connected segments as in write_2d_plot
+                start = np.ones(len(index), dtype=bool)
+                start[1:] = ((index[1:] != index[:-1] + 1) |
+                             (umax[index[:-1]] < 1.0))
+                run_start = np.nonzero(start)[0]
+                run_len = np.diff(np.append(run_start, len(index)))
+
+                # The first run continues the open path if it starts at the
+                # previous point
+                cont = path_open and index[0] == 0
+                if path_open and not cont:
+                    fp.write(end)
+
+                pieces = []
+                coords = []
+                for r, (i, m) in enumerate(zip(run_start.tolist(),
+                                               run_len.tolist())):
+                    if r == 0 and cont:
+                        pieces.append((sep + point)*m)
+                    else:
+                        if r > 0:
+                            pieces.append(end)
+                        pieces.append(head.replace('%', '%%') + point +
+                                      (sep + point)*m)
+                        coords.extend([x1[i], y1[i]])
+                    coords.extend(np.column_stack(
+                        (x2[i:i+m], y2[i:i+m])).ravel().tolist())
+
+                s = ''.join(pieces)%tuple(coords)
+                if precision is not None:
+                    s = _shorten_numbers(s)
+                fp.write(s)
+
+                # Keep the path open if it ends at the last point
+                last = len(lx) - 2
+                path_open = index[-1] == last and umax[last] >= 1.0
+                if not path_open or symbol is not None:
+                    fp.write(end)
+                    path_open = False
+
+        if symbol is not None:
+            inside = ((bx >= xmin) & (bx <= xmax) &
+                      (by >= ymin) & (by <= ymax))
+            _write_symbols(fp, xscale*(bx[inside] - xbase),
+                           yscale*(by[inside] - ybase), symbol,
+                           symbol_dim=symbol_dim, color=color,
+                           fill_color=fill_color, symbol_size=symbol_size,
+                           symbol_mode=symbol_mode, style=symbol_style,
+                           precision=precision)
+
+        prev = (bx[-1], by[-1])
+
+    if path_open:
+        fp.write(end)
+
+@_get_string_signature(write_2d_plot_stream)
+def get_2d_plot_stream(*args, **kwargs):
+    """
+    Create a string representing the 2D plot of a line given as an
+    iterable of (x, y) blocks
+    """
+    return _get_string(write_2d_plot_stream, *args, **kwargs)
+
+def _write_2d_plot_blocks(fp, xvals, yvals, block_size, xlog=False,
+                          ylog=False, linthresh=1.0, xmin=None, xmax=None,
+                          ymin=None, ymax=None, line_dim='thick',
+                          symbol=None, **kwargs):
+    """
+    Write the 2D plot by reading the points in blocks
+
+    The missing limits are found with a first pass over the blocks, and
+    the blocks are then written with write_2d_plot_stream.
+    """
+
+    n = min(len(xvals), len(yvals))
+    fx = _get_axis_transform(xlog, linthresh)
+    fy = _get_axis_transform(ylog, linthresh)
+
+    def get_block(start, end):
+        bx = np.asarray(xvals[start:end], dtype=float)
+        by = np.asarray(yvals[start:end], dtype=float)
+        if fx is not None:
+            bx = fx(bx)
+        if fy is not None:
+            by = fy(by)
+        return bx, by
+
+    # Find the limits in the transformed coordinates
+    xmin, xmax = _transform_limits(fx, xmin, xmax)
+    ymin, ymax = _transform_limits(fy, ymin, ymax)
+    if xmin is None or xmax is None or ymin is None or ymax is None:
+        lims = np.array([np.inf, -np.inf, np.inf, -np.inf])
+        for start in range(0, n, block_size):
+            bx, by = get_block(start, start + block_size)
+            bx = bx[np.isfinite(bx)]
+            by = by[np.isfinite(by)]
+            if len(bx) > 0:
+                lims[:2] = np.fmin(lims[:2], [np.min(bx), -np.max(bx)])
+            if len(by) > 0:
+                lims[2:] = np.fmin(lims[2:], [np.min(by), -np.max(by)])
+        if xmin is None:
+            xmin = lims[0]
+        if xmax is None:
+            xmax = -lims[1]
+        if ymin is None:
+            ymin = lims[2]
+        if ymax is None:
+            ymax = -lims[3]
+
+    box = dict(xmin=xmin, xmax=xmax, ymin=ymin, ymax=ymax)
+    if kwargs.pop('relative', False):
+        # Relative coordinates are not continued across the blocks, so
+        # write each block as a separate plot
+        for start in range(0, n - 1, block_size):
+            bx, by = get_block(start, start + block_size + 1)
+            write_2d_plot(fp, bx, by, line_dim=line_dim, symbol=None,
+                          relative=True, **dict(box, **kwargs))
+        line_dim = None
+
+    blocks = (get_block(start, start + block_size)
+              for start in range(0, n, block_size))
+    write_2d_plot_stream(fp, blocks, line_dim=line_dim, symbol=symbol,
+                         **dict(box, **kwargs))
+
+def load_npy(filename):
+    """
+    Open a .npy file as a read-only np.memmap
+
+    The data is only read from the file when it is accessed, so a column
+    of the array (or a field of a structured array) can be passed to
+    write_2d_plot with a block_size to plot it in bounded memory.
+    """
+    return np.load(filename, mmap_mode='r')
+
+def load_npz(filename):
+    """
+    Open a .npz file
+
+    The arrays in the file are loaded by name when they are accessed.
+    """
+    return np.load(filename)
+
+def _is_header(line, delimiter=','):
+    """Check if a line of a CSV file has a field that is not a number"""
+    if not line.strip():
+        return False
+    for field in line.split(delimiter):
+        try:
+            float(field)
+        except ValueError:
+            return True
+    return False
+
+def iter_csv_blocks(filename, columns=None, block_size=100000,
+                    delimiter=',', skip_header=0, header=None):
+    """
+    Read the columns of a CSV file in blocks of rows
+
+    The first line of the file (after skip_header lines) contains the
+    column names if header is True. By default, it is taken as the header
+    when any of its fields is not a number. The columns are given by
+    their indices, or by their names if there is a header. Yields a 2D
+    array for each block with one column for each entry in columns.
+    """
+
+    with open(filename, 'r') as fp:
+        for i in range(skip_header):
+            fp.readline()
+
+        first = fp.readline()
+        if header is None:
+            header = _is_header(first, delimiter)
+        if header:
+            names = [name.strip() for name in first.split(delimiter)]
+        if columns is not None and any(isinstance(c, str) for c in columns):
+            if not header:
+                raise ValueError('The columns can only be given by name when '
+                                 'the file has a header')
+            columns = [names.index(c) if isinstance(c, str) else c
+                       for c in columns]
+
+        rows = fp if header else itertools.chain([first], fp)
+        while True:
+            lines = [line for line in itertools.islice(rows, block_size)
+                     if line.strip()]
+            if len(lines) == 0:
+                break
+            yield np.loadtxt(lines, delimiter=delimiter, usecols=columns,
+                             ndmin=2)
+
+def csv_to_npy(filename, npyfile, columns=None, block_size=100000,
+               delimiter=',', skip_header=0, header=None):
+    """
+    Convert the columns of a CSV file to a .npy file in blocks
+
+    See iter_csv_blocks for the arguments. Only one block of rows is held
+    in memory at a time. Returns the result opened with load_npy.
+    """
+
+    # Count the rows and columns of the data
+    nrows = 0
+    ncols = 0
+    for block in iter_csv_blocks(filename, columns=columns,
+                                 block_size=block_size, delimiter=delimiter,
+                                 skip_header=skip_header, header=header):
+        nrows += block.shape[0]
+        ncols = block.shape[1]
+
+    data = np.lib.format.open_memmap(npyfile, mode='w+', dtype=float,
+                                     shape=(nrows, ncols))
+    row = 0
+    for block in iter_csv_blocks(filename, columns=columns,
+                                 block_size=block_size, delimiter=delimiter,
+                                 skip_header=skip_header, header=header):
+        data[row:row + block.shape[0]] = block
+        row += block.shape[0]
+    data.flush()
+    del data
+
+    return load_npy(npyfile)
+
+@_get_string_signature(write_2d_plot)
+def get_2d_plot(*args, **kwargs):
     """
     Create a string representing the 2D plot of a series of
     linesegments. If ymin/ymax, xmin/xmax are specified, clip the plot
     to the box
     """
+    return _get_string(write_2d_plot, *args, **kwargs)
+
+def write_png(filename, rgba):
+    """
+    Write an RGBA image to a PNG file
+
+    The image is an array of shape (height, width, 4) with values from 0
+    to 255, where the first row is the top of the image.
+    """
+
+    rgba = np.asarray(rgba, dtype=np.uint8)
+    height, width = rgba.shape[:2]
+
+    def chunk(tag, data):
+        return (struct.pack('>I', len(data)) + tag + data +
+                struct.pack('>I', zlib.crc32(tag + data) & 0xffffffff))
+
+    # Each row starts with the filter type, which is zero (none)
+    raw = np.zeros((height, 4*width + 1), dtype=np.uint8)
+    raw[:, 1:] = rgba.reshape(height, 4*width)
+
+    with open(filename, 'wb') as fp:
+        fp.write(b'\x89PNG\r\n\x1a\n')
+        fp.write(chunk(b'IHDR', struct.pack('>IIBBBBB', width, height,
+                                            8, 6, 0, 0, 0)))
+        fp.write(chunk(b'IDAT', zlib.compress(raw.tobytes(), 6)))
+        fp.write(chunk(b'IEND', b''))
+
+# The size of the units used for the picture dimensions in inches
+_units_per_inch = {'in': 1.0, 'cm': 2.54, 'mm': 25.4, 'pt': 72.27, 'bp': 72.0}
+
+def _interp_grid(x, y, F, xp, yp, interpolation='bilinear'):
+    """
+    Interpolate the field on a rectilinear grid at the points xp, yp
+
+    The x and y values must be increasing. Points outside the grid are
+    set to NaN.
+    """
+
+    i = np.clip(np.searchsorted(x, xp, side='right') - 1, 0, len(x) - 2)
+    j = np.clip(np.searchsorted(y, yp, side='right') - 1, 0, len(y) - 2)
+    u = (xp - x[i])/(x[i+1] - x[i])
+    w = (yp - y[j])/(y[j+1] - y[j])
+
+    if interpolation == 'nearest':
+        i = np.where(u < 0.5, i, i + 1)
+        j = np.where(w < 0.5, j, j + 1)
+        vals = F[j, i]
+    else:
+        vals = ((1.0 - w)*((1.0 - u)*F[j, i] + u*F[j, i+1]) +
+                w*((1.0 - u)*F[j+1, i] + u*F[j+1, i+1]))
+
+    outside = (xp < x[0]) | (xp > x[-1]) | (yp < y[0]) | (yp > y[-1])
+    return np.where(outside, np.nan, vals)
+
+def write_2d_image_plot(fp, X, Y, F, filename, cmap='blue-red',
+                        vmin=None, vmax=None,
+                        xscale=1.0, xbase=0.0, yscale=1.0, ybase=0.0,
+                        xmin=None, xmax=None, ymin=None, ymax=None,
+                        xdim=1.0, ydim=1.0, xunit='cm', yunit='cm',
+                        dpi=150, interpolation='bilinear', image_path=None,
+                        precision=None):
+    """
+    Write a rasterized image of a field on a structured grid
+
+    X, Y and F are 2D arrays on a rectilinear grid, for instance created
+    with np.meshgrid. The part of the field inside the box is sampled at
+    the given dots per inch, using the xdim/xunit and ydim/yunit that are
+    passed to get_begin_tikz, and colored with the colormap (a Colormap
+    or the name of one) between vmin and vmax. The image is written to a
+    PNG file and placed in the picture with \\includegraphics, so it lines
+    up with the axes, lines and contours drawn with the same scale and
+    base. A negative xscale or yscale mirrors the image. The image_path is
+    the name used in the document, which is the filename by default, so a
+    relative filename is found from the directory where the document is
+    compiled (tikzbuild adds the current directory to TEXINPUTS). NaN
+    values are transparent. The SHA-256 digest of the image is written in
+    a comment, so the output changes whenever the image does and a
+    FigureCache does not return a figure made from an old image.
+    """
+
+    if xscale == 0.0 or yscale == 0.0:
+        raise ValueError('The xscale and yscale of an image must be nonzero')
+
+    X = np.asarray(X, dtype=float)
+    Y = np.asarray(Y, dtype=float)
+    F = np.asarray(F, dtype=float)
+    x = X[0, :]
+    y = Y[:, 0]
+
+    # Make the grid coordinates increasing
+    if x[0] > x[-1]:
+        x, F = x[::-1], F[:, ::-1]
+    if y[0] > y[-1]:
+        y, F = y[::-1], F[::-1, :]
+
+    if isinstance(cmap, str):
+        cmap = get_colormap(cmap)
+    if vmin is None:
+        vmin = np.nanmin(F)
+    if vmax is None:
+        vmax = np.nanmax(F)
+
+    # Find the region of the box covered by the grid
+    x0 = x[0] if xmin is None else max(xmin, x[0])
+    x1 = x[-1] if xmax is None else min(xmax, x[-1])
+    y0 = y[0] if ymin is None else max(ymin, y[0])
+    y1 = y[-1] if ymax is None else min(ymax, y[-1])
+    if x1 <= x0 or y1 <= y0:
+        return
+
+    # Find the number of pixels from the size in the drawing
+    width = abs(xscale)*(x1 - x0)*xdim
+    height = abs(yscale)*(y1 - y0)*ydim
+    nx = max(1, int(np.ceil(dpi*width/_units_per_inch[xunit])))
+    ny = max(1, int(np.ceil(dpi*height/_units_per_inch[yunit])))
+
+    # Sample the field at the pixel centers, with the top row first
+    xp = x0 + (x1 - x0)*(np.arange(nx) + 0.5)/nx
+    yp = y1 - (y1 - y0)*(np.arange(ny) + 0.5)/ny
+    vals = _interp_grid(x, y, F, xp[np.newaxis, :], yp[:, np.newaxis],
+                        interpolation=interpolation)
+
+    if vmax > vmin:
+        u = (vals - vmin)/(vmax - vmin)
+    else:
+        u = np.zeros(vals.shape)
+    rgba = np.empty((ny, nx, 4), dtype=np.uint8)
+    rgba[:, :, :3] = cmap(np.nan_to_num(u))
+    rgba[:, :, 3] = np.where(np.isnan(vals), 0, 255)
+
+    # Mirror the image along the axes with a negative scale, so that the
+    # lower left corner is at the lower left of the drawing
+    if xscale < 0.0:
+        rgba = rgba[:, ::-1]
+        x0 = x1
+    if yscale < 0.0:
+        rgba = rgba[::-1, :]
+        y0 = y1
+    write_png(filename, rgba)
+    digest = hashlib.sha256(struct.pack('>II', *rgba.shape[:2]) +
+                            np.ascontiguousarray(rgba).tobytes())
+
+    if image_path is None:
+        image_path = filename
+    fp.write('%% %s sha256=%s\n'%(image_path, digest.hexdigest()))
+    fp.write('\\node[anchor=south west, inner sep=0] at (%s, %s) '%(
+        _format_number(xscale*(x0 - xbase), precision),
+        _format_number(yscale*(y0 - ybase), precision)))
+    fp.write('{\\includegraphics[width=%s%s, height=%s%s]{%s}};\n'%(
+        _format_number(width, precision), xunit,
+        _format_number(height, precision), yunit, image_path))
+
+@_get_string_signature(write_2d_image_plot)
+def get_2d_image_plot(*args, **kwargs):
+    """
+    Create the string that places a rasterized image of a field and write
+    the image to a PNG file
+    """
+    return _get_string(write_2d_image_plot, *args, **kwargs)
+
+def _get_scatter_cells(px, py, x0, y0, cell_size):
+    """
+    Bin the points into square cells of the given size in the drawing
+    coordinates
+
+    Returns the index of the first point in each occupied cell, in the
+    original order of the points, and the number of points in each cell.
+    """
+
+    ix = np.floor((px - x0)/cell_size).astype(np.int64)
+    iy = np.floor((py - y0)/cell_size).astype(np.int64)
+    ix -= ix.min()
+    iy -= iy.min()
+    key = ix*(iy.max() + 1) + iy
+
+    _, first, count = np.unique(key, return_index=True, return_counts=True)
+    order = np.argsort(first)
+    first = first[order]
+    return first, count[order]
+
+def write_2d_scatter_plot(fp, xvals, yvals, xscale=1.0, xbase=0.0,
+                          yscale=1.0, ybase=0.0, color='black',
+                          fill_color='white',
+                          xmin=None, xmax=None, ymin=None, ymax=None,
+                          symbol='circle', symbol_dim='thin',
+                          symbol_size=0.15, symbol_mode='draw',
+                          mode='cull', cell_size=None, levels=8,
+                          precision=None, xlog=False, ylog=False,
+                          linthresh=1.0, symbol_style=None):
+    """
+    Write a scatter plot of a large number of points
+
+    The points inside the box are binned into a grid of square cells in
+    the drawing coordinates. The cell size defaults to the symbol size so
+    that the output size depends on the size of the drawing and not on
+    the number of points. With mode='cull', the symbol is drawn only at
+    the first point in each occupied cell. With mode='density', each
+    occupied cell is filled with the color at an opacity proportional to
+    the number of points in the cell, rounded to the given number of
+    levels, and the cells with the same opacity are drawn as one path.
+    The xlog, ylog, linthresh and symbol_style options are the same as for
+    write_2d_plot.
+    """
+
+    xvals = np.asarray(xvals, dtype=float)
+    yvals = np.asarray(yvals, dtype=float)
+    if precision is None:
+        precision = _precision
+    if cell_size is None:
+        cell_size = symbol_size
+
+    n = min(len(yvals), len(xvals))
+    xvals = xvals[:n]
+    yvals = yvals[:n]
+
+    fx = _get_axis_transform(xlog, linthresh)
+    fy = _get_axis_transform(ylog, linthresh)
+    if fx is not None:
+        xvals = fx(xvals)
+    if fy is not None:
+        yvals = fy(yvals)
+    xmin, xmax = _transform_limits(fx, xmin, xmax)
+    ymin, ymax = _transform_limits(fy, ymin, ymax)
 
-    # Map the points to the drawing
     if ymin is None:
-        ymin = min(yvals)
+        ymin = np.nanmin(yvals)
     if xmin is None:
-        xmin = min(xvals)
+        xmin = np.nanmin(xvals)
 
     if ymax is None:
-        ymax = max(yvals)
+        ymax = np.nanmax(yvals)
     if xmax is None:
-        xmax = max(xvals)
+        xmax = np.nanmax(xvals)
+
+    inside = ((xvals >= xmin) & (xvals <= xmax) &
+              (yvals >= ymin) & (yvals <= ymax))
+    px = xscale*(xvals[inside] - xbase)
+    py = yscale*(yvals[inside] - ybase)
+    if len(px) == 0:
+        return
+
+    # Align the grid with the corner of the box
+    x0 = min(xscale*(xmin - xbase), xscale*(xmax - xbase))
+    y0 = min(yscale*(ymin - ybase), yscale*(ymax - ybase))
+    first, count = _get_scatter_cells(px, py, x0, y0, cell_size)
+
+    if mode == 'density':
+        # Quantize the opacity of each cell
+        level = np.ceil(levels*count/float(count.max())).astype(int)
+        x1 = x0 + cell_size*np.floor((px[first] - x0)/cell_size)
+        y1 = y0 + cell_size*np.floor((py[first] - y0)/cell_size)
+
+        point, sep = _get_path_format(precision)
+        for lev in np.unique(level).tolist():
+            index = np.nonzero(level == lev)[0]
+            coords = np.column_stack((x1[index], y1[index],
+                                      x1[index] + cell_size,
+                                      y1[index] + cell_size)).ravel().tolist()
+            fmt = ' '.join([point + ' rectangle ' + point]*len(index))
+            s = fmt%tuple(coords)
+            if precision is not None:
+                s = _shorten_numbers(s)
+            fp.write('\\fill[color=%s, fill opacity=%g] %s;\n'%(
+                color, float(lev)/levels, s))
+    else:
+        _write_symbols(fp, px[first], py[first], symbol,
+                       symbol_dim=symbol_dim, color=color,
+                       fill_color=fill_color, symbol_size=symbol_size,
+                       symbol_mode=symbol_mode, style=symbol_style,
+                       precision=precision)
+
+@_get_string_signature(write_2d_scatter_plot)
+def get_2d_scatter_plot(*args, **kwargs):
+    """
+    Create a string representing a scatter plot of a large number of
+    points binned to the size of the symbols
+    """
+    return _get_string(write_2d_scatter_plot, *args, **kwargs)
 
-    s = ''
-    n = min(len(yvals), len(xvals))
-    if line_dim is not None:
-        draw_on = False
-
-        for i in range(n-1):
-            inter = _get_intersections(xvals[i], xvals[i+1],
-                                       yvals[i], yvals[i+1],
-                                       xmin, xmax, ymin, ymax)
-
-            if inter is not None:
-                if symbol is None:
-                    u = inter[0]
-                    if not draw_on:
-                        s += r'\draw[%s, color=%s] '%(line_dim, color)
-                        s += r'(%f, %f) '%(
-                            xscale*((1.0 - u)*xvals[i] + u*xvals[i+1] - xbase),
-                            yscale*((1.0 - u)*yvals[i] + u*yvals[i+1] - ybase))
-                        draw_on = True
-
-                    u = inter[1]
-                    s += r'-- (%f, %f) '%(
-                        xscale*((1.0 - u)*xvals[i] + u*xvals[i+1] - xbase),
-                        yscale*((1.0 - u)*yvals[i] + u*yvals[i+1] - ybase))
-
-                    if u < 1.0:
-                        s += ';\n'
-                        draw_on = False
-                else:
-                    u = inter[0]
-                    s += r'\draw[%s, color=%s] '%(line_dim, color)
-                    s += r'(%f, %f) '%(
-                        xscale*((1.0 - u)*xvals[i] + u*xvals[i+1] - xbase),
-                        yscale*((1.0 - u)*yvals[i] + u*yvals[i+1] - ybase))
-                    u = inter[1]
-                    s += r'-- (%f, %f);'%(
-                        xscale*((1.0 - u)*xvals[i] + u*xvals[i+1] - xbase),
-                        yscale*((1.0 - u)*yvals[i] + u*yvals[i+1] - ybase))
-                    s += '\n'
-
-        if symbol is None:
-            if draw_on:
-                s += ';\n'
-
-    if symbol == 'circle':
-        for i in range(n):
-            if ((xvals[i] >= xmin and xvals[i] <= xmax) and
-                (yvals[i] >= ymin and yvals[i] <= ymax)):
-                s += r'\draw[%s, color=%s, fill=%s] (%f, %f) circle (%g);'%(
-                    symbol_dim, color, fill_color,
-                    xscale*(xvals[i] - xbase),
-                    yscale*(yvals[i] - ybase), 0.5*symbol_size)
-    elif symbol == 'square':
-        for i in range(n):
-            if ((xvals[i] >= xmin and xvals[i] <= xmax) and
-                (yvals[i] >= ymin and yvals[i] <= ymax)):
-                s += r'\draw[%s, color=%s, fill=%s] (%f, %f) rectangle (%f, %f);'%(
-                    symbol_dim, color, fill_color,
-                    xscale*(xvals[i] - xbase) - 0.5*symbol_size,
-                    yscale*(yvals[i] - ybase) - 0.5*symbol_size,
-                    xscale*(xvals[i] - xbase) + 0.5*symbol_size,
-                    yscale*(yvals[i] - ybase) + 0.5*symbol_size)
-    elif symbol == 'triangle':
-        for i in range(n):
-            if ((xvals[i] >= xmin and xvals[i] <= xmax) and
-                (yvals[i] >= ymin and yvals[i] <= ymax)):
-                s += r'\draw[%s, color=%s, fill=%s] (%f,%f) '%(
-                    symbol_dim, color, fill_color,
-                    xscale*(xvals[i] - xbase) - 0.45*symbol_size,
-                    yscale*(yvals[i] - ybase) - 0.5*symbol_size)
-                s += '-- (%f,%f) -- (%f,%f) -- cycle;\n'%(
-                    xscale*(xvals[i] - xbase) + 0.45*symbol_size,
-                    yscale*(yvals[i] - ybase) - 0.5*symbol_size,
-                    xscale*(xvals[i] - xbase),
-                    yscale*(yvals[i] - ybase) + 0.5*symbol_size)
-    elif symbol == 'delta':
-        for i in range(n):
-            if ((xvals[i] >= xmin and xvals[i] <= xmax) and
-                (yvals[i] >= ymin and yvals[i] <= ymax)):
-                s += r'\draw[%s, color=%s, fill=%s] (%f,%f) '%(
-                    symbol_dim, color, fill_color,
-                    xscale*(xvals[i] - xbase) - 0.45*symbol_size,
-                    yscale*(yvals[i] - ybase) + 0.5*symbol_size)
-                s += '-- (%f,%f) -- (%f,%f) -- cycle;\n'%(
-                    xscale*(xvals[i] - xbase) + 0.45*symbol_size,
-                    yscale*(yvals[i] - ybase) + 0.5*symbol_size,
-                    xscale*(xvals[i] - xbase),
-                    yscale*(yvals[i] - ybase) - 0.5*symbol_size)
-    elif symbol == 'diamond':
-        for i in range(n):
-            if ((xvals[i] >= xmin and xvals[i] <= xmax) and
-                (yvals[i] >= ymin and yvals[i] <= ymax)):
-                s += r'\draw[%s, color=%s, fill=%s] (%f,%f) '%(
-                    symbol_dim, color, fill_color,
-                    xscale*(xvals[i] - xbase) - 0.5*symbol_size,
-                    yscale*(yvals[i] - ybase))
-                s += '-- (%f,%f) -- (%f,%f) -- (%f,%f) -- cycle;\n'%(
-                    xscale*(xvals[i] - xbase),
-                    yscale*(yvals[i] - ybase) - 0.5*symbol_size,
-                    xscale*(xvals[i] - xbase) + 0.5*symbol_size,
-                    yscale*(yvals[i] - ybase),
-                    xscale*(xvals[i] - xbase),
-                    yscale*(yvals[i] - ybase) + 0.5*symbol_size)
-
-    return s
-
-def get_bar_chart(bars, color_list=None, x_sep=0.25,
-                  xmin=None, xmax=None, ymin=None, ymax=None,
-                  line_dim='thick', xscale=1.0, xbase=0.0,
-                  yscale=1, ybase=0.0,
-                  bar_width=None, bar_offset=None):
-    """Get the string for a bar chart"""
+def _get_bar_array(bars):
+    """
+    Convert the bar data to a masked 2D array with one row per group
+
+    The bars can be a 2D array, a masked array or a list of rows with
+    different lengths. A 1D array or a list of numbers is a single series,
+    with one bar in each group. Missing and non-finite entries are masked.
+    Returns the array and the number of bars in each group.
+    """
+
+    if isinstance(bars, np.ndarray):
+        data = np.ma.masked_invalid(np.ma.asarray(bars, dtype=float))
+        if data.ndim == 1:
+            data = data.reshape(-1, 1)
+        elif data.ndim != 2:
+            raise ValueError('The bars must be a 1D or 2D array')
+        return data, np.full(data.shape[0], data.shape[1])
+
+    rows = [np.ma.asarray(row, dtype=float).ravel() for row in bars]
+    counts = np.array([len(row) for row in rows], dtype=int)
+    ncols = max(counts.max(), 1) if len(rows) > 0 else 1
+    data = np.ma.masked_all((len(rows), ncols))
+    for i, row in enumerate(rows):
+        data[i, :len(row)] = row
+    return np.ma.masked_invalid(data), counts
+
+def write_bar_chart(fp, bars, color_list=None, x_sep=0.25,
+                    xmin=None, xmax=None, ymin=None, ymax=None,
+                    line_dim='thick', xscale=1.0, xbase=0.0,
+                    yscale=1, ybase=0.0,
+                    bar_width=None, bar_offset=None, stacked=False,
+                    precision=None):
+    """
+    Write a bar chart
+
+    The bars are given as a 2D array with one row per group and one
+    column per series. A masked array or a list of rows with different
+    lengths can also be used, and a 1D array or a list of numbers draws
+    one bar in each group. The bars start at ymin, or at zero if ymin is
+    not specified, so negative values are drawn downward. With
+    stacked=True the series in each group are stacked on top of each
+    other in a single bar.
+    """
+
+    data, counts = _get_bar_array(bars)
+    ngroups, ncols = data.shape
+    if ngroups == 0:
+        return
 
     if color_list is None:
-        color_list = len(bars[0])*['black']
+        color_list = ncols*['black']
 
-    s = ''
-    for i in range(len(bars)):
-        if bar_width is None:
-            bw = (1.0 - x_sep)/len(bars[i])
+    # Compute the width of the bars in each group
+    if stacked:
+        counts = np.ones(ngroups, dtype=int)
+    if bar_width is None:
+        bw = (1.0 - x_sep)/np.maximum(counts, 1)
+    else:
+        bw = np.full(ngroups, float(bar_width))
+
+    boff = 0.0
+    if bar_offset is not None:
+        boff = bar_offset
+
+    # Compute the corners of all the bars at once
+    group = np.arange(1, ngroups + 1, dtype=float)[:, np.newaxis]
+    bw = bw[:, np.newaxis]
+    if stacked:
+        col = np.zeros((1, ncols))
+    else:
+        col = np.arange(ncols, dtype=float)[np.newaxis, :]
+    x1 = group + boff + (col + 0.05)*bw
+    x2 = group + boff + (col + 0.95)*bw
+
+    base = 0.0
+    if ymin is not None:
+        base = ymin
+    vals = data.filled(0.0)
+    if stacked:
+        y2 = base + np.cumsum(vals, axis=1)
+        y1 = y2 - vals
+    else:
+        y1 = np.full(vals.shape, float(base))
+        y2 = vals
+    x1, x2, y1, y2 = np.broadcast_arrays(x1, x2, y1, y2)
+
+    # Clamp the bars to the box
+    if xmin is not None:
+        x1 = np.maximum(x1, xmin)
+        x2 = np.maximum(x2, xmin)
+    if xmax is not None:
+        x1 = np.minimum(x1, xmax)
+        x2 = np.minimum(x2, xmax)
+    if ymin is not None:
+        y1 = np.maximum(y1, ymin)
+        y2 = np.maximum(y2, ymin)
+    if ymax is not None:
+        y1 = np.minimum(y1, ymax)
+        y2 = np.minimum(y2, ymax)
+
+    # Only draw the bars that are present and have a visible height
+    draw = ~np.ma.getmaskarray(data) & (y2 != y1)
+    if not stacked:
+        draw &= np.arange(ncols)[np.newaxis, :] < counts[:, np.newaxis]
+    gi, cj = np.nonzero(draw)
+    if len(gi) == 0:
+        return
+
+    coords = _get_coord_strings(np.column_stack((
+        xscale*(x1[gi, cj] - xbase), yscale*(y1[gi, cj] - ybase),
+        xscale*(x2[gi, cj] - xbase), yscale*(y2[gi, cj] - ybase))), precision)
+
+    heads = [(r'\draw[%s, color=%s, fill=%s, fill opacity=0.3]'%(
+        line_dim, c, c)).replace('%', '%%') for c in color_list]
+    fmt = ''.join([heads[j] + ' (%s, %s) rectangle (%s, %s);'
+                   for j in cj.tolist()])
+    fp.write(fmt%tuple(coords))
+
+@_get_string_signature(write_bar_chart)
+def get_bar_chart(*args, **kwargs):
+    """Get the string for a bar chart"""
+    return _get_string(write_bar_chart, *args, **kwargs)
+
+def _get_nice_number(x, round_number=True):
+    """Get a number of the form 1, 2 or 5 times a power of ten close to x"""
+    exponent = np.floor(np.log10(x))
+    f = x/10.0**exponent
+    if round_number:
+        nice = 1.0 if f < 1.5 else 2.0 if f < 3.0 else 5.0 if f < 7.0 else 10.0
+    else:
+        nice = 1.0 if f <= 1.0 else 2.0 if f <= 2.0 else 5.0 if f <= 5.0 else 10.0
+    return nice*10.0**exponent
+
+def get_nice_ticks(vmin, vmax, nticks=5):
+    """
+    Get about nticks evenly spaced tick locations between vmin and vmax
+
+    The spacing is 1, 2 or 5 times a power of ten and the ticks are
+    rounded to the number of decimal places of the spacing.
+    """
+    if not vmax > vmin:
+        return [vmin]
+
+    span = _get_nice_number(vmax - vmin, False)
+    step = _get_nice_number(span/max(nticks - 1, 1), True)
+    first = np.ceil(vmin/step - 1e-10)
+    last = np.floor(vmax/step + 1e-10)
+    decimals = max(0, int(-np.floor(np.log10(step))))
+    ticks = np.round(step*np.arange(first, last + 1), decimals) + 0.0
+    return ticks.tolist()
+
+def get_tick_labels(ticks):
+    """Get the labels for the tick locations"""
+    return ['%g'%(tick) for tick in ticks]
+
+def get_log_ticks(vmin, vmax, log=True, linthresh=1.0):
+    """
+    Get the decade ticks between vmin and vmax on a log or symlog axis
+
+    On a symlog axis, the ticks are placed at zero and at the decades
+    outside of the linear threshold. On a log axis, both limits must be
+    positive.
+    """
+    def decades(a, b):
+        lo = int(np.ceil(np.log10(a) - 1e-10))
+        hi = int(np.floor(np.log10(b) + 1e-10))
+        return [10.0**k for k in range(lo, hi + 1)]
+
+    if log == 'symlog':
+        ticks = []
+        if vmin < -linthresh:
+            ticks.extend([-t for t in decades(max(linthresh, -vmax), -vmin)[::-1]])
+        if vmin <= 0.0 <= vmax:
+            ticks.append(0.0)
+        if vmax > linthresh:
+            ticks.extend(decades(max(linthresh, vmin), vmax))
+        return ticks
+
+    if not (vmin > 0.0 and vmax > 0.0):
+        raise ValueError('The limits of a log axis must be positive to place '
+                         'the ticks, got %g and %g'%(vmin, vmax))
+    return decades(vmin, vmax)
+
+def get_log_tick_labels(ticks):
+    """Get the labels of the decade ticks as powers of ten"""
+    labels = []
+    for tick in ticks:
+        if tick == 0.0:
+            labels.append('$0$')
         else:
-            bw = bar_width
-
-        boff = 0.0
-        if bar_offset is not None:
-            boff = bar_offset
-
-        for j in range(len(bars[i])):
-            x1 = (i+1) + boff + (j+0.05)*bw
-            x2 = (i+1) + boff + (j+0.95)*bw
-            if xmin is not None:
-                x1 = max(x1, xmin)
-                x2 = max(x2, xmin)
-            if xmax is not None:
-                x1 = min(x1, xmax)
-                x2 = min(x2, xmax)
-
-            y1 = ymin
-            y2 = bars[i][j]
-            if ymin is not None:
-                y1 = max(y1, ymin)
-                y2 = max(y2, ymin)
-            if ymax is not None:
-                y1 = min(y1, ymax)
-                y2 = min(y2, ymax)
-
-            if y2 > ymin:
-                s += r'\draw[%s, color=%s, fill=%s, fill opacity=0.3]'%(
-                    line_dim, color_list[j], color_list[j])
-                s += ' (%f, %f) rectangle (%f, %f);'%(
-                    xscale*(x1 - xbase), yscale*(y1 - ybase),
-                    xscale*(x2 - xbase), yscale*(y2 - ybase))
-
-    return s
-
-def get_2d_axes(xmin, xmax, ymin, ymax,
-                axis_style='r-style',
-                xscale=1.0, xbase=0.0, yscale=1.0, ybase=0.0,
-                xticks=[], yticks=[],
-                xtick_labels=None, ytick_labels=None,
-                tick_font='normalsize', tick_size='semithick',
-                label_font='Large', xlabel='x', ylabel='y',
-                xlabel_offset=0.1, ylabel_offset=0.15,
-                axis_size='thick', axis_color='gray',
-                tick_frac=0.05, ):
-    """Draw the axes on the plot"""
+            sign = '-' if tick < 0.0 else ''
+            labels.append('$%s10^{%d}$'%(sign, int(round(np.log10(abs(tick))))))
+    return labels
+
+def _write_2d_axes(fp, xmin, xmax, ymin, ymax, axis_style,
+                   xscale, xbase, yscale, ybase, xticks, yticks,
+                   xtick_labels, ytick_labels, tick_font, tick_size,
+                   label_font, xlabel, ylabel, xlabel_offset, ylabel_offset,
+                   axis_size, axis_color, tick_frac, precision):
+    """Write the axes with all the arguments given explicitly"""
 
     # Find the tick size
     tick_dim = min(tick_frac*(ymax - ymin)*yscale,
                    tick_frac*(xmax - xmin)*xscale)
 
     # Draw the axes
-    s = ''
     if axis_style == 'r-style':
         if len(xticks) >= 2:
-            s += '\\draw[%s, color=%s] (%f, %f) -- (%f,%f) -- (%f,%f) -- (%f, %f);'%(
+            fp.write(_format_coords('\\draw[%s, color=%s] (%f, %f) -- (%f,%f) -- (%f,%f) -- (%f, %f);', (
                 axis_size, axis_color,
                 xscale*(xticks[0] - xbase),
                 yscale*(ymin - ybase) - tick_dim,
                 xscale*(xticks[0] - xbase), yscale*(ymin - ybase),
                 xscale*(xticks[-1] - xbase), yscale*(ymin - ybase),
-                xscale*(xticks[-1] - xbase), yscale*(ymin - ybase) - tick_dim)
+                xscale*(xticks[-1] - xbase), yscale*(ymin - ybase) - tick_dim), precision))
         if len(yticks) >= 2:
-            s += '\\draw[%s, color=%s] (%f, %f) -- (%f,%f) -- (%f,%f) -- (%f, %f);'%(
+            fp.write(_format_coords('\\draw[%s, color=%s] (%f, %f) -- (%f,%f) -- (%f,%f) -- (%f, %f);', (
                 axis_size, axis_color,
                 xscale*(xmin - xbase) - tick_dim, yscale*(yticks[0] - ybase),
                 xscale*(xmin - xbase), yscale*(yticks[0] - ybase),
                 xscale*(xmin - xbase), yscale*(yticks[-1] - ybase),
-                xscale*(xmin - xbase) - tick_dim, yscale*(yticks[-1] - ybase))
+                xscale*(xmin - xbase) - tick_dim, yscale*(yticks[-1] - ybase)), precision))
     else:
-        s += '\\draw[%s, color=%s] (%f,%f) -- (%f,%f);'%(
+        fp.write(_format_coords('\\draw[%s, color=%s] (%f,%f) -- (%f,%f);', (
             axis_size, axis_color,
             xscale*(xmin - xbase), yscale*(ymin - ybase),
-            xscale*(xmax - xbase), yscale*(ymin - ybase))
-        s += '\\draw[%s, color=%s] (%f,%f) -- (%f,%f);'%(
+            xscale*(xmax - xbase), yscale*(ymin - ybase)), precision))
+        fp.write(_format_coords('\\draw[%s, color=%s] (%f,%f) -- (%f,%f);', (
             axis_size, axis_color,
             xscale*(xmin - xbase), yscale*(ymin - ybase),
-            xscale*(xmin - xbase), yscale*(ymax - ybase))
+            xscale*(xmin - xbase), yscale*(ymax - ybase)), precision))
 
     # Draw the x-label
     if xlabel is not None:
-        s += '\\draw[font=\\%s] (%f, %f) node[below] {%s};'%(
+        fp.write(_format_coords('\\draw[font=\\%s] (%f, %f) node[below] {%s};', (
             label_font, 0.5*xscale*(xmin + xmax - xbase),
             yscale*(ymin - xlabel_offset*(ymax - ymin) - ybase),
-            xlabel)
+            xlabel), precision))
 
     # Draw the y-label
     if ylabel is not None:
-        s += '\\draw[font=\\%s] (%f, %f) node[rotate=90] {%s};'%(
+        fp.write(_format_coords('\\draw[font=\\%s] (%f, %f) node[rotate=90] {%s};', (
             label_font, xscale*(xmin - ylabel_offset*(xmax - xmin) - xbase),
             0.5*yscale*(ymin + ymax - ybase),
-            ylabel)
+            ylabel), precision))
 
-    # Draw the ticks on the graph
+    # The r-style ticks point out from the axes, the others point in
     if axis_style == 'r-style':
-        if xtick_labels is None:
-            for i in range(len(xticks)):
-                s += '\\draw[font=\\%s, %s, color=%s, text=black] '%(
-                    tick_font, tick_size, axis_color)
-                s += '(%f, %f) -- (%f, %f) node[below] {%g};\n'%(
-                    xscale*(xticks[i] - xbase), yscale*(ymin - ybase),
-                    xscale*(xticks[i] - xbase), yscale*(ymin - ybase) - tick_dim,
-                    xticks[i])
-        else:
-            for i in range(len(xticks)):
-                s += '\\draw[font=\\%s, %s, color=%s, text=black] '%(
-                    tick_font, tick_size, axis_color)
-                s += '(%f, %f) -- (%f, %f) node[below] {%s};\n'%(
-                    xscale*(xticks[i] - xbase), yscale*(ymin - ybase),
-                    xscale*(xticks[i] - xbase), yscale*(ymin - ybase) - tick_dim,
-                    xtick_labels[i])
-
-        # Draw the ticks on the graph
-        if ytick_labels is None:
-            for i in range(len(yticks)):
-                s += '\\draw[font=\\%s, %s, color=%s, text=black] '%(
-                    tick_font, tick_size, axis_color)
-                s += '(%f, %f) -- (%f, %f) node[left] {%g};\n'%(
-                    xscale*(xmin - xbase), yscale*(yticks[i] - ybase),
-                    xscale*(xmin - xbase) - tick_dim, yscale*(yticks[i] - ybase),
-                    yticks[i])
-        else:
-            for i in range(len(yticks)):
-                s += '\\draw[font=\\%s, %s, color=%s, text=black] '%(
-                    tick_font, tick_size, axis_color)
-                s += '(%f, %f) -- (%f, %f) node[left] {%s};\n'%(
-                    xscale*(xmin - xbase), yscale*(yticks[i] - ybase),
-                    xscale*(xmin - xbase) - tick_dim, yscale*(yticks[i] - ybase),
-                    ytick_labels[i])
+        tick_dir = -1.0
     else:
-        if xtick_labels is None:
-            for i in range(len(xticks)):
-                s += '\\draw[font=\\%s, %s, color=%s, text=black] '%(
-                    tick_font, tick_size, axis_color)
-                s += '(%f, %f) -- (%f, %f) node[below] {%g};\n'%(
-                    xscale*(xticks[i] - xbase), yscale*(ymin - ybase) + tick_dim,
-                    xscale*(xticks[i] - xbase), yscale*(ymin - ybase),
-                    xticks[i])
+        tick_dir = 1.0
+
+    # Draw all the ticks on each axis with a single path
+    head = '\\draw[font=\\%s, %s, color=%s, text=black]'%(
+        tick_font, tick_size, axis_color)
+    for ticks, labels, node in [(xticks, xtick_labels, 'below'),
+                                (yticks, ytick_labels, 'left')]:
+        if len(ticks) == 0:
+            continue
+        if labels is None:
+            labels = get_tick_labels(ticks)
+
+        t = np.array(ticks, dtype=float)
+        if node == 'below':
+            px = xscale*(t - xbase)
+            py = np.full(len(t), yscale*(ymin - ybase))
+            x1, y1, x2, y2 = px, py, px, py + tick_dir*tick_dim
         else:
-            for i in range(len(xticks)):
-                s += '\\draw[font=\\%s, %s, color=%s, text=black] '%(
-                    tick_font, tick_size, axis_color)
-                s += '(%f, %f) -- (%f, %f) node[below] {%s};\n'%(
-                    xscale*(xticks[i] - xbase), yscale*(ymin - ybase) + tick_dim,
-                    xscale*(xticks[i] - xbase), yscale*(ymin - ybase),
-                    xtick_labels[i])
-
-        # Draw the ticks on the graph
-        if ytick_labels is None:
-            for i in range(len(yticks)):
-                s += '\\draw[font=\\%s, %s, color=%s, text=black] '%(
-                    tick_font, tick_size, axis_color)
-                s += '(%f, %f) -- (%f, %f) node[left] {%g};\n'%(
-                    xscale*(xmin - xbase) + tick_dim, yscale*(yticks[i] - ybase),
-                    xscale*(xmin - xbase), yscale*(yticks[i] - ybase),
-                    yticks[i])
-        else:
-            for i in range(len(yticks)):
-                s += '\\draw[font=\\%s, %s, color=%s, text=black] '%(
-                    tick_font, tick_size, axis_color)
-                s += '(%f, %f) -- (%f, %f) node[left] {%s};\n'%(
-                    xscale*(xmin - xbase) + tick_dim, yscale*(yticks[i] - ybase),
-                    xscale*(xmin - xbase), yscale*(yticks[i] - ybase),
-                    ytick_labels[i])
-
-    return s
-
-def get_legend_entry(x, y, length, xscale=1.0, xbase=0.0,
-                     yscale=1.0, ybase=0.0,
-                     font_size='large',
-                     line_dim='thick', color='black',
-                     symbol=None, symbol_dim='thin',
-                     symbol_size=0.15, label=''):
+            px = np.full(len(t), xscale*(xmin - xbase))
+            py = yscale*(t - ybase)
+            x1, y1, x2, y2 = px, py, px + tick_dir*tick_dim, py
+        if tick_dir > 0.0:
+            x1, y1, x2, y2 = x2, y2, x1, y1
+
+        coords = _get_coord_strings(np.column_stack((x1, y1, x2, y2)),
+                                    precision)
+        fmt = ''.join([' (%s, %s) -- (%s, %s) node[' + node + '] {%s}']*len(t))
+        args = []
+        for i in range(len(t)):
+            args.extend(coords[4*i:4*i+4])
+            args.append(labels[i])
+        fp.write(head + fmt%tuple(args) + ';\n')
+
+@functools.lru_cache(maxsize=128)
+def _get_cached_2d_axes(*args):
+    """Get the string for the axes, reusing it for identical arguments"""
+    return _get_string(_write_2d_axes, *args)
+
+def write_2d_axes(fp, xmin, xmax, ymin, ymax,
+                  axis_style='r-style',
+                  xscale=1.0, xbase=0.0, yscale=1.0, ybase=0.0,
+                  xticks=None, yticks=None,
+                  xtick_labels=None, ytick_labels=None,
+                  tick_font='normalsize', tick_size='semithick',
+                  label_font='Large', xlabel='x', ylabel='y',
+                  xlabel_offset=0.1, ylabel_offset=0.15,
+                  axis_size='thick', axis_color='gray',
+                  tick_frac=0.05, precision=None, nticks=5,
+                  xlog=False, ylog=False, linthresh=1.0):
+    """
+    Draw the axes on the plot
+
+    The xticks and yticks are the tick locations, or 'auto' to place
+    about nticks ticks between the limits with get_nice_ticks. The
+    labels are found with get_tick_labels unless they are given. The
+    output is cached, so axes with the same limits and options that are
+    drawn many times are only formatted once.
+
+    With xlog or ylog (see write_2d_plot), the limits and ticks are given
+    in the data units and 'auto' places the ticks at the decades, which
+    are labeled as powers of ten. The ticks at or below zero are dropped
+    on a log axis, and a lower limit at or below zero is moved to the
+    first tick. With 'auto' and a lower limit at or below zero, the ticks
+    are the nticks decades up to the upper limit.
+    """
+
+    def get_ticks(ticks, labels, vmin, vmax, log):
+        transform = _get_axis_transform(log, linthresh)
+        if ticks is None:
+            return (), None
+        if isinstance(ticks, str) and ticks == 'auto':
+            if log:
+                if log != 'symlog' and vmin <= 0.0 < vmax:
+                    # Use the decades up to the upper limit
+                    vmin = 10.0**(np.floor(np.log10(vmax)) - nticks + 1)
+                ticks = get_log_ticks(vmin, vmax, log, linthresh)
+                if labels is None:
+                    labels = get_log_tick_labels(ticks)
+            else:
+                ticks = get_nice_ticks(vmin, vmax, nticks)
+        if transform is not None:
+            # Label the ticks with their values before they are mapped
+            if labels is None:
+                labels = get_tick_labels(ticks)
+            ticks = transform(ticks)
+            keep = np.isfinite(ticks)
+            ticks = ticks[keep]
+            labels = [label for label, k in zip(labels, keep) if k]
+        if labels is not None:
+            labels = tuple(str(label) for label in labels)
+        return tuple(float(tick) for tick in ticks), labels
+
+    def get_limits(vmin, vmax, ticks, log):
+        vmin, vmax = _transform_limits(_get_axis_transform(log, linthresh),
+                                       vmin, vmax)
+        if vmin is None:
+            if len(ticks) == 0:
+                raise ValueError('The lower limit of a log axis must be '
+                                 'positive when there are no ticks')
+            vmin = min(ticks)
+        return vmin, vmax
+
+    if precision is None:
+        precision = _precision
+
+    xticks, xtick_labels = get_ticks(xticks, xtick_labels, xmin, xmax, xlog)
+    yticks, ytick_labels = get_ticks(yticks, ytick_labels, ymin, ymax, ylog)
+    xmin, xmax = get_limits(xmin, xmax, xticks, xlog)
+    ymin, ymax = get_limits(ymin, ymax, yticks, ylog)
+
+    fp.write(_get_cached_2d_axes(
+        float(xmin), float(xmax), float(ymin), float(ymax), axis_style,
+        float(xscale), float(xbase), float(yscale), float(ybase),
+        xticks, yticks, xtick_labels, ytick_labels,
+        tick_font, tick_size, label_font, xlabel, ylabel,
+        xlabel_offset, ylabel_offset, axis_size, axis_color, tick_frac,
+        precision))
+
+@_get_string_signature(write_2d_axes)
+def get_2d_axes(*args, **kwargs):
+    """Get the string that draws the axes on the plot"""
+    return _get_string(write_2d_axes, *args, **kwargs)
+
+def write_legend_entry(fp, x, y, length, xscale=1.0, xbase=0.0,
+                       yscale=1.0, ybase=0.0,
+                       font_size='large',
+                       line_dim='thick', color='black',
+                       symbol=None, symbol_dim='thin',
+                       symbol_size=0.15, label='', precision=None,
+                       style=None, symbol_style=None):
     """Add a single entry to the legend"""
 
     # Plot a line segment
     xvals = [x - 0.5*length, x + 0.5*length]
     yvals = [y, y]
 
-    s = get_2d_plot(xvals, yvals, xscale=xscale, xbase=xbase,
-                    yscale=yscale, ybase=ybase,
-                    line_dim=line_dim, color=color,
-                    symbol=symbol, symbol_dim=symbol_dim,
-                    symbol_size=symbol_size)
+    write_2d_plot(fp, xvals, yvals, xscale=xscale, xbase=xbase,
+                  yscale=yscale, ybase=ybase,
+                  line_dim=line_dim, color=color,
+                  symbol=symbol, symbol_dim=symbol_dim,
+                  symbol_size=symbol_size, precision=precision,
+                  style=style, symbol_style=symbol_style)
+
+    fp.write(_format_coords('\\draw[font=\\%s] (%f,%f) node[right] {%s};', (
+        font_size, xscale*(x + 0.75*length), yscale*y, label), precision))
+
+@_get_string_signature(write_legend_entry)
+def get_legend_entry(*args, **kwargs):
+    """Get the string for a single entry in the legend"""
+    return _get_string(write_legend_entry, *args, **kwargs)
+
+class Axes(object):
+    """
+    A set of plots that share the same view box and transformation
+
+    The plotting methods only record the data, and the contour lines are
+    found when the figure is written. The limits that are not specified
+    are found from all the recorded data, or the grid or mesh of a contour
+    plot, and the series are then drawn in the order they were added.
+    """
 
-    s += '\\draw[font=\\%s] (%f,%f) node[right] {%s};'%(
-        font_size, xscale*(x + 0.75*length), yscale*y, label)
+    def __init__(self, figure, xmin=None, xmax=None, ymin=None, ymax=None,
+                 xscale=1.0, xbase=0.0, yscale=1.0, ybase=0.0,
+                 xlog=False, ylog=False, linthresh=1.0):
+        self.figure = figure
+        self.xlog = xlog
+        self.ylog = ylog
+        self.linthresh = linthresh
+        self.xmin = xmin
+        self.xmax = xmax
+        self.ymin = ymin
+        self.ymax = ymax
+        self.xscale = xscale
+        self.xbase = xbase
+        self.yscale = yscale
+        self.ybase = ybase
+        self.series = []
+        self.axes_options = None
+
+    def plot(self, xvals, yvals, line_dim='thick', color='black',
+             symbol=None, symbol_dim='thin', fill_color='white', **kwargs):
+        """Add a line plot, see write_2d_plot for the other options"""
+        style = self.figure.get_style('%s, color=%s'%(
+            line_dim, self.figure.get_color(color)))
+        symbol_style = None
+        if symbol is not None:
+            symbol_style = self.figure.get_style('%s, color=%s, fill=%s'%(
+                symbol_dim, self.figure.get_color(color),
+                self.figure.get_color(fill_color)))
+        kwargs.update(line_dim=line_dim, symbol=symbol, style=style,
+                      symbol_style=symbol_style)
+        self.series.append((write_2d_plot, (xvals, yvals), kwargs,
+                            (xvals, yvals)))
+
+    def scatter(self, xvals, yvals, color='black', fill_color='white',
+                symbol_dim='thin', **kwargs):
+        """Add a scatter plot, see write_2d_scatter_plot"""
+        color = self.figure.get_color(color)
+        symbol_style = None
+        if kwargs.get('mode', 'cull') != 'density':
+            symbol_style = self.figure.get_style('%s, color=%s, fill=%s'%(
+                symbol_dim, color, self.figure.get_color(fill_color)))
+        kwargs.update(color=color, symbol_dim=symbol_dim,
+                      symbol_style=symbol_style)
+        self.series.append((write_2d_scatter_plot, (xvals, yvals), kwargs,
+                            (xvals, yvals)))
+
+    def contour(self, X, Y, F, levs, lev_colors=None, line_dim='thick',
+                **kwargs):
+        """Add a contour plot of the data on a structured grid"""
+        styles = self._get_contour_styles(levs, lev_colors, line_dim)
+        kwargs.update(line_dim=line_dim)
+        self.series.append((self._write_contour_lines,
+                            (_get_2d_grid_contour_level_lines,
+                             (X, Y, F, levs), styles), kwargs, (X, Y)))
+
+    def tri_contour(self, x, y, vals, tris, levs, lev_colors=None,
+                    line_dim='thick', **kwargs):
+        """Add a contour plot of the data on a triangle mesh or TriMesh"""
+        if isinstance(tris, TriMesh):
+            mesh = tris
+        else:
+            mesh = TriMesh(x, y, tris)
+        styles = self._get_contour_styles(levs, lev_colors, line_dim)
+        kwargs.update(line_dim=line_dim)
+        self.series.append((self._write_contour_lines,
+                            (self._get_tri_level_lines,
+                             (mesh, vals, levs), styles), kwargs,
+                            (mesh.x, mesh.y)))
+
+    def _get_contour_styles(self, levs, lev_colors, line_dim):
+        if lev_colors is None or len(lev_colors) != len(levs):
+            lev_colors = ['black']*len(levs)
+        return [self.figure.get_style('%s, color=%s'%(
+            line_dim, self.figure.get_color(color))) for color in lev_colors]
+
+    @staticmethod
+    def _get_tri_level_lines(mesh, vals, levs):
+        return _get_2d_tri_contour_level_lines(
+            mesh.x, mesh.y, vals, mesh.tris, mesh.edges, mesh.tri_to_edges,
+            mesh.edge_to_tris, levs)
+
+    @staticmethod
+    def _write_contour_lines(fp, get_level_lines, args, styles, **kwargs):
+        """Find the contour lines and write them with the level styles"""
+        level_lines = get_level_lines(*args)
+        for style, lines in zip(styles, level_lines):
+            for line in lines:
+                write_2d_plot(fp, line[0], line[1], style=style, **kwargs)
+
+    def legend_entry(self, x, y, length, line_dim='thick', color='black',
+                     symbol=None, symbol_dim='thin', fill_color='white',
+                     **kwargs):
+        """Add a legend entry, see write_legend_entry"""
+        style = self.figure.get_style('%s, color=%s'%(
+            line_dim, self.figure.get_color(color)))
+        symbol_style = None
+        if symbol is not None:
+            symbol_style = self.figure.get_style('%s, color=%s, fill=%s'%(
+                symbol_dim, self.figure.get_color(color),
+                self.figure.get_color(fill_color)))
+        kwargs.update(line_dim=line_dim, symbol=symbol, style=style,
+                      symbol_style=symbol_style)
+        self.series.append((write_legend_entry, (x, y, length), kwargs,
+                            None))
+
+    def set_axes(self, **kwargs):
+        """Draw the axes, see write_2d_axes for the options"""
+        self.axes_options = kwargs
+
+    def get_limits(self):
+        """
+        Get the view box, using the data for the unspecified limits
+
+        An axis without any data to show uses the limits (0, 1), or (1, 10)
+        on a log axis.
+        """
+        limits = [self.xmin, self.xmax, self.ymin, self.ymax]
+        if any(lim is None for lim in limits):
+            data = [d for func, args, kwargs, d in self.series
+                    if d is not None]
+            xs = [np.asarray(d[0], dtype=float).ravel() for d in data]
+            ys = [np.asarray(d[1], dtype=float).ravel() for d in data]
+            xs = np.concatenate(xs + [[np.nan]])
+            ys = np.concatenate(ys + [[np.nan]])
+
+            # Only the positive values can be shown on a log axis
+            if self.xlog is True:
+                xs[xs <= 0.0] = np.nan
+            if self.ylog is True:
+                ys[ys <= 0.0] = np.nan
+
+            found = []
+            for vals, log in [(xs, self.xlog), (ys, self.ylog)]:
+                vals = vals[np.isfinite(vals)]
+                if len(vals) > 0:
+                    found.extend([np.min(vals), np.max(vals)])
+                elif log is True:
+                    found.extend([1.0, 10.0])
+                else:
+                    found.extend([0.0, 1.0])
+            limits = [f if lim is None else lim for lim, f in zip(limits, found)]
+        return limits
+
+    def write(self, fp, precision=None):
+        """Write all the series and the axes"""
+        xmin, xmax, ymin, ymax = self.get_limits()
+        transform = dict(xscale=self.xscale, xbase=self.xbase,
+                         yscale=self.yscale, ybase=self.ybase,
+                         xlog=self.xlog, ylog=self.ylog,
+                         linthresh=self.linthresh)
+        box = dict(xmin=xmin, xmax=xmax, ymin=ymin, ymax=ymax)
+
+        for func, args, kwargs, data in self.series:
+            options = dict(transform)
+            options['precision'] = precision
+            if func is write_legend_entry:
+                # Legend entries are placed in the log coordinates
+                for key in ['xlog', 'ylog', 'linthresh']:
+                    options.pop(key)
+            else:
+                options.update(box)
+            options.update(kwargs)
+            func(fp, *args, **options)
+
+        if self.axes_options is not None:
+            options = dict(transform)
+            options['precision'] = precision
+            options.update(self.axes_options)
+            write_2d_axes(fp, xmin, xmax, ymin, ymax, **options)
+
+class Figure(object):
+    """
+    A figure that records its axes and writes the document in one pass
+
+    The line and symbol options that are used by several series are
+    defined once with \\tikzset and referred to by name, and the RGB
+    colors are defined once with a ColorRegistry.
+    """
 
-    return s
+    def __init__(self, xdim=1.0, ydim=1.0, xunit='cm', yunit='cm',
+                 font_package='helvet', use_sf=True, precision=None):
+        self.xdim = xdim
+        self.ydim = ydim
+        self.xunit = xunit
+        self.yunit = yunit
+        self.font_package = font_package
+        self.use_sf = use_sf
+        self.precision = precision
+        self.axes = []
+        self.styles = {}
+        self.colors = ColorRegistry()
+
+    def add_axes(self, **kwargs):
+        """Add a set of axes, see Axes for the options"""
+        ax = Axes(self, **kwargs)
+        self.axes.append(ax)
+        return ax
+
+    def get_color(self, color):
+        """Get the name of a color, which may be a name or an RGB tuple"""
+        if isinstance(color, str):
+            return color
+        return self.colors.get_name(color)
+
+    def get_style(self, options):
+        """Get the name of the style with the given options"""
+        if options not in self.styles:
+            self.styles[options] = 'tps%d'%(len(self.styles))
+        return self.styles[options]
+
+    def _write_contents(self, fp):
+        """Write the color and style definitions and all the axes"""
+        self.colors.write_definitions(fp)
+        if len(self.styles) > 0:
+            fp.write('\\tikzset{')
+            fp.write(',\n'.join(['%s/.style={%s}'%(name, options)
+                                for options, name in self.styles.items()]))
+            fp.write('}\n')
+        for ax in self.axes:
+            ax.write(fp, precision=self.precision)
+
+    def write_picture(self, fp):
+        """Write the tikzpicture with all the axes"""
+        write_begin_tikz_picture(fp, xdim=self.xdim, ydim=self.ydim,
+                                 xunit=self.xunit, yunit=self.yunit,
+                                 use_sf=self.use_sf)
+        self._write_contents(fp)
+        write_end_tikz_picture(fp)
+
+    def write(self, fp):
+        """Write the complete document"""
+        write_header(fp, font_package=self.font_package)
+        write_begin_tikz(fp, xdim=self.xdim, ydim=self.ydim,
+                         xunit=self.xunit, yunit=self.yunit,
+                         use_sf=self.use_sf)
+        self._write_contents(fp)
+        write_end_tikz(fp)
+
+    def get_string(self):
+        """Get the complete document as a string"""
+        return _get_string(self.write)
+
+    def save(self, filename):
+        """Write the complete document to a file"""
+        with open(filename, 'w') as fp:
+            self.write(fp)